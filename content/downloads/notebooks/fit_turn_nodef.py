@@ -20,62 +20,78 @@ DPI = 300
 WIDECHARTWIDTH = 10
 WIDECHARTHEIGHT = 6
 SAVECHARTS = False
+# 'mcmc' for pymc's Metropolis, or the same model fit by fitting.py: 'nuts', 'chains' (parallel NUTS chains), or
+# 'laplace' (approximate, in seconds)
+FIT_BACKEND = 'mcmc'
+# trace store of a previous fit of this model to warm start from:
+# starting values from its posterior means and step sizes from its spread, with burn-in and draws sized from how
+# well it mixed (see fitting.metropolis_schedule())
+WARM_START = None
 
 
 import nfl_hierarchical_bayes
-from nfl_hierarchical_bayes import data_prep, simulation_pwexp, elapsed_time, REDZONE_PIECE
-
-
-df = pd.read_csv(DATA_DIR + 'pbp-2014-bugfixed.csv')
-df = data_prep.enrich_play_level_df(df)
-df = data_prep.merge_in_game_level_dataset(df, data_prep.GAME_LEVEL_DATASET_2014)
-df = data_prep.calculate_game_score_at_play_start(df)
-df_drive = data_prep.generate_drive_df(df)
-df_drive, teams = data_prep.index_with_team_indexes(df_drive)
-df_drive = data_prep.remove_unexplained_drives(df_drive)
-df_drive = data_prep.enrich_drive_level_df(df_drive)
-
-print 'Dropping %s drives due to their beginning with <30 seconds left in half' % \
-      df_drive[(df_drive.thirty_seconds_drill)].shape[0]
-df_drive = df_drive[~(df_drive.thirty_seconds_drill)]
-
-print 'Dropping %s drives due to the ending with qb kneel' % df_drive[(df_drive.end_qb_kneel)].shape[0]
-df_drive = df_drive[~(df_drive.end_qb_kneel)]
-
-df_pw = data_prep.generate_piecewise_df(df_drive)
-df_counts = data_prep.generate_piecewise_counts_df(df_pw)
-
-observed_drive_deaths_ex_turnover = df_counts.deaths_ex_turnover.values
-observed_exposures = df_counts.exposure_yards.values
-piece_i = df_counts.piece_i.values
-red_zone = (df_counts.piece_i == REDZONE_PIECE).astype(int).values
-not_red_zone = (df_counts.piece_i != REDZONE_PIECE).astype(int).values
-attacking_team = df_counts.i_attacking.values
-defending_team = df_counts.i_defending.values
-defending_team_is_home = df_counts.defending_team_is_home.values
-offense_is_losing_badly = df_counts.offense_losing_badly.astype(int).values
-offense_is_winning_greatly = df_counts.offense_winning_greatly.astype(int).values
-drive_is_two_minute_drill = df_counts.two_minute_drill.astype(int).values
-num_teams = len(df_counts.i_home.unique())
-num_obs = len(drive_is_two_minute_drill)
-num_pieces = len(df_counts.piece_i.unique())
-
-observed_drive_deaths_turnover = df_counts.deaths_turnover.values
-
-g = df_counts.groupby('piece_i')
-baseline_starting_vals = g.deaths_turnover.sum() / g.exposure_yards.sum()
+from nfl_hierarchical_bayes.sufficient_stats import PiecewiseCounts
+from nfl_hierarchical_bayes.likelihood import PiecewisePoissonLikelihood
+from nfl_hierarchical_bayes.posterior import turnover_posterior
+from nfl_hierarchical_bayes.fitting import fit_nuts, fit_chains, fit_laplace, posterior_means, posterior_sds, \
+    metropolis_schedule
+from nfl_hierarchical_bayes.traces import TraceStore, save_trace_store
+from nfl_hierarchical_bayes import data_prep, pipeline, simulation_pwexp, elapsed_time
+
+
+prepped = pipeline.run_pipeline(DATA_DIR + 'pbp-2014-bugfixed.csv', data_prep.GAME_LEVEL_DATASET_2014)
+df_drive, teams, df_counts = prepped['df_drive'], prepped['teams'], prepped['df_counts']
+
+counts = PiecewiseCounts.from_frame(df_counts)
+model_inputs = counts.model_inputs(['piece_i', 'i_attacking', 'defending_team_is_home', 'offense_losing_badly',
+                                     'offense_winning_greatly', 'two_minute_drill'])
+
+observed_drive_deaths_ex_turnover = model_inputs['observed_drive_deaths_ex_turnover']
+observed_exposures = model_inputs['observed_exposures']
+piece_i = model_inputs['piece_i']
+red_zone = model_inputs['red_zone']
+not_red_zone = model_inputs['not_red_zone']
+attacking_team = model_inputs['attacking_team']
+defending_team_is_home = model_inputs['defending_team_is_home']
+offense_is_losing_badly = model_inputs['offense_is_losing_badly']
+offense_is_winning_greatly = model_inputs['offense_is_winning_greatly']
+drive_is_two_minute_drill = model_inputs['drive_is_two_minute_drill']
+num_teams = len(teams)
+num_obs = model_inputs['num_obs']
+num_pieces = model_inputs['num_pieces']
+
+observed_drive_deaths_turnover = model_inputs['observed_drive_deaths_turnover']
+
+baseline_starting_vals = counts.baseline_hazards('deaths_turnover')
+
+STOCHASTICS = ['std_dev_att', 'baseline_hazards', 'two_minute_drill', 'offense_losing_badly', 'offense_winning_greatly',
+               'home', 'atts_star']
+previous = None
+if WARM_START is not None:
+    previous = TraceStore(WARM_START)
+start = posterior_means(previous, STOCHASTICS) if previous is not None else {}
+
+# deaths ~ Poisson(observed_exposures * baseline_hazards[piece_i] * exp(covariates * coefficients + team effects))
+likelihood = PiecewisePoissonLikelihood(observed_drive_deaths_turnover, observed_exposures, piece_i,
+                                        covariates={'home': defending_team_is_home,
+                                                    'two_minute_drill': drive_is_two_minute_drill,
+                                                    'offense_losing_badly': offense_is_losing_badly,
+                                                    'offense_winning_greatly': offense_is_winning_greatly},
+                                        team_effects={'atts': attacking_team})
 
 
 def turnover_piecewise_exponential_model():
     # hyperpriors for team-level distributions
-    std_dev_att = pm.Uniform('std_dev_att', lower=0, upper=50)
+    std_dev_att = pm.Uniform('std_dev_att', lower=0, upper=50, value=start.get('std_dev_att'))
 
     # priors on coefficients
-    baseline_hazards = pm.Normal('baseline_hazards', 0, .0001, size=num_pieces, value=baseline_starting_vals.values)
-    two_minute_drill = pm.Normal('two_minute_drill', 0, .0001, value=-.01)
-    offense_losing_badly = pm.Normal('offense_losing_badly', 0, .0001, value=-.01)
-    offense_winning_greatly = pm.Normal('offense_winning_greatly', 0, .0001, value=.01)
-    home = pm.Normal('home', 0, .0001, value=-.01)
+    baseline_hazards = pm.Normal('baseline_hazards', 0, .0001, size=num_pieces,
+                                 value=start.get('baseline_hazards', baseline_starting_vals))
+    two_minute_drill = pm.Normal('two_minute_drill', 0, .0001, value=start.get('two_minute_drill', -.01))
+    offense_losing_badly = pm.Normal('offense_losing_badly', 0, .0001, value=start.get('offense_losing_badly', -.01))
+    offense_winning_greatly = pm.Normal('offense_winning_greatly', 0, .0001,
+                                        value=start.get('offense_winning_greatly', .01))
+    home = pm.Normal('home', 0, .0001, value=start.get('home', -.01))
 
     @pm.deterministic(plot=False)
     def tau_att(std_dev_att=std_dev_att):
@@ -86,7 +102,7 @@ def turnover_piecewise_exponential_model():
                           mu=0,
                           tau=tau_att,
                           size=num_teams,
-                          value=np.zeros(num_teams))
+                          value=start.get('atts_star', np.zeros(num_teams)))
 
 
     # trick to code the sum to zero contraint
@@ -97,31 +113,17 @@ def turnover_piecewise_exponential_model():
         return atts
 
 
-    @pm.deterministic
-    def lambdas(attacking_team=attacking_team,
-                defending_team=defending_team,
-                defending_team_is_home=defending_team_is_home,
-                two_minute_drill=two_minute_drill,
-                drive_is_two_minute_drill=drive_is_two_minute_drill,
-                offense_losing_badly=offense_losing_badly,
-                offense_is_losing_badly=offense_is_losing_badly,
-                offense_winning_greatly=offense_winning_greatly,
-                offense_is_winning_greatly=offense_is_winning_greatly,
-                home=home,
-                atts=atts,
-                baseline_hazards=baseline_hazards,
-                observed_exposures=observed_exposures,
-                piece_i=piece_i):
-        return observed_exposures * baseline_hazards[piece_i] * \
-               np.exp(home * defending_team_is_home + \
-                      two_minute_drill * drive_is_two_minute_drill + \
-                      offense_losing_badly * offense_is_losing_badly + \
-                      offense_winning_greatly * offense_is_winning_greatly + \
-                      atts[attacking_team])
-
-
-    drive_deaths = pm.Poisson("drive_deaths", lambdas,
-                              value=observed_drive_deaths_turnover, observed=True)
+    @pm.observed(plot=False)
+    def drive_deaths(value=observed_drive_deaths_turnover,
+                     baseline_hazards=baseline_hazards,
+                     home=home,
+                     two_minute_drill=two_minute_drill,
+                     offense_losing_badly=offense_losing_badly,
+                     offense_winning_greatly=offense_winning_greatly,
+                     atts=atts):
+        return likelihood.logp(baseline_hazards, home=home, two_minute_drill=two_minute_drill,
+                               offense_losing_badly=offense_losing_badly,
+                               offense_winning_greatly=offense_winning_greatly, atts=atts)
 
     @pm.potential
     def limit_sd(std_dev_att=std_dev_att):
@@ -139,6 +141,14 @@ def turnover_piecewise_exponential_model():
     return locals()
 
 
-turnover = pm.MCMC(turnover_piecewise_exponential_model(),
-                   db='pickle', dbname=DATA_DIR + 'turnover_nodef.pickle')
-turnover.sample(100000, 70000, 40)
+if FIT_BACKEND != 'mcmc':
+    fit = {'nuts': fit_nuts, 'chains': fit_chains, 'laplace': fit_laplace}[FIT_BACKEND]
+    turnover = fit(turnover_posterior(model_inputs, num_teams, defense=False), previous=previous)
+    turnover.save(DATA_DIR + 'turnover_nodef_' + FIT_BACKEND + '_traces/')
+else:
+    turnover = pm.MCMC(turnover_piecewise_exponential_model())
+    if previous is not None:
+        for name, sd in posterior_sds(previous, STOCHASTICS).items():
+            turnover.use_step_method(pm.Metropolis, getattr(turnover, name), proposal_sd=sd)
+    turnover.sample(*metropolis_schedule(previous, STOCHASTICS, 100000, 70000, 40))
+    save_trace_store(turnover, DATA_DIR + 'turnover_nodef_traces/')
@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Parquet goes through pyarrow, which is imported only where a parquet file is read or written, so the rest of the
+# package works without it.
+
+# Explicit dtypes for the columns of the raw inputs we use.  Team slugs are loaded as categoricals.
+PLAY_BY_PLAY_DTYPES = {'GameId': np.int64, 'Quarter': np.int64, 'Minute': np.int64, 'Second': np.int64,
+                       'OffenseTeam': 'category', 'DefenseTeam': 'category', 'Down': np.int64, 'ToGo': np.int64,
+                       'YardLine': np.int64, 'SeriesFirstDown': np.int64, 'Description': object, 'Yards': np.int64,
+                       'PlayType': 'category', 'IsTouchdown': np.int64, 'IsFumble': np.int64,
+                       'IsInterception': np.int64, 'IsChallengeReversed': np.int64,
+                       'IsTwoPointConversionSuccessful': np.int64, 'IsPenaltyAccepted': np.int64,
+                       'PenaltyTeam': 'category', 'PenaltyYards': np.int64}
+GAME_LEVEL_DTYPES = {'GameId': np.int64, 'hometeam': 'category', 'awayteam': 'category'}
+STADIUM_DTYPES = {'slug': 'category', 'has_dome': bool}
+# Team slug columns in the raw inputs.  They share categories, so they can be compared with each other.
+TEAM_COLUMNS = ['OffenseTeam', 'DefenseTeam', 'PenaltyTeam', 'hometeam', 'awayteam', 'slug']
+
+
+def write_frame(df, path):
+    """
+    Write a frame, index included, to a parquet file.
+    :param df: DataFrame
+    :param path: str
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    pq.write_table(pa.Table.from_pandas(df), path)
+
+
+def read_frame(path, columns=None):
+    """
+    Read a frame written by write_frame(), optionally just some of its columns.
+    :param path: str
+    :param columns: list of column names, or None for all
+    :return: DataFrame
+    """
+    import pyarrow.parquet as pq
+    return pq.read_table(path, columns=columns).to_pandas()
+
+
+def load_columnar(path, dtypes, columns=None, reader=pd.read_csv):
+    """
+    Load a raw input through a typed parquet copy saved next to it.  The source is parsed only on first use, or when
+    it is newer than its copy.
+    :param path: str path to the source file
+    :param dtypes: dict of column name to dtype.  Columns not listed are copied as parsed.
+    :param columns: list of columns to read, or None for all
+    :param reader: function parsing the source, e.g. pd.read_csv or pd.read_excel
+    :return: DataFrame
+    """
+    columnar_path = os.path.splitext(path)[0] + '.parquet'
+    if not os.path.exists(columnar_path) or os.path.getmtime(columnar_path) < os.path.getmtime(path):
+        df = reader(path)
+        for c, dtype in dtypes.items():
+            if c in df.columns and dtype != 'category':  # parquet keeps the strings; categories are set on read
+                df[c] = df[c].astype(dtype)
+        write_frame(df.reset_index(drop=True), columnar_path)
+
+    df = read_frame(columnar_path, columns=columns)
+    categorical = [c for c, dtype in dtypes.items() if dtype == 'category' and c in df.columns]
+    teams = [c for c in categorical if c in TEAM_COLUMNS]
+    for c in categorical:
+        df[c] = df[c].astype('category')
+    if teams:
+        df = unify_team_categories(df, teams)
+    return df
+
+
+def unify_team_categories(df, columns):
+    """
+    Give the team slug columns of df one shared, alpha-sorted set of categories.
+    :param df: DataFrame
+    :param columns: list of team slug columns
+    :return: df
+    """
+    slugs = set()
+    for c in columns:
+        slugs.update(df[c].dropna().unique())
+    slugs = sorted(slugs)
+    for c in columns:
+        df[c] = pd.Categorical(df[c], categories=slugs)
+    return df
+
+
+def load_play_by_play(path, columns=None):
+    return load_columnar(path, PLAY_BY_PLAY_DTYPES, columns)
+
+
+def load_game_level(path, columns=None):
+    return load_columnar(path, GAME_LEVEL_DTYPES, columns, reader=pd.read_excel)
+
+
+def load_stadiums(path, columns=None):
+    return load_columnar(path, STADIUM_DTYPES, columns)
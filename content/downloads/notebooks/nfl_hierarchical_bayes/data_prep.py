@@ -1,6 +1,12 @@
+import multiprocessing
 import os
+import re
+import numpy as np
 import pandas as pd
 from . import PIECES, LOSING_BADLY_THRESHOLD
+from .columnar import load_play_by_play, load_game_level, load_stadiums, unify_team_categories
+from .sufficient_stats import PiecewiseCounts
+from .team_index import TEAM_INDEX
 
 PARENT_DIR = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
 DATA_DIR = os.path.join(os.getcwd(), 'data/')
@@ -15,34 +21,54 @@ DRIVE_COLS = ['GameId', 'quarter', 'minute', 'second', 'drive_id', 'OffenseTeam'
 PLAY_COLS = ['GameId', 'drive_id', 'play_id', 'Quarter', 'Minute', 'Second', 'OffenseTeam', u'DefenseTeam', 'Yards',
              'is_offensive_touchdown', 'is_field_goal', 'Down', 'ToGo']
 
-
-def enrich_play_level_df(df):
+# (tag, regex) for phrases in play descriptions, one bit each in the description_flags column.
+DESCRIPTION_TAGS = [('two_minute_warning', 'TWO-MINUTE WARNING'),
+                    ('timeout', 'TIMEOUT'),
+                    ('end_of_quarter', 'END.+QUARTER'),
+                    ('end_game', 'END GAME'),
+                    ('end_of_game', 'END OF GAME'),
+                    ('end_of_half', 'END.+HALF'),
+                    ('is_good', 'IS GOOD'),
+                    ('no_play', 'NO PLAY'),
+                    ('no_good', 'NO GOOD'),
+                    ('blocked', 'BLOCKED'),
+                    ('safety', 'SAFETY')]
+DESCRIPTION_FLAGS = {tag: 1 << i for i, (tag, regex) in enumerate(DESCRIPTION_TAGS)}
+_DESCRIPTION_TAG_BITS = [DESCRIPTION_FLAGS[tag] for tag, regex in DESCRIPTION_TAGS]
+# one optional lookahead per tag, so a single match() reports every tag in a description, on any of its lines...
+_ALL_DESCRIPTION_TAGS = re.compile(''.join('(?:(?=[\s\S]*?(%s)))?' % regex for tag, regex in DESCRIPTION_TAGS))
+# ...and literal text every tag starts with, to skip descriptions having none of them
+_ANY_DESCRIPTION_TAG = re.compile('TWO-MINUTE WARNING|TIMEOUT|END|IS GOOD|NO PLAY|NO GOOD|BLOCKED|SAFETY')
+
+
+def enrich_play_level_df(df, workers=1):
     '''
     Add helpful columns - mostly boolean - to the drive level dataset, identifying play types and outcomes.
     Generate unique drive_ids grouping plays into drives.
 
     :param df: drive level data set from http://nflsavant.com/about.php
+    :param workers: int, processes to parse the Description column with.  Results don't depend on it.
     :return: df
     '''
     df = df.sort_index(by=['GameId', 'Quarter', 'Minute', 'Second'], ascending=[True, True, False, False])
     df = df.reset_index().drop('index', axis=1)
 
     df['clock'] = 60 - (df.Quarter) * 15 + df.Minute + df.Second / 60.0
-    df['clock_after_play'] = df.clock.shift(-1)
+    df['clock_after_play'] = df.groupby('GameId').clock.shift(-1)  # not the next game's kickoff
 
     # drop plays we obviously dont need
     # df = df[(df.PlayType != 'TIMEOUT')]
     df = df[(df.Description.notnull())]
-    df = df[~(df.Description.str.contains('TWO-MINUTE WARNING'))]
-    df = df[~(df.Description.str.contains('TIMEOUT')) |
-            (df.Description.str.len() > 35)]  # some timeouts tacked onto play descriptions
+    df['description_flags'] = classify_descriptions(df, workers)
+    df = df[~has_tag(df, 'two_minute_warning')]
+    df = df[~has_tag(df, 'timeout') | (df.Description.str.len() > 35)]  # some timeouts tacked onto play descriptions
 
     # Tag final play of half, so we'll know if a drive was censored by the clock
-    df['is_end_of_quarter'] = (df.Description.str.contains(r'END.+QUARTER'))
-    df['is_end_of_period'] = (df.Description.str.contains('END GAME')) | \
-                             (df.Description.str.contains('END OF GAME')) | \
-                             (df.Description.str.contains('END.+HALF')) | \
-                             (df.Description.str.contains(r'END.+QUARTER')) & \
+    df['is_end_of_quarter'] = has_tag(df, 'end_of_quarter')
+    df['is_end_of_period'] = has_tag(df, 'end_game') | \
+                             has_tag(df, 'end_of_game') | \
+                             has_tag(df, 'end_of_half') | \
+                             has_tag(df, 'end_of_quarter') & \
                              (df.Quarter.isin([2, 4]))
     df['is_final_play_of_half'] = df.is_end_of_period.shift(-1).fillna(False)
 
@@ -61,14 +87,13 @@ def enrich_play_level_df(df):
     df['is_field_goal'] = (df.PlayType == 'FIELD GOAL')
     df['is_field_goal_not_nullified'] = (df.PlayType == 'FIELD GOAL') & (df.IsPenaltyAccepted != 1)
     df['is_extra_point'] = (df.PlayType == 'EXTRA POINT')
-    df['is_extra_point_successful'] = (df.is_extra_point) & (df.Description.str.contains('IS GOOD'))
+    df['is_extra_point_successful'] = (df.is_extra_point) & has_tag(df, 'is_good')
     df['is_after_touchdown'] = (df.PlayType.isin(['EXTRA POINT', 'TWO-POINT CONVERSION']))
     df['is_time_out'] = (df.PlayType == 'TIMEOUT')
-    df['is_no_play'] = (df.Description.str.contains('NO PLAY'))
+    df['is_no_play'] = has_tag(df, 'no_play')
     df['is_qb_kneel'] = (df.PlayType == 'QB KNEEL')
-    df['is_missed_field_goal'] = (df.is_field_goal) & \
-                                 (df.Description.str.contains('NO GOOD') | df.Description.str.contains('BLOCKED'))
-    df['is_safety'] = (df.Description.str.contains('SAFETY'))
+    df['is_missed_field_goal'] = (df.is_field_goal) & (has_tag(df, 'no_good') | has_tag(df, 'blocked'))
+    df['is_safety'] = has_tag(df, 'safety')
     df['is_turnover'] = (df.IsFumble | df.IsInterception) & (df.OffenseTeam != df.OffenseTeam.shift(-1))
     df['is_turnover_on_missed_fg'] = (df.is_missed_field_goal) & (df.OffenseTeam != df.OffenseTeam.shift(-1))
     df['is_turnover_on_downs'] = (df.Down == 4) & \
@@ -98,10 +123,8 @@ def enrich_play_level_df(df):
 
     df['is_first_play_of_drive'] = (df.drive_id != df.drive_id.shift(1)) & (df.drive_id.notnull())
     df['is_last_play_of_drive'] = (df.drive_id != df.drive_id.shift(-1)) & (df.drive_id.notnull())
-    df['yards_offensive'] = df.apply(offensive_yards, axis=1)
-    df['yardline_after_play'] = df.apply(
-        lambda x: x['YardLine'] if x['is_no_play'] else x['YardLine'] + x['yards_offensive'],
-        axis=1)
+    df['yards_offensive'] = calculate_offensive_yards(df)
+    df['yardline_after_play'] = calculate_yardline_after_play(df)
     df['is_earned_first_down'] = (df.Down == 1) & \
                                  (df.yards_offensive.shift(1) > df.ToGo.shift(1)) & \
                                  (df.OffenseTeam.shift(1) == df.OffenseTeam)
@@ -109,6 +132,49 @@ def enrich_play_level_df(df):
     return df
 
 
+def classify_descriptions(df, workers=1):
+    """
+    Tag plays by phrases in their Description, in one pass over the strings.  Tags only depend on the play itself, so
+    with workers > 1 the frame is split on game boundaries and the pieces are parsed on a process pool.
+    :param df: play level frame, with the plays of each game together
+    :param workers: int
+    :return: Series of DESCRIPTION_TAGS bit flags, with df's index
+    """
+    if workers > 1:
+        game_ids = df.GameId.values
+        game_starts = np.flatnonzero(np.append(True, game_ids[1:] != game_ids[:-1]))
+        bounds = game_starts[::max(1, len(game_starts) // (4 * workers))]
+        partitions = [df.Description.iloc[i:j] for i, j in zip(bounds, np.append(bounds[1:], len(df)))]
+        pool = multiprocessing.Pool(workers)
+        try:
+            tags = pd.concat(pool.map(_classify_descriptions, partitions))
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return tags
+    return _classify_descriptions(df.Description)
+
+
+def _classify_descriptions(description):
+    # most descriptions have none of the phrases, and are let go after one search for the anchors
+    any_tag, all_tags = _ANY_DESCRIPTION_TAG.search, _ALL_DESCRIPTION_TAGS.match
+    flags = [sum(bit for bit, found in zip(_DESCRIPTION_TAG_BITS, all_tags(d).groups()) if found is not None)
+             if any_tag(d) else 0 for d in description.values]
+    return pd.Series(np.array(flags, dtype=np.uint16), index=description.index)
+
+
+def has_tag(df, tag):
+    """
+    :param df: play level frame with a description_flags column
+    :param tag: str name from DESCRIPTION_TAGS
+    :return: boolean Series
+    """
+    return (df.description_flags & DESCRIPTION_FLAGS[tag]) != 0
+
+
 def merge_in_game_level_dataset(df, game_level_dataset):
     """
     Merge in home and away team data
@@ -116,23 +182,29 @@ def merge_in_game_level_dataset(df, game_level_dataset):
     :param game_level_dataset:
     :return:
     """
-    df_game = load_game_level_dataset(game_level_dataset)
+    return merge_in_game_level_df(df, load_game_level_dataset(game_level_dataset))
+
+
+def merge_in_game_level_df(df, df_game):
+    """
+    :param df: play level frame
+    :param df_game: frame from load_game_level_dataset()
+    :return: df
+    """
     df = pd.merge(df, df_game, on='GameId', how='left')
+    # categorical team slugs can only be compared if they share categories.
+    team_columns = ['OffenseTeam', 'DefenseTeam', 'PenaltyTeam', 'hometeam', 'awayteam']
+    if any(str(df[c].dtype) == 'category' for c in team_columns):
+        df = unify_team_categories(df, team_columns)
     return df
 
 
 def load_game_level_dataset(game_level_dataset):
-    df_game = pd.read_excel(game_level_dataset)
-    df_game = df_game[['GameId', 'hometeam', 'awayteam']]
-    return df_game
+    return load_game_level(game_level_dataset, columns=['GameId', 'hometeam', 'awayteam'])
 
 
-def merge_team_indexes_with_game_level_df(df_game, teams):
-    df_game = pd.merge(df_game, teams, left_on='hometeam', right_on='slug')
-    df_game = df_game.rename(columns={'i': 'i_home'}).drop('slug', axis=1)
-    df_game = pd.merge(df_game, teams, left_on='awayteam', right_on='slug')
-    df_game = df_game.rename(columns={'i': 'i_away'}).drop('slug', axis=1)
-    return df_game
+def merge_team_indexes_with_game_level_df(df_game, team_index=TEAM_INDEX):
+    return team_index.add_codes(df_game, [('hometeam', 'i_home'), ('awayteam', 'i_away')])
 
 
 def calculate_game_score_at_play_start(df):
@@ -141,8 +213,7 @@ def calculate_game_score_at_play_start(df):
     :param game_level_dataset:
     :return:
     """
-    points_on_play = pd.DataFrame(df.apply(points_scored, axis=1))
-    df = df.join(points_on_play)
+    df = df.join(calculate_points_scored(df))
 
     df['home_points'] = (df.hometeam == df.OffenseTeam).astype(int) * df.points_o
     df['home_points'] += (df.hometeam == df.DefenseTeam).astype(int) * df.points_d
@@ -223,7 +294,7 @@ def merge_stadium_dataset(df_drive):
     :param df_game:
     :return:
     """
-    df_s = pd.read_csv(DOME_DATASET)[['slug', 'has_dome']]
+    df_s = load_stadiums(DOME_DATASET, columns=['slug', 'has_dome'])
     df_s.columns = ['hometeam', 'has_dome']
     df_s.has_dome = df_s.has_dome.astype(bool)
     df_drive = pd.merge(df_drive, df_s, on='hometeam', how='left')
@@ -245,29 +316,60 @@ def remove_unexplained_drives(df_drive):
     return df_drive[df_drive.explained]
 
 
-def index_with_team_indexes(df_drive):
+def remove_end_of_half_and_kneel_drives(df_drive):
     """
-    Assign each team an integer id number, and determine ids of home/away/attacking/defending teams
+    Remove drives beginning with <30 seconds left in the half, and drives ending with a qb kneel.  Neither is trying
+    to score.
     :param df_drive:
     :return: df_drive
     """
-    # alpha-sorted team slugs ('ARI', 'ATL', 'BAL'...)
-    teams = pd.DataFrame({'slug': df_drive.OffenseTeam.unique()}).sort_index(by=['slug']).reset_index().drop('index', 1)
-    teams['i'] = teams.index
-    df_drive = pd.merge(df_drive, teams, left_on='hometeam', right_on='slug')
-    df_drive = df_drive.rename(columns={'i': 'i_home'}).drop('slug', axis=1)
-    df_drive = pd.merge(df_drive, teams, left_on='awayteam', right_on='slug')
-    df_drive = df_drive.rename(columns={'i': 'i_away'}).drop('slug', axis=1)
-    df_drive = pd.merge(df_drive, teams, left_on='OffenseTeam', right_on='slug')
-    df_drive = df_drive.rename(columns={'i': 'i_attacking'}).drop('slug', axis=1)
-    df_drive = pd.merge(df_drive, teams, left_on='DefenseTeam', right_on='slug')
-    df_drive = df_drive.rename(columns={'i': 'i_defending'}).drop('slug', axis=1)
-    return df_drive, teams
+    print 'Dropping %s drives due to their beginning with <30 seconds left in half' % \
+          df_drive[(df_drive.thirty_seconds_drill)].shape[0]
+    df_drive = df_drive[~(df_drive.thirty_seconds_drill)]
+
+    print 'Dropping %s drives due to the ending with qb kneel' % df_drive[(df_drive.end_qb_kneel)].shape[0]
+    return df_drive[~(df_drive.end_qb_kneel)]
+
+
+def index_with_team_indexes(df_drive, team_index=TEAM_INDEX):
+    """
+    Assign each team an integer id number, and determine ids of home/away/attacking/defending teams
+    :param df_drive:
+    :param team_index: TeamIndex.  The default numbering is the same every season.
+    :return: df_drive, teams
+    """
+    df_drive = team_index.add_codes(df_drive, [('hometeam', 'i_home'), ('awayteam', 'i_away'),
+                                               ('OffenseTeam', 'i_attacking'), ('DefenseTeam', 'i_defending')])
+    return df_drive, team_index.frame()
+
+
+def calculate_offensive_yards(df):
+    """
+    Column-wise version of offensive_yards(), for the whole play data frame at once.
+    :param df: play data frame
+    :return: Series
+    """
+    is_penalty_accepted = df.IsPenaltyAccepted.astype(bool)
+    penalty_on_defense = is_penalty_accepted & (df.PenaltyTeam == df.DefenseTeam)
+    penalty_on_offense = is_penalty_accepted & (df.PenaltyTeam == df.OffenseTeam)
+    yards = np.select([(df.PlayType == 'PUNT') | df.is_turnover,
+                       penalty_on_defense,
+                       penalty_on_offense & df.IsTouchdown.astype(bool),
+                       penalty_on_offense,
+                       df.is_no_play],
+                      [0,
+                       df.PenaltyYards + df.Yards,
+                       df.Yards,
+                       df.Yards - df.PenaltyYards,
+                       0],
+                      default=df.Yards)
+    return pd.Series(yards, index=df.index)
 
 
 def offensive_yards(x):
     """
     Yards - including penalty yards - earned on a play.  Turnovers count as 0.
+    Row-wise reference for calculate_offensive_yards().
     :param x: row in play data frame
     :return: int
     """
@@ -287,10 +389,48 @@ def offensive_yards(x):
     return x['Yards']
 
 
+def calculate_yardline_after_play(df):
+    """
+    Column-wise version of yardline_after_play().
+    :param df: play data frame, with yards_offensive
+    :return: Series
+    """
+    return pd.Series(np.where(df.is_no_play, df.YardLine, df.YardLine + df.yards_offensive), index=df.index)
+
+
+def yardline_after_play(x):
+    """
+    Where the ball is after a play; no plays leave it where it was.
+    Row-wise reference for calculate_yardline_after_play().
+    :param x: row in play data frame
+    :return: int
+    """
+    return x['YardLine'] if x['is_no_play'] else x['YardLine'] + x['yards_offensive']
+
+
+def calculate_points_scored(df):
+    """
+    Column-wise version of points_scored(), for the whole play data frame at once.
+    :param df: play data frame
+    :return: DataFrame with points_o and points_d columns
+    """
+    is_touchdown = df.IsTouchdown.astype(bool)
+    conditions = [is_touchdown & df.is_turnover,
+                  is_touchdown,
+                  df.is_extra_point_successful,
+                  df.IsTwoPointConversionSuccessful.astype(bool),
+                  df.is_field_goal & ~df.is_missed_field_goal,
+                  df.is_safety]
+    return pd.DataFrame({'points_o': np.select(conditions, [0, 6, 1, 2, 3, 0], default=0),
+                         'points_d': np.select(conditions, [6, 0, 0, 0, 0, 2], default=0)},
+                        index=df.index)
+
+
 def points_scored(x):
     """
     Calculate points scored by offense/defense on a given play.
     Known to be inaccurate in edge cases.
+    Row-wise reference for calculate_points_scored().
 
     :param x: row in play data frame
     :return: (offensive points, defensive points)
@@ -347,25 +487,29 @@ def enrich_drive_level_df(df_drive, losing_badly_threshold=LOSING_BADLY_THRESHOL
 def generate_piecewise_df(df_drive):
     """
     Expand a drive level frame into a piecewise frame with all drives passing through or dying in that piece.
+    Built in one step, by broadcasting drives against the piece boundaries; rows are ordered by piece, then drive.
     :param df_drive:
     :return: df_pw
     """
-    new_frames = []
-    for i in range(len(PIECES) - 1):
-        lower, upper = PIECES[i], PIECES[i + 1]
-        df_piece = df_drive[(df_drive.start_yardline < upper) & (df_drive.end_yardline_zero_plus > lower)]
-        df_piece['died_in_piece'] = (df_piece.end_yardline_zero_plus <= upper)
-        df_piece['died_in_piece_ex_turnover'] = (df_piece.end_yardline_zero_plus <= upper) & ~(df_piece.end_turnover)
-        df_piece['died_in_piece_turnover'] = (df_piece.end_yardline_zero_plus <= upper) & (df_piece.end_turnover)
-        df_piece['exposure_start'] = df_piece.apply(lambda x: max(x['start_yardline'], lower), axis=1)
-        df_piece['exposure_end'] = df_piece.apply(lambda x: min(x['end_yardline_zero_plus'], upper), axis=1)
-        df_piece['exposure_yards'] = df_piece.exposure_end - df_piece.exposure_start
-        df_piece['exposure_yards'] = df_piece.apply(lambda x: max(.01, x['exposure_yards']), axis=1)
-        df_piece['piece_i'] = i
-        df_piece['piece_lower'] = lower
-        df_piece['piece_upper'] = upper
-        new_frames.append(df_piece.copy())
-    df_pw = pd.concat(new_frames, ignore_index=True)
+    lower, upper = np.array(PIECES[:-1]), np.array(PIECES[1:])
+    start_yardline = df_drive.start_yardline.values
+    end_yardline = df_drive.end_yardline_zero_plus.values
+    in_piece = (start_yardline[None, :] < upper[:, None]) & (end_yardline[None, :] > lower[:, None])
+    piece_i, drive_i = np.nonzero(in_piece)
+
+    df_pw = df_drive.iloc[drive_i].reset_index(drop=True)
+    lower, upper = lower[piece_i], upper[piece_i]
+    start_yardline, end_yardline = start_yardline[drive_i], end_yardline[drive_i]
+    end_turnover = df_pw.end_turnover.values.astype(bool)
+    df_pw['died_in_piece'] = (end_yardline <= upper)
+    df_pw['died_in_piece_ex_turnover'] = (end_yardline <= upper) & ~end_turnover
+    df_pw['died_in_piece_turnover'] = (end_yardline <= upper) & end_turnover
+    df_pw['exposure_start'] = np.maximum(start_yardline, lower)
+    df_pw['exposure_end'] = np.minimum(end_yardline, upper)
+    df_pw['exposure_yards'] = np.maximum(.01, df_pw.exposure_end - df_pw.exposure_start)
+    df_pw['piece_i'] = piece_i
+    df_pw['piece_lower'] = lower
+    df_pw['piece_upper'] = upper
     return df_pw
 
 
@@ -387,3 +531,14 @@ def generate_piecewise_counts_df(df_pw):
     for c in ['i_attacking', 'i_defending', 'i_home', 'i_away']:
         df[c] = df[c].astype(int)
     return df
+
+
+def add_piecewise_counts(df_counts, df_counts_new):
+    """
+    Add two frames from generate_piecewise_counts_df(), e.g. for drives prepped separately.  Counts are sums over
+    drives, so the result is the same as counting all the drives at once.
+    :param df_counts:
+    :param df_counts_new:
+    :return: df_counts
+    """
+    return PiecewiseCounts.from_frame(df_counts).merge(PiecewiseCounts.from_frame(df_counts_new)).to_frame()
@@ -0,0 +1,63 @@
+import numpy as np
+
+# Convergence diagnostics over several chains, as in Stan (Gelman et al., Bayesian Data Analysis 3rd ed., ch. 11):
+# split R-hat, and effective sample size from the chains' autocorrelations summed by Geyer's initial monotone
+# sequence.  Both take draws as an array of shape (chains, draws, ...) and give one value per param.
+
+
+def split_rhat(draws):
+    """
+    :param draws: array of shape (chains, draws, ...)
+    :return: array of R-hat per param, shape draws.shape[2:].  Near 1 once the chains agree.
+    """
+    draws = np.asarray(draws, dtype=float)
+    half = draws.shape[1] // 2
+    split = np.concatenate([draws[:, :half], draws[:, -half:]])
+    within, var_plus = _variances(split)
+    return np.sqrt(var_plus / within)
+
+
+def effective_sample_size(draws):
+    """
+    :param draws: array of shape (chains, draws, ...)
+    :return: array of effective sample size per param, shape draws.shape[2:]
+    """
+    draws = np.asarray(draws, dtype=float)
+    shape = draws.shape[2:]
+    num_chains, n = draws.shape[:2]
+    draws = draws.reshape(num_chains, n, -1)
+    within, var_plus = _variances(draws)
+    # autocorrelation of the pooled chains at each lag, shape (lags, params)
+    rho = 1 - (within - _autocovariance(draws).mean(axis=0)) / var_plus
+    ess = np.empty(draws.shape[2])
+    for j in range(draws.shape[2]):
+        # pairs of consecutive lags, summed while positive and kept from increasing
+        pairs = rho[:n - n % 2:2, j] + rho[1:n - n % 2:2, j]
+        positive = np.flatnonzero(pairs <= 0)
+        pairs = pairs[:positive[0]] if len(positive) else pairs
+        pairs = np.minimum.accumulate(pairs)
+        tau = -1 + 2 * pairs.sum()
+        ess[j] = num_chains * n / max(tau, 1. / np.log10(num_chains * n))
+    return ess.reshape(shape)
+
+
+def _variances(draws):
+    """
+    :return: (mean within-chain variance, pooled variance estimate), per param
+    """
+    n = draws.shape[1]
+    within = draws.var(axis=1, ddof=1).mean(axis=0)
+    between = n * draws.mean(axis=1).var(axis=0, ddof=1) if len(draws) > 1 else 0.
+    return within, (n - 1.) / n * within + between / n
+
+
+def _autocovariance(draws):
+    """
+    :param draws: array of shape (chains, draws, params)
+    :return: array of shape (chains, lags, params), biased autocovariances by FFT
+    """
+    n = draws.shape[1]
+    centered = draws - draws.mean(axis=1, keepdims=True)
+    size = 2 ** int(np.ceil(np.log2(2 * n)))
+    spectrum = np.fft.rfft(centered, size, axis=1)
+    return np.fft.irfft(spectrum * np.conjugate(spectrum), size, axis=1)[:, :n] / n
@@ -0,0 +1,139 @@
+import bisect
+import math
+
+import numpy as np
+
+from . import PIECES, PIECE_LENGTHS, FIELD_GOAL_RANGE, REDZONE_PIECE
+
+# Drives surviving past the goal line score a touchdown.
+GOAL_LINE = PIECES[-1]
+
+
+class DriveHazards(object):
+    """
+    Closed-form version of the piecewise exponential drive model, for one offense in one game situation.
+
+    Hazards are constant within each piece, so the cumulative hazard is piecewise linear in yardline, and
+    the probability of surviving from one yardline to another is exp(-(cumulative hazard difference)).  A drive
+    that dies in a piece is a turnover with probability turnover hazard / total hazard for that piece.
+    """
+
+    def __init__(self, hazards, turnover_hazards):
+        """
+        :param hazards: array of ex-turnover hazards, one per piece
+        :param turnover_hazards: array of turnover hazards, one per piece
+        """
+        self.hazards = np.asarray(hazards, dtype=float)
+        self.turnover_hazards = np.asarray(turnover_hazards, dtype=float)
+        self.total_hazards = self.hazards + self.turnover_hazards
+        self.p_turnover = self.turnover_hazards / self.total_hazards
+        self.cumulative_hazard_at_pieces = np.append(0, np.cumsum(self.total_hazards * PIECE_LENGTHS))
+        # plain python copies for sample(), which is called once per drive with scalars
+        self._total_hazards = self.total_hazards.tolist()
+        self._p_turnover = self.p_turnover.tolist()
+        self._cumulative_hazard_at_pieces = self.cumulative_hazard_at_pieces.tolist()
+
+    def cumulative_hazard(self, yardline):
+        return np.interp(yardline, PIECES, self.cumulative_hazard_at_pieces)
+
+    def survival(self, start_yardline, yardline):
+        """
+        Probability a drive starting at start_yardline is still alive at yardline.
+        """
+        return np.exp(self.cumulative_hazard(start_yardline) - self.cumulative_hazard(yardline))
+
+    def sample(self, start_yardline, u=None):
+        """
+        Play out a drive by inverting the survival function, instead of drawing yards piece by piece.
+        :param start_yardline: float
+        :param u: optional pair of uniforms, for the death spot and the turnover coin flip
+        :return: (death_yardline, is_turnover). death_yardline is None for a touchdown.
+        """
+        if u is None:
+            u = np.random.random(2)
+        start_yardline = min(max(start_yardline, PIECES[0]), GOAL_LINE)
+        start_piece = _piece(start_yardline)
+        cumulative = self._cumulative_hazard_at_pieces
+        target = cumulative[start_piece] + self._total_hazards[start_piece] * (start_yardline - PIECES[start_piece]) - \
+                 math.log(1 - u[0])
+        if target >= cumulative[-1]:
+            return None, False
+        piece = min(bisect.bisect_right(cumulative, target) - 1, len(PIECE_LENGTHS) - 1)
+        death_yardline = PIECES[piece] + (target - cumulative[piece]) / self._total_hazards[piece]
+        return death_yardline, u[1] < self._p_turnover[piece]
+
+    def death_probabilities(self, start_yardline, bucket_edges):
+        """
+        Probability that a drive starting at start_yardline dies in each yardline bucket, with and without a turnover.
+        :param start_yardline: float
+        :param bucket_edges: increasing array of yardlines, from at most start_yardline to GOAL_LINE
+        :return: (p_ex_turnover, p_turnover, p_touchdown).  The first two have one entry per bucket.
+        """
+        bucket_edges = np.asarray(bucket_edges, dtype=float)
+        # split buckets at piece boundaries, so each segment has one hazard
+        knots = np.union1d(np.clip(bucket_edges, start_yardline, GOAL_LINE), PIECES)
+        knots = knots[(knots >= start_yardline) & (knots <= GOAL_LINE)]
+        segment_deaths = -np.diff(self.survival(start_yardline, knots))
+        segment_piece = np.minimum(np.searchsorted(PIECES, knots[:-1], side='right') - 1, len(PIECE_LENGTHS) - 1)
+        segment_bucket = np.searchsorted(bucket_edges, knots[:-1], side='right') - 1
+
+        num_buckets = len(bucket_edges) - 1
+        p_turnover = np.zeros(num_buckets)
+        p_ex_turnover = np.zeros(num_buckets)
+        np.add.at(p_turnover, segment_bucket, segment_deaths * self.p_turnover[segment_piece])
+        np.add.at(p_ex_turnover, segment_bucket, segment_deaths * (1 - self.p_turnover[segment_piece]))
+        return p_ex_turnover, p_turnover, self.survival(start_yardline, GOAL_LINE)
+
+    def outcome_probabilities(self, start_yardline, bucket_size=5):
+        """
+        Drive outcome table: touchdown, field goal, and punts and turnovers by the yardline where the drive died.
+        :param start_yardline: float
+        :param bucket_size: int yards per punt/turnover bucket
+        :return: dict
+        """
+        bucket_edges = bucket_edges_for(bucket_size)
+        p_ex_turnover, p_turnover, p_touchdown = self.death_probabilities(start_yardline, bucket_edges)
+        in_field_goal_range = bucket_edges[:-1] >= FIELD_GOAL_RANGE
+        return {'bucket_edges': bucket_edges,
+                'touchdown': p_touchdown,
+                'field_goal': p_ex_turnover[in_field_goal_range].sum(),
+                'punt': np.where(in_field_goal_range, 0, p_ex_turnover),
+                'turnover': p_turnover}
+
+
+def _piece(yardline):
+    return min(max(bisect.bisect_right(PIECES, yardline) - 1, 0), len(PIECE_LENGTHS) - 1)
+
+
+def bucket_edges_for(bucket_size):
+    """
+    Yardline buckets of bucket_size yards, split at FIELD_GOAL_RANGE so every bucket is all punts or all field goals.
+    """
+    return np.union1d(np.append(np.arange(0, GOAL_LINE, bucket_size), GOAL_LINE), [FIELD_GOAL_RANGE])
+
+
+def drive_hazards(params, possession, offense_winning_greatly, offense_losing_badly, two_minute_drill):
+    """
+    Build the closed-form drive model for the offense and game situation, using the current draw in params.
+    :param params: ParamCalculator
+    :param possession: 'home' or 'away'
+    :return: DriveHazards
+    """
+    xb = params.home_xb() if possession == 'home' else params.away_xb()
+    xb_rz = params.home_xb_rz() if possession == 'home' else params.away_xb_rz()
+    xb_turn = params.home_turnover_xb() if possession == 'home' else params.away_turnover_xb()
+    xb = np.where(np.arange(len(PIECE_LENGTHS)) == REDZONE_PIECE, xb_rz, xb)
+
+    # amend xb for drive-specific situations
+    if offense_winning_greatly:
+        xb += params.ex_t_offense_winning_greatly()
+        xb_turn += params.t_offense_winning_greatly()
+    if offense_losing_badly:
+        xb += params.ex_t_offense_losing_badly()
+        xb_turn += params.t_offense_losing_badly()
+    if two_minute_drill:
+        xb += params.ex_t_two_minute_drill()
+        xb_turn += params.t_two_minute_drill()
+
+    return DriveHazards(params.ex_t_baseline_hazards() * np.exp(xb),
+                        params.t_baseline_hazards() * np.exp(xb_turn))
@@ -0,0 +1,263 @@
+import multiprocessing
+import time
+import traceback
+
+import numpy as np
+
+from .diagnostics import split_rhat, effective_sample_size
+from .laplace import find_mode, laplace_covariance, sample_laplace
+from .nuts import NUTS
+from .traces import Traces
+
+# Fit drivers for the PiecewiseExponentialPosterior models, as alternatives to pymc's Metropolis: NUTS, in one chain
+# or several, and a Laplace approximation for quick refreshes.  Each returns a Traces object ParamCalculator can read
+# in place of a fitted pymc MCMC object.
+
+NUTS_DRAWS = 2000
+NUTS_WARMUP = 1000
+# fit_chains() stops once every param passes these, checking every CHECK_EVERY draws per chain
+MAX_RHAT = 1.01
+MIN_ESS = 400
+CHECK_EVERY = 100
+LAPLACE_DRAWS = 2000
+# burn-in of a Metropolis refit warm started from a previous fit, in autocorrelation times of that fit
+WARM_START_BURN_AUTOCORRELATION_TIMES = 10
+
+
+def fit_nuts(posterior, draws=NUTS_DRAWS, warmup=NUTS_WARMUP, seed=None, previous=None, verbose=True):
+    """
+    Sample the posterior with NUTS, using its analytic gradient.  Every draw is kept; NUTS draws are far less
+    autocorrelated than Metropolis ones, so there's no thinning.
+    :param posterior: PiecewiseExponentialPosterior
+    :param draws: int, draws kept after warmup
+    :param warmup: int, tuning draws thrown away; most of them, when warm starting
+    :param seed: int
+    :param previous: optional earlier fit of the same model to warm start from (see warm_start())
+    :param verbose: bool
+    :return: Traces, with the sampler's final step_size and inv_mass, and the warmup it took, in info
+    """
+    start = time.time()
+    x0, inv_mass, step_size, adapt_mass = _starting_state(posterior, previous)
+    sampler = NUTS(posterior.logp_and_grad, x0, step_size, inv_mass, seed=seed)
+    warmup = len(sampler.warmup(warmup, adapt_mass, until_settled=not adapt_mass))
+    result = sampler.sample(draws)
+    elapsed = time.time() - start
+    if verbose:
+        print 'NUTS: %s warmup, %s draws in %.1f s, step size %.3g, mean tree depth %.1f, %s divergent.' % \
+              (warmup, draws, elapsed, sampler.step_size, result['depth'].mean(), result['diverged'].sum())
+    return Traces(posterior.node_traces(result['samples']),
+                  {'sampler': 'nuts', 'step_size': sampler.step_size, 'inv_mass': sampler.inv_mass, 'warmup': warmup,
+                   'accept_stat': result['accept_stat'].mean(), 'divergences': int(result['diverged'].sum()),
+                   'gradient_evaluations': sampler.gradient_evaluations, 'seconds': elapsed})
+
+
+def fit_chains(posterior, chains=4, warmup=NUTS_WARMUP, max_draws=NUTS_DRAWS, min_draws=CHECK_EVERY,
+               max_rhat=MAX_RHAT, min_ess=MIN_ESS, check_every=CHECK_EVERY, seed=None, previous=None, verbose=True):
+    """
+    Run NUTS chains in parallel processes, each from its own jittered starting point.  Every check_every draws
+    per chain, split R-hat and effective sample size are computed over what all chains have drawn so far, and the
+    chains stop once every param has R-hat below max_rhat and ESS above min_ess, or at max_draws.
+    :param posterior: PiecewiseExponentialPosterior
+    :param chains: int, one process each
+    :param warmup: int, tuning draws per chain; most of them, when warm starting
+    :param max_draws: int, most draws kept per chain
+    :param min_draws: int, fewest draws per chain before stopping early
+    :param max_rhat: float
+    :param min_ess: float, over all chains together
+    :param check_every: int
+    :param seed: int
+    :param previous: optional earlier fit of the same model to warm start from (see warm_start()).  Chains then
+                     start from draws of a normal with its means and variances.
+    :param verbose: bool
+    :return: Traces, with chains stacked draw-wise, and info holding the final rhat and ess per param
+    """
+    start = time.time()
+    random = np.random.RandomState(seed)
+    x0, inv_mass, step_size, adapt_mass = _starting_state(posterior, previous)
+    if previous is None:
+        starts = [x0 + random.uniform(-1, 1, len(x0)) for _ in range(chains)]
+    else:
+        starts = [x0 + random.normal(size=len(x0)) * np.sqrt(inv_mass) for _ in range(chains)]
+    seeds = random.randint(0, 2 ** 31 - 1, size=chains)
+
+    # Chains are forked, so they inherit the posterior rather than unpickling it.
+    queue = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    processes = [multiprocessing.Process(target=_run_chain,
+                                         args=(posterior, starts[c], seeds[c], c, step_size, inv_mass, warmup,
+                                               adapt_mass, max_draws, check_every, queue, stop))
+                 for c in range(chains)]
+    for process in processes:
+        process.daemon = True
+        process.start()
+
+    blocks = [[] for _ in range(chains)]
+    infos = [None] * chains
+    checked = 0
+    diagnostics = {}
+    try:
+        while None in infos:
+            chain, samples, info = queue.get()
+            if samples is None:
+                if 'error' in info:
+                    raise RuntimeError('Chain %s failed:\n%s' % (chain, info['error']))
+                infos[chain] = info
+                continue
+            blocks[chain].append(samples)
+            common = min(len(b) for b in blocks)
+            if common > checked and not stop.is_set():
+                checked = common
+                draws = np.array([np.concatenate(b[:common]) for b in blocks])
+                diagnostics = _diagnostics(draws)
+                if verbose:
+                    print '%s draws per chain: max R-hat %.3f, min ESS %.0f, %.0f s' % \
+                          (draws.shape[1], diagnostics['rhat'].max(), diagnostics['ess'].min(), time.time() - start)
+                if draws.shape[1] >= min_draws and diagnostics['rhat'].max() < max_rhat and \
+                        diagnostics['ess'].min() > min_ess:
+                    stop.set()
+    except BaseException:
+        # the other chains may be blocked putting blocks nobody will read, so joining them would hang
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        stop.set()
+        for process in processes:
+            process.join()
+
+    # chains may have run a block past the stop; keep the same number of draws from each
+    common = min(sum(len(s) for s in b) for b in blocks)
+    draws = np.array([np.concatenate(b)[:common] for b in blocks])
+    diagnostics = _diagnostics(draws)
+    elapsed = time.time() - start
+    if verbose:
+        print '%s chains x %s draws in %.1f s: max R-hat %.3f, min ESS %.0f, %s divergent.' % \
+              (chains, common, elapsed, diagnostics['rhat'].max(), diagnostics['ess'].min(),
+               sum(info['divergences'] for info in infos))
+    return Traces(posterior.node_traces(draws.reshape(-1, draws.shape[2])),
+                  {'sampler': 'nuts', 'chains': chains, 'rhat': diagnostics['rhat'], 'ess': diagnostics['ess'],
+                   'step_size': [info['step_size'] for info in infos], 'warmup': [info['warmup'] for info in infos],
+                   'inv_mass': np.mean([info['inv_mass'] for info in infos], axis=0),
+                   'divergences': sum(info['divergences'] for info in infos), 'seconds': elapsed})
+
+
+def _run_chain(posterior, x0, seed, chain, step_size, inv_mass, warmup, adapt_mass, max_draws, block, queue, stop):
+    # runs in a child process; sends blocks of draws, then (chain, None, info) when done
+    try:
+        sampler = NUTS(posterior.logp_and_grad, x0, step_size, inv_mass, seed=seed)
+        warmup = len(sampler.warmup(warmup, adapt_mass, until_settled=not adapt_mass))
+        drawn = 0
+        divergences = 0
+        while drawn < max_draws and not stop.is_set():
+            result = sampler.sample(min(block, max_draws - drawn))
+            drawn += len(result['samples'])
+            divergences += result['diverged'].sum()
+            queue.put((chain, result['samples'], None))
+        queue.put((chain, None, {'step_size': sampler.step_size, 'inv_mass': sampler.inv_mass, 'warmup': warmup,
+                                 'divergences': int(divergences)}))
+    except Exception:
+        queue.put((chain, None, {'error': traceback.format_exc()}))
+
+
+def _diagnostics(draws):
+    """
+    :param draws: array of unconstrained params, shape (chains, draws, params)
+    """
+    return {'rhat': split_rhat(draws), 'ess': effective_sample_size(draws)}
+
+
+def fit_laplace(posterior, draws=LAPLACE_DRAWS, seed=None, previous=None, verbose=True):
+    """
+    Fast approximate fit: std_devs at their marginal posterior mode, and pseudo-traces of everything else drawn from
+    the Laplace approximation around its mode given them (see laplace.py).  The sum-to-zero team effects are part of
+    the posterior, so the draws respect them like sampled ones do; the std_dev traces are constant.
+    :param posterior: PiecewiseExponentialPosterior
+    :param draws: int, pseudo-trace length
+    :param seed: int
+    :param previous: optional earlier fit of the same model; the mode search starts from its means
+    :param verbose: bool
+    :return: Traces, with the mode, and the covariance of all but the std_devs, in info
+    """
+    start = time.time()
+    mode, neg_hessian = find_mode(posterior, None if previous is None else warm_start(posterior, previous)[0])
+    covariance = laplace_covariance(neg_hessian)
+    samples = sample_laplace(posterior, mode, covariance, draws, np.random.RandomState(seed))
+    elapsed = time.time() - start
+    if verbose:
+        print 'Laplace: mode found and %s draws in %.1f s.' % (draws, elapsed)
+    return Traces(posterior.node_traces(samples),
+                  {'sampler': 'laplace', 'mode': mode, 'covariance': covariance, 'seconds': elapsed})
+
+
+def warm_start(posterior, previous):
+    """
+    Sampler state to start a refit from, e.g. after adding a week of games: the previous posterior means, its
+    variances as the inverse mass matrix, and its NUTS step size, if it has one.
+    :param posterior: PiecewiseExponentialPosterior
+    :param previous: earlier fit of the same model: Traces, TraceStore, or a pymc MCMC object
+    :return: (x0, inv_mass, step_size or None)
+    """
+    draws = posterior.pack_traces(previous)
+    variances = draws.var(axis=0)
+    # Laplace fits hold the std_devs fixed; leave those to the step size
+    inv_mass = np.where(variances > 0, variances, 1.)
+    info = getattr(previous, 'info', None) or {}
+    step_size = float(np.mean(info['step_size'])) if 'step_size' in info else None
+    return draws.mean(axis=0), inv_mass, step_size
+
+
+def _starting_state(posterior, previous):
+    """
+    :return: (x0, inv_mass, step_size, adapt_mass) for a cold start, or a warm start from previous with the mass
+             matrix kept, so warmup only tunes the step size and stops once that settles
+    """
+    if previous is None:
+        return posterior.initial_point(), None, None, True
+    x0, inv_mass, step_size = warm_start(posterior, previous)
+    return x0, inv_mass, step_size, False
+
+
+def metropolis_schedule(previous, names, iterations, burn, thin, max_rhat=MAX_RHAT, min_ess=MIN_ESS):
+    """
+    pymc MCMC.sample() arguments for a Metropolis refit warm started from previous, sized from how well previous
+    mixed: one chain's split R-hat and effective sample size over names give its autocorrelation time, and the refit
+    keeps enough draws for min_ess after a burn-in of WARM_START_BURN_AUTOCORRELATION_TIMES of them.  Neither is
+    more than the cold start's, which is used as is when there's no previous fit or it hadn't converged.
+    :param previous: earlier fit of the same model, thinned by thin as well: Traces, TraceStore, or a pymc MCMC
+                     object; or None
+    :param names: list of node names
+    :param iterations: int, cold start iterations, burn-in included
+    :param burn: int, cold start burn-in
+    :param thin: int
+    :param max_rhat: float
+    :param min_ess: float
+    :return: (iterations, burn, thin)
+    """
+    if previous is None:
+        return iterations, burn, thin
+    traces = [np.asarray(getattr(previous, name).gettrace(), dtype=float) for name in names]
+    draws = np.column_stack([trace.reshape(len(trace), -1) for trace in traces])
+    # std_devs a Laplace fit held fixed have no spread to measure
+    draws = draws[:, draws.var(axis=0) > 0][None]
+    if not draws.size or split_rhat(draws).max() > max_rhat:
+        return iterations, burn, thin
+    autocorrelation_time = draws.shape[1] / effective_sample_size(draws).min() * thin
+    kept = min(iterations - burn, int(np.ceil(min_ess * autocorrelation_time / thin)) * thin)
+    burn = min(burn, int(np.ceil(WARM_START_BURN_AUTOCORRELATION_TIMES * autocorrelation_time)))
+    return burn + kept, burn, thin
+
+
+def posterior_means(previous, names):
+    """
+    :param previous: earlier fit: Traces, TraceStore, or a pymc MCMC object
+    :param names: list of node names
+    :return: dict of node name to its posterior mean, e.g. as pymc starting values
+    """
+    return {name: np.mean(getattr(previous, name).gettrace(), axis=0) for name in names}
+
+
+def posterior_sds(previous, names):
+    """
+    :return: dict of node name to its posterior std dev, e.g. as pymc Metropolis proposal_sd
+    """
+    return {name: np.std(getattr(previous, name).gettrace(), axis=0) for name in names}
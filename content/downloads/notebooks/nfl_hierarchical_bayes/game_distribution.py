@@ -0,0 +1,195 @@
+import numpy as np
+import pandas as pd
+
+from . import FIELD_GOAL_RANGE, PUNT_DISTANCE, LOSING_BADLY_THRESHOLD, \
+    SIMULATION_TIE_BREAKER_COIN_FLIP_HOME_ADVANTAGE, PUNT_CLOCK_TIME, TOUCHDOWN_CLOCK_TIME, FG_CLOCK_TIME
+from drive_outcomes import drive_hazards, bucket_edges_for, GOAL_LINE
+from elapsed_time import drive_time_elapsed
+from simulation import simulate_game_n_times, HOME, AWAY
+
+# Exact (up to discretization) alternative to simulate_game_n_times().  For one posterior draw the game is a Markov
+# chain over (half, possession, clock, start yardline, score margin), one step per drive.  Every drive uses up
+# clock, so the chain is solved in one pass over the clock from kickoff down to zero, pushing the probability mass at
+# each clock bucket forward through the closed-form drive outcome probabilities in drive_outcomes.
+#
+# Discretization: drives start on a grid of yard_bucket yards, die at the middle of their yardline bucket, clock runs
+# on a grid of clock_bucket minutes (every drive takes at least one bucket), and the score margin is clipped at
+# +/- max_margin.  cross_check() compares against simulate_game_n_times().
+
+
+def game_outcome_distribution(pc, yard_bucket=5, clock_bucket=.5, max_margin=3 * LOSING_BADLY_THRESHOLD):
+    """
+    Final score margin distribution for the matchup in pc, using its current posterior draw.
+    :param pc: ParamCalculator, with i_home, i_away set and a sample drawn
+    :param yard_bucket: int yards per start yardline / drive death bucket
+    :param clock_bucket: float minutes per clock bucket
+    :param max_margin: int, home - away margins are clipped to +/- this
+    :return: dict with margin, p_margin, and home_win, away_win probabilities (ties settled by the coin flip)
+    """
+    margins = np.arange(-max_margin, max_margin + 1)
+    start_yardlines = np.arange(0, GOAL_LINE, yard_bucket)
+    num_clocks = int(round(60. / clock_bucket)) + 1
+    transitions = _drive_transitions(pc, start_yardlines, margins, clock_bucket)
+
+    p_margin = np.zeros(len(margins))
+    for first_half_possession in [HOME, AWAY]:
+        p_margin += .5 * _solve_chain(transitions, first_half_possession, int(round(20. / yard_bucket)), num_clocks,
+                                      clock_bucket)
+
+    p_tie = p_margin[margins == 0].sum()
+    p_home_coin_flip = .5 + SIMULATION_TIE_BREAKER_COIN_FLIP_HOME_ADVANTAGE
+    return {'margin': margins,
+            'p_margin': p_margin,
+            'home_win': p_margin[margins > 0].sum() + p_tie * p_home_coin_flip,
+            'away_win': p_margin[margins < 0].sum() + p_tie * (1 - p_home_coin_flip)}
+
+
+def matchup_outcome_distribution(pc, n_draws=100, **kwargs):
+    """
+    Average game_outcome_distribution() over n_draws posterior draws.
+    Each draw solves two chains (one per first half possession), about .4 s with the default buckets, so the default
+    100 draws take most of a minute per matchup where simulate_game_n_times(batch=True) plays 10000 games in about a
+    second.  Coarser clock_bucket / yard_bucket trade accuracy for speed roughly in proportion.
+    :return: DataFrame with one row per margin
+    """
+    p_margin = 0
+    for i in range(n_draws):
+        pc.re_draw_sample()
+        result = game_outcome_distribution(pc, **kwargs)
+        p_margin = p_margin + result['p_margin'] / n_draws
+    df = pd.DataFrame({'margin': result['margin'], 'p': p_margin})
+    df['i_home'] = pc.i_home
+    df['i_away'] = pc.i_away
+    return df
+
+
+def summarize_margins(margins, p):
+    """
+    Home/away win probability and margin moments, from a margin distribution.
+    """
+    p_tie = p[margins == 0].sum()
+    p_home_coin_flip = .5 + SIMULATION_TIE_BREAKER_COIN_FLIP_HOME_ADVANTAGE
+    mean = (margins * p).sum()
+    return pd.Series({'home_win': p[margins > 0].sum() + p_tie * p_home_coin_flip,
+                      'away_win': p[margins < 0].sum() + p_tie * (1 - p_home_coin_flip),
+                      'tie_before_coin_flip': p_tie,
+                      'mean_margin': mean,
+                      'sd_margin': np.sqrt((p * (margins - mean) ** 2).sum())})
+
+
+def cross_check(pc, n_draws=100, n_games=10000, **kwargs):
+    """
+    Monte Carlo cross-check of the exact engine: compare summaries of matchup_outcome_distribution() with
+    simulate_game_n_times() for the same matchup.  Both average over posterior draws, so n_draws needs to be large
+    enough for the exact side to settle; that side dominates the run time, see matchup_outcome_distribution().
+    :return: DataFrame with exact and monte_carlo columns
+    """
+    df_exact = matchup_outcome_distribution(pc, n_draws, **kwargs)
+    df_mc = simulate_game_n_times(pc, n_games, batch=True)
+    mc_margins = (df_mc.home_score - df_mc.away_score).values
+    margins = np.arange(mc_margins.min(), mc_margins.max() + 1)
+    p_mc = np.bincount(mc_margins - margins[0]) / float(len(mc_margins))
+    return pd.DataFrame({'exact': summarize_margins(df_exact.margin.values, df_exact.p.values),
+                         'monte_carlo': summarize_margins(margins, p_mc)})
+
+
+def _drive_transitions(pc, start_yardlines, margins, clock_bucket):
+    """
+    Where each drive can end up, by possession, two minute drill, margin and start yardline.
+    :return: dict with
+        p: (2, 2, J, K, D) probability of outcome k for possession, two minute drill, start j, margin d
+        next_start: (J, K) start yardline index of the next drive
+        clock_used: (J, K) clock buckets used
+        points: (K,) points for the offense
+    """
+    bucket_edges = bucket_edges_for(start_yardlines[1] - start_yardlines[0])
+    # drives die in the middle of their bucket; start yardlines are bucket edges, so no bucket is cut in two.
+    death_yardlines = np.maximum((bucket_edges[:-1] + bucket_edges[1:]) / 2., start_yardlines[:, None])
+    is_field_goal = bucket_edges[:-1] >= FIELD_GOAL_RANGE
+    num_buckets = len(bucket_edges) - 1
+
+    # outcome k: ex-turnover death in bucket k, turnover in bucket k - num_buckets, or the touchdown last.
+    punt_to_yardlines = 100 - (death_yardlines + PUNT_DISTANCE)
+    punt_to_yardlines[punt_to_yardlines < 2] = 20  # cut down on coffin corner punts
+    next_start = np.column_stack([np.where(is_field_goal, 20, punt_to_yardlines),
+                                  100 - death_yardlines,
+                                  np.ones(len(start_yardlines)) * 20])
+    drive_yards = np.column_stack([death_yardlines, death_yardlines, np.ones(len(start_yardlines)) * GOAL_LINE]) - \
+                  start_yardlines[:, None]
+    outcome_clock = np.concatenate([np.where(is_field_goal, FG_CLOCK_TIME, PUNT_CLOCK_TIME), np.zeros(num_buckets),
+                                    [TOUCHDOWN_CLOCK_TIME]])
+    clock_used = np.round((drive_time_elapsed(drive_yards) + outcome_clock) / clock_bucket).astype(int)
+    points = np.concatenate([np.where(is_field_goal, 3, 0), np.zeros(num_buckets), [7]]).astype(int)
+
+    yard_bucket = start_yardlines[1] - start_yardlines[0]
+    p = np.zeros((2, 2, len(start_yardlines), len(points), len(margins)))
+    for possession in [HOME, AWAY]:
+        offense_margins = margins if possession == HOME else -margins
+        situations = [offense_margins > LOSING_BADLY_THRESHOLD, -offense_margins > LOSING_BADLY_THRESHOLD]
+        situations.append(~situations[0] & ~situations[1])
+        for two_minute_drill in [False, True]:
+            for winning_greatly, losing_badly, in_situation in zip([True, False, False], [False, True, False],
+                                                                   situations):
+                model = drive_hazards(pc, 'home' if possession == HOME else 'away', winning_greatly, losing_badly,
+                                      two_minute_drill)
+                for j, start_yardline in enumerate(start_yardlines):
+                    p_ex_turnover, p_turnover, p_touchdown = model.death_probabilities(start_yardline, bucket_edges)
+                    p_outcome = np.append(np.append(p_ex_turnover, p_turnover), p_touchdown)
+                    p[possession, int(two_minute_drill), j][:, in_situation] = p_outcome[:, None]
+
+    return {'p': p,
+            'next_start': np.clip(np.round(next_start / yard_bucket).astype(int), 0, len(start_yardlines) - 1),
+            'clock_used': np.maximum(clock_used, 1),
+            'points': points}
+
+
+def _solve_chain(transitions, first_half_possession, kickoff_start, num_clocks, clock_bucket):
+    """
+    Push probability mass from kickoff to the final whistle.
+    State is (clock, half, possession, start yardline, margin).  Drives only move mass to lower clocks, so each clock
+    bucket is settled by the time we reach it.  Second half drives that run out the clock land on clock 0, and first
+    half ones are collected once every first half drive has ended, so each step is one bincount with no masking.
+    :return: final margin distribution
+    """
+    num_starts, num_outcomes = transitions['clock_used'].shape
+    num_margins = transitions['p'].shape[-1]
+    state_shape = (2, 2, num_starts, num_margins)
+    state_size = np.prod(state_shape)
+    mass = np.zeros((num_clocks,) + state_shape)
+    mass[num_clocks - 1, 0, first_half_possession, kickoff_start, num_margins // 2] = 1
+    halftime_clock = int(round(30. / clock_bucket))
+    # first half drives ending below 30.5 minutes go to halftime
+    last_first_half_clock = int(np.ceil(30.5 / clock_bucket)) - 1
+    assert halftime_clock <= last_first_half_clock, 'clock_bucket too coarse'
+    max_clock_used = transitions['clock_used'].max()
+
+    # where outcome k of a drive from start j goes, as flat (possession, j, k, margin) arrays
+    points = np.array([transitions['points'], -transitions['points']])  # from home's point of view
+    next_margin = np.clip(np.arange(num_margins)[None, None, None, :] + points[:, None, :, None], 0, num_margins - 1)
+    clock_used = transitions['clock_used'][None, :, :, None]
+    next_start = transitions['next_start'][None, :, :, None]
+    next_possession = np.array([AWAY, HOME])[:, None, None, None]
+    shape = (2, num_starts, num_outcomes, num_margins)
+    # flat index within clock 0 (possession always flips), and the same moved down by the clock each outcome uses
+    next_state = [np.broadcast_to(np.ravel_multi_index((half, next_possession, next_start, next_margin), state_shape),
+                                  shape).ravel() for half in [0, 1]]
+    moved = [s - np.broadcast_to(clock_used, shape).ravel() * state_size for s in next_state]
+
+    for c in range(num_clocks - 1, 0, -1):
+        clock = c * clock_bucket
+        two_minute_drill = int(30 < clock < 32 or clock < 2)
+        window_start = max(c - max_clock_used, 0)
+        if c == last_first_half_clock:
+            # the second half starts with the other team receiving at the 20.
+            mass[halftime_clock, 1, 1 - first_half_possession, kickoff_start] += mass[:c + 1, 0].sum(axis=(0, 1, 2))
+            mass[:c + 1, 0] = 0
+        for half in [0, 1]:
+            m = mass[c, half]
+            if not m.any():
+                continue
+            weights = (m[:, :, None, :] * transitions['p'][:, two_minute_drill]).ravel()
+            # clocks below window_start can't be reached from here, except clock 0, where drives past it stop
+            flat = np.maximum(moved[half] + (c - window_start) * state_size, next_state[half])
+            mass[window_start:c] += np.bincount(flat, weights, minlength=(c - window_start) * state_size).reshape(
+                (c - window_start,) + state_shape)
+    return mass[0, 1].sum(axis=(0, 1))
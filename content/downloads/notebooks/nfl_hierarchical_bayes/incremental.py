@@ -0,0 +1,95 @@
+import os
+
+import pandas as pd
+
+from . import data_prep
+from .columnar import write_frame, read_frame
+from .streaming import prep_games
+from .team_index import TEAM_INDEX
+
+# In-season updates: only games not seen before are prepped, their drives are appended to a drive store on disk,
+# and their piecewise counts are added to the stored counts.  Counts are sums over drives, so the result is the same
+# as rebuilding from scratch.
+#
+# Store layout, one batch per update:
+#   drives-00000.parquet, ...  drives added by each batch
+#   counts-00000.parquet, ...  piecewise counts over all drives up to and including each batch
+#   games.parquet              GameIds stored, their batch, and the play and drive ids the next batch starts from
+# games.parquet is written last, so a batch interrupted before then is simply redone by the next update.
+
+STORE_DIR = os.path.join(data_prep.DATA_DIR, 'drive_store/')
+
+
+def update_drive_store(pbp_file, game_level_dataset=data_prep.GAME_LEVEL_DATASET_2014, store_dir=STORE_DIR):
+    """
+    Prep the games in pbp_file that aren't in the store yet, and add them to it as a new batch.  Every game in
+    pbp_file must be complete.
+    :param pbp_file: str path to play-by-play csv from http://nflsavant.com/about.php
+    :param game_level_dataset: str path to game level dataset
+    :param store_dir: str
+    :return: dict with teams, df_counts, and new_games (the GameIds added by this update)
+    """
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    df_stored_games = _read_stored_games(store_dir)
+    batch = df_stored_games.batch.max() + 1 if len(df_stored_games) else 0
+
+    game_ids = data_prep.load_play_by_play(pbp_file, columns=['GameId']).GameId
+    new_games = game_ids[~game_ids.isin(df_stored_games.GameId)].unique()
+    if not len(new_games):
+        print 'No new games.'
+        return {'teams': TEAM_INDEX.frame(), 'df_counts': load_counts(store_dir), 'new_games': new_games}
+
+    print 'Adding %s new games.' % len(new_games)
+    df = data_prep.load_play_by_play(pbp_file)
+    df = df[df.GameId.isin(new_games)].reset_index(drop=True)
+    next_play_id = df_stored_games.next_play_id.max() if batch else 0
+    next_drive_id = df_stored_games.next_drive_id.max() if batch else 0
+    df_drive, next_play_id, next_drive_id = prep_games(df, data_prep.load_game_level_dataset(game_level_dataset),
+                                                       next_play_id, next_drive_id)
+    df_counts = data_prep.generate_piecewise_counts_df(data_prep.generate_piecewise_df(df_drive))
+    if batch:
+        df_counts = data_prep.add_piecewise_counts(load_counts(store_dir), df_counts)
+
+    write_frame(df_drive.reset_index(drop=True), _batch_path(store_dir, 'drives', batch))
+    write_frame(df_counts, _batch_path(store_dir, 'counts', batch))
+    df_new_games = pd.DataFrame({'GameId': new_games, 'batch': batch, 'next_play_id': next_play_id,
+                                 'next_drive_id': next_drive_id},
+                                columns=df_stored_games.columns)
+    games_path = os.path.join(store_dir, 'games.parquet')
+    write_frame(pd.concat([df_stored_games, df_new_games], ignore_index=True), games_path + '.tmp')
+    os.rename(games_path + '.tmp', games_path)
+    if batch:
+        os.remove(_batch_path(store_dir, 'counts', batch - 1))
+    return {'teams': TEAM_INDEX.frame(), 'df_counts': df_counts, 'new_games': new_games}
+
+
+def load_counts(store_dir=STORE_DIR):
+    """
+    :param store_dir: str
+    :return: df_counts over all stored drives
+    """
+    return read_frame(_batch_path(store_dir, 'counts', _read_stored_games(store_dir).batch.max()))
+
+
+def load_drive_store(store_dir=STORE_DIR, columns=None):
+    """
+    :param store_dir: str
+    :param columns: list of drive columns to read, or None for all
+    :return: df_drive, all stored drives
+    """
+    batches = range(_read_stored_games(store_dir).batch.max() + 1)
+    return pd.concat([read_frame(_batch_path(store_dir, 'drives', b), columns=columns) for b in batches],
+                     ignore_index=True)
+
+
+def _read_stored_games(store_dir):
+    games_path = os.path.join(store_dir, 'games.parquet')
+    if os.path.exists(games_path):
+        return read_frame(games_path)
+    return pd.DataFrame({'GameId': [], 'batch': [], 'next_play_id': [], 'next_drive_id': []},
+                        columns=['GameId', 'batch', 'next_play_id', 'next_drive_id'], dtype=int)
+
+
+def _batch_path(store_dir, name, batch):
+    return os.path.join(store_dir, '%s-%05d.parquet' % (name, batch))
@@ -0,0 +1,124 @@
+import numpy as np
+
+# Laplace approximation of a PiecewiseExponentialPosterior, for fits in seconds rather than hours.
+#
+# The joint mode of a hierarchical model is no good to center on: it runs off to std_devs at the edge of their range
+# (to zero, or in the z-score parameterization to the top), with team effects to match.  So, as in empirical Bayes,
+# the std_devs are set to the mode of their marginal posterior, itself Laplace-approximated:
+#
+#   log p(std_devs | data) ~ log p(mode of the rest, std_devs, data) - 1/2 log det(negative Hessian of the rest)
+#
+# and the remaining params (log baseline hazards, coefficients, team effects) get a normal approximation around their
+# mode given those std_devs.  Given the std_devs the model is a Poisson regression, concave in the rest with an exact
+# Hessian, so that mode is found reliably by Newton steps.
+
+STD_DEV_STEP = 1e-2  # finite difference step for the marginal, in the logistic std_dev coordinates
+
+
+def fit_conditional_mode(posterior, x, tol=1e-8, max_iter=100):
+    """
+    Maximize the log posterior over posterior.free_indices(), holding the std_devs at their values in x, by damped
+    Newton steps (Levenberg-Marquardt).
+    :param posterior: PiecewiseExponentialPosterior
+    :param x: unconstrained vector to start from
+    :param tol: float, stop once no free gradient component is bigger than this
+    :param max_iter: int
+    :return: (x at the mode, negative Hessian over the free params there)
+    """
+    free = posterior.free_indices()
+    x = np.array(x, dtype=float)
+    logp, grad = posterior.logp_and_grad(x)
+    ridge = 1e-6
+    for _ in range(max_iter):
+        neg_hessian = -posterior.hessian_given_std_devs(x)
+        if np.abs(grad[free]).max() < tol:
+            break
+        scale = np.maximum(np.abs(np.diag(neg_hessian)), 1.)
+        while True:
+            candidate = x.copy()
+            candidate[free] += np.linalg.solve(neg_hessian + ridge * np.diag(scale), grad[free])
+            new_logp, new_grad = posterior.logp_and_grad(candidate)
+            if new_logp >= logp:
+                break
+            ridge *= 10
+            if ridge > 1e12:
+                return x, neg_hessian
+        x, logp, grad = candidate, new_logp, new_grad
+        ridge = max(ridge / 10, 1e-12)
+    return x, neg_hessian
+
+
+def log_marginal(posterior, x):
+    """
+    Laplace approximation of the log marginal posterior of the std_devs, at their values in x.
+    :return: (log marginal, x at the conditional mode of the rest, negative Hessian over the rest there)
+    """
+    x, neg_hessian = fit_conditional_mode(posterior, x)
+    sign, log_det = np.linalg.slogdet(neg_hessian)
+    if sign <= 0:
+        return -np.inf, x, neg_hessian
+    return posterior.logp(x) - .5 * log_det, x, neg_hessian
+
+
+def find_mode(posterior, x0=None, tol=1e-4, max_iter=50):
+    """
+    Find the std_devs' marginal mode, by Newton steps on finite differences of log_marginal() one coordinate at a
+    time, and the conditional mode of everything else given them.
+    :param posterior: PiecewiseExponentialPosterior
+    :param x0: starting unconstrained vector, or None for posterior.initial_point()
+    :param tol: float, stop once no std_dev coordinate moves by more than this
+    :param max_iter: int
+    :return: (x, negative Hessian over posterior.free_indices() at x)
+    """
+    x = posterior.initial_point() if x0 is None else np.array(x0, dtype=float)
+    value, x, neg_hessian = log_marginal(posterior, x)
+    for _ in range(max_iter):
+        largest_move = 0.
+        for name in posterior.std_dev_names:
+            i = posterior.slices['u_' + name].start
+            up, down = x.copy(), x.copy()
+            up[i] += STD_DEV_STEP
+            down[i] -= STD_DEV_STEP
+            value_up = log_marginal(posterior, up)[0]
+            value_down = log_marginal(posterior, down)[0]
+            slope = (value_up - value_down) / (2 * STD_DEV_STEP)
+            curvature = (value_up - 2 * value + value_down) / STD_DEV_STEP ** 2
+            move = np.clip(-slope / curvature if curvature < 0 else np.sign(slope), -1, 1)
+            # halve the move until the marginal improves
+            while abs(move) > tol / 10:
+                candidate = x.copy()
+                candidate[i] += move
+                new_value, new_x, new_neg_hessian = log_marginal(posterior, candidate)
+                if new_value > value:
+                    value, x, neg_hessian = new_value, new_x, new_neg_hessian
+                    largest_move = max(largest_move, abs(move))
+                    break
+                move /= 2
+        if largest_move < tol:
+            break
+    return x, neg_hessian
+
+
+def laplace_covariance(neg_hessian, min_eigenvalue=1e-8):
+    """
+    :param neg_hessian: array, negative Hessian of the log posterior at the mode
+    :param min_eigenvalue: float, floor for its eigenvalues, in case the mode is flat in some direction
+    :return: covariance array
+    """
+    eigenvalues, eigenvectors = np.linalg.eigh(neg_hessian)
+    return (eigenvectors / np.maximum(eigenvalues, min_eigenvalue)).dot(eigenvectors.T)
+
+
+def sample_laplace(posterior, x, covariance, draws, random=np.random):
+    """
+    :param posterior: PiecewiseExponentialPosterior
+    :param x: array, unconstrained vector at the mode
+    :param covariance: array over posterior.free_indices(); the std_devs stay at their values in x
+    :param draws: int
+    :param random: RandomState
+    :return: array (draws, size) of unconstrained vectors
+    """
+    free = posterior.free_indices()
+    samples = np.tile(x, (draws, 1))
+    samples[:, free] += random.normal(size=(draws, len(free))).dot(np.linalg.cholesky(covariance).T)
+    return samples
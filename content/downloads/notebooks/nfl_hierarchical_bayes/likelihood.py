@@ -0,0 +1,80 @@
+import math
+
+import numpy as np
+
+
+class PiecewisePoissonLikelihood(object):
+    """
+    Log-likelihood of the piecewise exponential drive models, with deaths in each cell Poisson with mean
+
+        exposure * baseline_hazards[piece] * exp(sum of covariate coefficients + team effects)
+
+    The deaths * log(mean) part is linear in the coefficients, so it comes down to death totals per piece, covariate
+    and team, computed once.  Only the sum of the means needs a pass over the cells.  The log of exposure * exp(...)
+    is kept between calls and updated in place for the params that changed, which under Metropolis is usually one.
+    """
+    # recompute the linear predictor from scratch this often, so rounding errors from the updates can't build up
+    REFRESH_EVERY = 1000
+
+    def __init__(self, deaths, exposures, piece_i, covariates, team_effects):
+        """
+        :param deaths: array of deaths per cell
+        :param exposures: array of exposure yards per cell
+        :param piece_i: int array of the piece of each cell
+        :param covariates: dict of scalar param name to 0/1 array over cells
+        :param team_effects: dict of team param name to int array of the team of each cell
+        """
+        self.deaths = np.asarray(deaths, dtype=float)
+        self.log_exposures = np.log(exposures)
+        self.piece_i = np.asarray(piece_i)
+        self.covariate_cells = {name: np.flatnonzero(x) for name, x in covariates.items()}
+        self.team_effects = {name: np.asarray(teams) for name, teams in team_effects.items()}
+
+        self.constant = np.dot(self.deaths, self.log_exposures) - sum(math.lgamma(d + 1) for d in self.deaths)
+        self.deaths_by_piece = np.bincount(self.piece_i, self.deaths)
+        self.deaths_by_covariate = {name: self.deaths[cells].sum() for name, cells in self.covariate_cells.items()}
+        self.deaths_by_team = {name: np.bincount(teams, self.deaths) for name, teams in self.team_effects.items()}
+
+        self._log_means = None  # log(exposure) + linear predictor, without the baseline hazards
+        self._params = {}
+        self._updates = 0
+
+    def logp(self, baseline_hazards, **params):
+        """
+        :param baseline_hazards: array, one per piece
+        :param params: current values of every covariate and team effect param
+        :return: float log-likelihood
+        """
+        baseline_hazards = np.asarray(baseline_hazards, dtype=float)
+        if np.any(baseline_hazards <= 0):
+            return -np.inf
+        self._update_log_means(params)
+
+        expected = np.dot(baseline_hazards, np.bincount(self.piece_i, np.exp(self._log_means),
+                                                        minlength=len(baseline_hazards)))
+        observed = self.constant + np.dot(self.deaths_by_piece, np.log(baseline_hazards[:len(self.deaths_by_piece)]))
+        for name, total in self.deaths_by_covariate.items():
+            observed += params[name] * total
+        for name, totals in self.deaths_by_team.items():
+            observed += np.dot(totals, params[name][:len(totals)])
+        return float(observed - expected)
+
+    def _update_log_means(self, params):
+        if self._log_means is None or self._updates >= self.REFRESH_EVERY:
+            self._log_means = self.log_exposures.copy()
+            for name, cells in self.covariate_cells.items():
+                self._log_means[cells] += params[name]
+            for name, teams in self.team_effects.items():
+                self._log_means += params[name][teams]
+            self._updates = 0
+        else:
+            for name, cells in self.covariate_cells.items():
+                delta = params[name] - self._params[name]
+                if delta:
+                    self._log_means[cells] += delta
+            for name, teams in self.team_effects.items():
+                delta = params[name] - self._params[name]
+                if delta.any():
+                    self._log_means += delta[teams]
+            self._updates += 1
+        self._params = {name: np.array(value, dtype=float) for name, value in params.items()}
@@ -0,0 +1,245 @@
+import math
+
+import numpy as np
+
+# No-U-Turn sampler (Hoffman & Gelman 2014, algorithms 3 and 6) with a diagonal mass matrix.  During warmup the step
+# size is tuned by dual averaging to hit target_accept, and the mass matrix is set to the posterior variances seen
+# over a series of doubling windows, as Stan does.
+
+MAX_ENERGY_ERROR = 1000.
+# warmup windows: step size only for the first INITIAL_BUFFER and last TERMINAL_BUFFER iterations, mass matrix
+# windows in between starting at FIRST_WINDOW iterations
+INITIAL_BUFFER = 75
+TERMINAL_BUFFER = 50
+FIRST_WINDOW = 25
+# warmup that only tunes the step size can stop early, once its averaged step size moves by less than this fraction
+# over a FIRST_WINDOW of iterations
+SETTLED_STEP_SIZE_CHANGE = .02
+
+
+class NUTS(object):
+    """
+    A single chain.  Keeps its position and tuning between calls, so it can be warmed up and then sampled in
+    several goes.
+    """
+
+    def __init__(self, logp_and_grad, x0, step_size=None, inv_mass=None, target_accept=.8, max_depth=10, seed=None):
+        """
+        :param logp_and_grad: function of a position vector, returning (log density, gradient)
+        :param x0: starting position
+        :param step_size: float, or None to find one
+        :param inv_mass: array, diagonal of the inverse mass matrix (~ posterior variances), or None for ones
+        :param target_accept: float, mean acceptance statistic warmup aims for
+        :param max_depth: int, trees stop at 2 ** max_depth leapfrog steps
+        :param seed: int
+        """
+        self.logp_and_grad = logp_and_grad
+        self.gradient_evaluations = 0
+        self.random = np.random.RandomState(seed)
+        self.x = np.array(x0, dtype=float)
+        self.logp, self.grad = logp_and_grad(self.x)
+        if not np.isfinite(self.logp):
+            raise ValueError('Log density is not finite at the starting position.')
+        self.inv_mass = np.ones(len(self.x)) if inv_mass is None else np.array(inv_mass, dtype=float)
+        self.step_size = self.find_reasonable_step_size() if step_size is None else step_size
+        self.target_accept = target_accept
+        self.max_depth = max_depth
+
+    def find_reasonable_step_size(self):
+        step_size = 1.
+        r = self.random.normal(size=len(self.x)) / np.sqrt(self.inv_mass)
+        joint = self.logp - self._kinetic(r)
+        x, r_new, logp, grad = self._leapfrog(self.x, r, self.grad, step_size)
+        direction = 1 if logp - self._kinetic(r_new) - joint > math.log(.5) else -1
+        for _ in range(100):
+            x, r_new, logp, grad = self._leapfrog(self.x, r, self.grad, step_size)
+            log_ratio = logp - self._kinetic(r_new) - joint
+            if not np.isfinite(log_ratio) and direction == 1:
+                break
+            if direction * log_ratio <= direction * math.log(.5):
+                break
+            step_size *= 2. ** direction
+        return step_size
+
+    def warmup(self, n, adapt_mass=True, until_settled=False):
+        """
+        Tune step size (and the mass matrix, if adapt_mass and n is long enough) over n transitions.
+        :param n: int, most transitions
+        :param adapt_mass: bool
+        :param until_settled: bool, for step size only tuning: stop before n once the averaged step size settles
+        :return: array of the positions visited, shape (transitions run, dims)
+        """
+        windows = _mass_matrix_windows(n) if adapt_mass else []
+        window_ends = {end: start for start, end in windows}
+        positions = np.empty((n, len(self.x)))
+        dual_averaging = DualAveraging(self.step_size, self.target_accept)
+        last_step_size = None
+        for i in range(n):
+            accept_stat = self.transition(self.step_size)[0]
+            self.step_size = dual_averaging.update(accept_stat)
+            positions[i] = self.x
+            if i + 1 in window_ends:
+                count = i + 1 - window_ends[i + 1]
+                variances = positions[window_ends[i + 1]:i + 1].var(axis=0)
+                self.inv_mass = (count / (count + 5.)) * variances + 1e-3 * (5. / (count + 5.))
+                self.step_size = self.find_reasonable_step_size()
+                dual_averaging = DualAveraging(self.step_size, self.target_accept)
+            if until_settled and not windows and (i + 1) % FIRST_WINDOW == 0:
+                step_size = dual_averaging.final_step_size()
+                if last_step_size is not None and abs(step_size / last_step_size - 1) < SETTLED_STEP_SIZE_CHANGE:
+                    positions = positions[:i + 1]
+                    break
+                last_step_size = step_size
+        if len(positions):
+            self.step_size = dual_averaging.final_step_size()
+        return positions
+
+    def sample(self, n):
+        """
+        :param n: int
+        :return: dict with samples (n, dims), and per draw accept_stat, depth and diverged
+        """
+        samples = np.empty((n, len(self.x)))
+        stats = np.empty((n, 3))
+        for i in range(n):
+            stats[i] = self.transition(self.step_size)
+            samples[i] = self.x
+        return {'samples': samples, 'accept_stat': stats[:, 0], 'depth': stats[:, 1].astype(int),
+                'diverged': stats[:, 2].astype(bool)}
+
+    def transition(self, step_size):
+        """
+        One NUTS transition from the current position.
+        :param step_size: float
+        :return: (accept_stat, depth, diverged)
+        """
+        r0 = self.random.normal(size=len(self.x)) / np.sqrt(self.inv_mass)
+        joint0 = self.logp - self._kinetic(r0)
+        log_slice = joint0 + math.log(self.random.uniform())
+        minus = plus = (self.x, r0, self.grad)
+        n = 1
+        depth = 0
+        keep_going = True
+        while keep_going and depth < self.max_depth:
+            direction = 1 if self.random.uniform() < .5 else -1
+            if direction == -1:
+                tree = self._build_tree(minus, log_slice, direction, depth, step_size, joint0)
+                minus = tree.minus
+            else:
+                tree = self._build_tree(plus, log_slice, direction, depth, step_size, joint0)
+                plus = tree.plus
+            if tree.keep_going and self.random.uniform() < float(tree.n) / n:
+                self.x, self.logp, self.grad = tree.proposal
+            n += tree.n
+            keep_going = tree.keep_going and self._no_u_turn(minus, plus)
+            depth += 1
+        return tree.accept_stat_sum / tree.accept_stat_count, depth, tree.diverged
+
+    def _build_tree(self, end, log_slice, direction, depth, step_size, joint0):
+        if depth == 0:
+            x, r, logp, grad = self._leapfrog(end[0], end[1], end[2], direction * step_size)
+            joint = logp - self._kinetic(r)
+            if not np.isfinite(joint):
+                joint = -np.inf
+            diverged = joint - log_slice < -MAX_ENERGY_ERROR
+            tree = _Tree((x, r, grad), (x, logp, grad), int(log_slice <= joint), not diverged,
+                         min(1., math.exp(min(0., joint - joint0))), 1)
+            tree.diverged = diverged
+            return tree
+
+        tree = self._build_tree(end, log_slice, direction, depth - 1, step_size, joint0)
+        if not tree.keep_going:
+            return tree
+        if direction == -1:
+            other = self._build_tree(tree.minus, log_slice, direction, depth - 1, step_size, joint0)
+            tree.minus = other.minus
+        else:
+            other = self._build_tree(tree.plus, log_slice, direction, depth - 1, step_size, joint0)
+            tree.plus = other.plus
+        if other.n and self.random.uniform() < float(other.n) / (tree.n + other.n):
+            tree.proposal = other.proposal
+        tree.n += other.n
+        tree.accept_stat_sum += other.accept_stat_sum
+        tree.accept_stat_count += other.accept_stat_count
+        tree.diverged = tree.diverged or other.diverged
+        tree.keep_going = other.keep_going and self._no_u_turn(tree.minus, tree.plus)
+        return tree
+
+    def _leapfrog(self, x, r, grad, step_size):
+        self.gradient_evaluations += 1
+        r = r + .5 * step_size * grad
+        x = x + step_size * self.inv_mass * r
+        logp, grad = self.logp_and_grad(x)
+        r = r + .5 * step_size * grad
+        return x, r, logp, grad
+
+    def _kinetic(self, r):
+        return .5 * np.dot(r * self.inv_mass, r)
+
+    def _no_u_turn(self, minus, plus):
+        dx = plus[0] - minus[0]
+        return np.dot(dx, self.inv_mass * minus[1]) >= 0 and np.dot(dx, self.inv_mass * plus[1]) >= 0
+
+
+class _Tree(object):
+    __slots__ = ['minus', 'plus', 'proposal', 'n', 'keep_going', 'accept_stat_sum', 'accept_stat_count', 'diverged']
+
+    def __init__(self, end, proposal, n, keep_going, accept_stat_sum, accept_stat_count):
+        # end is (x, r, grad); both ends are the same leaf until the tree grows
+        self.minus = self.plus = end
+        self.proposal = proposal
+        self.n = n
+        self.keep_going = keep_going
+        self.accept_stat_sum = accept_stat_sum
+        self.accept_stat_count = accept_stat_count
+        self.diverged = False
+
+
+class DualAveraging(object):
+    """
+    Step size tuning of Hoffman & Gelman 2014, section 3.2.
+    """
+
+    def __init__(self, step_size, target_accept, gamma=.05, t0=10., kappa=.75):
+        self.mu = math.log(10 * step_size)
+        self.target_accept = target_accept
+        self.gamma, self.t0, self.kappa = gamma, t0, kappa
+        self.m = 0
+        self.h_bar = 0.
+        self.log_step_size_bar = 0.
+
+    def update(self, accept_stat):
+        """
+        :param accept_stat: float, mean acceptance statistic of the last transition
+        :return: float step size for the next transition
+        """
+        self.m += 1
+        eta = 1. / (self.m + self.t0)
+        self.h_bar = (1 - eta) * self.h_bar + eta * (self.target_accept - accept_stat)
+        log_step_size = self.mu - math.sqrt(self.m) / self.gamma * self.h_bar
+        weight = self.m ** -self.kappa
+        self.log_step_size_bar = weight * log_step_size + (1 - weight) * self.log_step_size_bar
+        return math.exp(log_step_size)
+
+    def final_step_size(self):
+        return math.exp(self.log_step_size_bar)
+
+
+def _mass_matrix_windows(n):
+    """
+    :param n: int warmup length
+    :return: list of (start, end) iterations, each a window the mass matrix is estimated over
+    """
+    if n < INITIAL_BUFFER + FIRST_WINDOW + TERMINAL_BUFFER:
+        return []
+    windows = []
+    start, size = INITIAL_BUFFER, FIRST_WINDOW
+    last_end = n - TERMINAL_BUFFER
+    while start < last_end:
+        end = start + size
+        # stretch the last window to the terminal buffer rather than leave a short one
+        if end + 2 * size > last_end:
+            end = last_end
+        windows.append((start, end))
+        start, size = end, 2 * size
+    return windows
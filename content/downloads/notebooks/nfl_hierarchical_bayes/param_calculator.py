@@ -1,5 +1,44 @@
+import weakref
+
 import numpy as np
 
+# model -> {(node name, team_specific): trace array}.  Weakly keyed, so the traces (and a TraceStore's memory maps)
+# go when the model does.
+_TRACE_CACHE = weakref.WeakKeyDictionary()
+
+
+def load_trace(model, name, team_specific=False):
+    """
+    Read a node's trace once into a contiguous array, and reuse it for every ParamCalculator built on the same model.
+    Traces from a TraceStore are used in place, memory-mapped, without a copy.
+    :param model: fitted pymc MCMC object, Traces or TraceStore
+    :param name: str node name
+    :param team_specific: bool, tack on the median team as an extra column
+    :return: array of shape (draws,) or (draws, ...)
+    """
+    traces = _TRACE_CACHE.setdefault(model, {})
+    key = (name, team_specific)
+    if key not in traces:
+        trace = model.with_median_team(name) if team_specific and hasattr(model, 'with_median_team') else None
+        if trace is None:
+            trace = np.asarray(getattr(model, name).gettrace())
+            if trace.dtype.kind != 'f':
+                trace = trace.astype(float)
+            if team_specific:
+                trace = tack_on_median_team(trace)
+        traces[key] = np.ascontiguousarray(trace)
+    return traces[key]
+
+
+def tack_on_median_team(trace):
+    """
+    Create a 33rd "team" representing the median team.  We'll use this median team to assess team quality and
+    strength of schedule.
+    :param trace: array of shape (draws, teams)
+    :return: array of shape (draws, teams + 1)
+    """
+    return np.column_stack([trace, np.median(trace, axis=1)])
+
 
 class ParamCalculator(object):
     """
@@ -7,82 +46,114 @@ class ParamCalculator(object):
     Some turnover models take into account defense takeaway propensity, others don't.
     The idea is to have one simulation function, and have these classes
     do the work of providing the appropriate parameters.
+
+    Traces are loaded once per model into (draws x ...) arrays, with the median team already tacked onto the
+    team-specific params, so a draw is just a row index.
     """
+    EX_TURNOVER_PARAMS = ['atts', 'atts_rz', 'defs', 'defs_rz', 'home', 'baseline_hazards', 'two_minute_drill',
+                          'offense_losing_badly', 'offense_winning_greatly']
+    TURNOVER_PARAMS = ['atts', 'defs', 'home', 'baseline_hazards', 'two_minute_drill', 'offense_losing_badly',
+                       'offense_winning_greatly']
+    EX_TURNOVER_TEAM_SPECIFIC_PARAMS = ['atts', 'atts_rz', 'defs', 'defs_rz', 'home']
+    TURNOVER_TEAM_SPECIFIC_PARAMS = ['atts', 'defs']
 
     def __init__(self, ex_turnover, turnover):
         self.ex_turnover = ex_turnover
         self.turnover = turnover
+        self.ex_t_traces = self.load_traces(ex_turnover, self.EX_TURNOVER_PARAMS, self.EX_TURNOVER_TEAM_SPECIFIC_PARAMS)
+        self.t_traces = self.load_traces(turnover, self.TURNOVER_PARAMS, self.TURNOVER_TEAM_SPECIFIC_PARAMS)
         self.ex_t = {}
         self.t = {}
+        self.ex_t_draw = None
+        self.t_draw = None
         self.i_home = None
         self.i_away = None
 
-    def re_draw_sample(self):
-        self.ex_t = self.re_draw_ex_turnover_sample()
-        self.t = self.re_draw_turnover_sample()
-        self.tack_on_median_team()
-
-    def re_draw_ex_turnover_sample(self):
-        num_samples = self.ex_turnover.atts.gettrace().shape[0]
-        draw = np.random.randint(0, num_samples)
-        return {'atts': self.ex_turnover.atts.gettrace()[draw, :],
-                'atts_rz': self.ex_turnover.atts_rz.gettrace()[draw, :],
-                'defs': self.ex_turnover.defs.gettrace()[draw, :],
-                'defs_rz': self.ex_turnover.defs_rz.gettrace()[draw, :],
-                'home': self.ex_turnover.home.gettrace()[draw, :],
-                'baseline_hazards': self.ex_turnover.baseline_hazards.gettrace()[draw, :],
-                'two_minute_drill': self.ex_turnover.two_minute_drill.gettrace()[draw],
-                'offense_losing_badly': self.ex_turnover.offense_losing_badly.gettrace()[draw],
-                'offense_winning_greatly': self.ex_turnover.offense_winning_greatly.gettrace()[draw]}
-
-    def re_draw_turnover_sample(self):
-        num_samples = self.turnover.atts.gettrace().shape[0]
-        draw = np.random.randint(0, num_samples)
-        return {'atts': self.turnover.atts.gettrace()[draw, :],
-                'defs': self.turnover.defs.gettrace()[draw, :],
-                'home': self.turnover.home.gettrace()[draw],
-                'baseline_hazards': self.turnover.baseline_hazards.gettrace()[draw, :],
-                'two_minute_drill': self.turnover.two_minute_drill.gettrace()[draw],
-                'offense_losing_badly': self.turnover.offense_losing_badly.gettrace()[draw],
-                'offense_winning_greatly': self.turnover.offense_winning_greatly.gettrace()[draw]}
-
-
-    def tack_on_median_team(self):
+    @staticmethod
+    def load_traces(model, params, team_specific_params):
+        return {param: load_trace(model, param, param in team_specific_params) for param in params}
+
+    def re_draw_sample(self, size=None):
         """
-        Create a 33rd "team" representing the median team.  We'll use this median team to assess team quality and
-        strength of schedule.
-        :param ex_turnover_params:
-        :param turnover_params:
-        :return:
+        :param size: None for a single draw, or int to draw a batch; params then get a leading axis of that length.
         """
-        for team_specific_param in ['atts', 'atts_rz', 'defs', 'defs_rz', 'home']:
-            if team_specific_param in self.ex_t:
-                self.ex_t[team_specific_param] = np.append(self.ex_t[team_specific_param],
-                                                           np.median(self.ex_t[team_specific_param]))
+        self.ex_t = self.re_draw_ex_turnover_sample(size)
+        self.t = self.re_draw_turnover_sample(size)
 
-        for team_specific_param in ['atts', 'defs']:
-            if team_specific_param in self.t:
-                self.t[team_specific_param] = np.append(self.t[team_specific_param],
-                                                        np.median(self.t[team_specific_param]))
+    def re_draw_ex_turnover_sample(self, size=None):
+        num_samples = self.ex_t_traces['atts'].shape[0]
+        self.ex_t_draw = np.random.randint(0, num_samples, size)
+        return {param: trace[self.ex_t_draw] for param, trace in self.ex_t_traces.items()}
 
+    def re_draw_turnover_sample(self, size=None):
+        num_samples = self.t_traces['atts'].shape[0]
+        self.t_draw = np.random.randint(0, num_samples, size)
+        return {param: trace[self.t_draw] for param, trace in self.t_traces.items()}
+
+    def use_sample(self, ex_t_draw, t_draw):
+        """
+        Use the given draws rather than random ones, e.g. to play several matchups on the same draws.
+        :param ex_t_draw: int, or array of ints for a batch, row(s) of the ex-turnover traces
+        :param t_draw: int, or array of ints for a batch, row(s) of the turnover traces
+        """
+        self.ex_t_draw = ex_t_draw
+        self.t_draw = t_draw
+        self.ex_t = {param: trace[ex_t_draw] for param, trace in self.ex_t_traces.items()}
+        self.t = {param: trace[t_draw] for param, trace in self.t_traces.items()}
 
+    def num_samples(self):
+        """
+        :return: (number of ex-turnover draws, number of turnover draws)
+        """
+        return self.ex_t_traces['atts'].shape[0], self.t_traces['atts'].shape[0]
+
+    def draw_batch(self, n):
+        """
+        Draw n samples for the current matchup and stack the params simulate_game_batch() needs into arrays.
+        :param n: int number of games
+        :return: dict of arrays, see batch_params()
+        """
+        self.re_draw_sample(size=n)
+        return self.batch_params()
+
+    def batch_params(self):
+        """
+        Stack the params simulate_game_batch() needs for the current matchup and batch of draws into arrays.  Offense
+        specific params have shape (n, 2): column 0 when home has the ball, column 1 when away has it.
+        :return: dict of arrays
+        """
+        return {'xb': np.column_stack([self.home_xb(), self.away_xb()]),
+                'xb_rz': np.column_stack([self.home_xb_rz(), self.away_xb_rz()]),
+                'xb_turn': np.column_stack([self.home_turnover_xb(), self.away_turnover_xb()]),
+                'ex_t_offense_winning_greatly': self.ex_t_offense_winning_greatly(),
+                't_offense_winning_greatly': self.t_offense_winning_greatly(),
+                'ex_t_offense_losing_badly': self.ex_t_offense_losing_badly(),
+                't_offense_losing_badly': self.t_offense_losing_badly(),
+                'ex_t_two_minute_drill': self.ex_t_two_minute_drill(),
+                't_two_minute_drill': self.t_two_minute_drill(),
+                'ex_t_baseline_hazards': self.ex_t_baseline_hazards(),
+                't_baseline_hazards': self.t_baseline_hazards()}
+
+    # team-specific params are indexed on the last axis, so these work for single draws and batches alike.
     def home_xb(self):
-        return self.ex_t['atts'][self.i_home] + self.ex_t['defs'][self.i_away]
+        return self.ex_t['atts'][..., self.i_home] + self.ex_t['defs'][..., self.i_away]
 
     def home_xb_rz(self):
-        return self.ex_t['atts_rz'][self.i_home] + self.ex_t['defs_rz'][self.i_away]
+        return self.ex_t['atts_rz'][..., self.i_home] + self.ex_t['defs_rz'][..., self.i_away]
 
     def away_xb(self):
-        return self.ex_t['atts'][self.i_away] + self.ex_t['defs'][self.i_home] + self.ex_t['home'][self.i_home]
+        return self.ex_t['atts'][..., self.i_away] + self.ex_t['defs'][..., self.i_home] + \
+               self.ex_t['home'][..., self.i_home]
 
     def away_xb_rz(self):
-        return self.ex_t['atts_rz'][self.i_away] + self.ex_t['defs_rz'][self.i_home] + self.ex_t['home'][self.i_home]
+        return self.ex_t['atts_rz'][..., self.i_away] + self.ex_t['defs_rz'][..., self.i_home] + \
+               self.ex_t['home'][..., self.i_home]
 
     def home_turnover_xb(self):
-        return self.t['atts'][self.i_home] + self.t['defs'][self.i_away]
+        return self.t['atts'][..., self.i_home] + self.t['defs'][..., self.i_away]
 
     def away_turnover_xb(self):
-        return self.t['atts'][self.i_away] + self.t['defs'][self.i_home] + self.t['home']
+        return self.t['atts'][..., self.i_away] + self.t['defs'][..., self.i_home] + self.t['home']
 
     def ex_t_offense_winning_greatly(self):
         return self.ex_t['offense_winning_greatly']
@@ -113,33 +184,29 @@ class ParamCalculatorNoTurnoverDefense(ParamCalculator):
     """
     No defense takeaway-propensity in the turnover model.
     """
+    TURNOVER_PARAMS = ['atts', 'home', 'baseline_hazards', 'two_minute_drill', 'offense_losing_badly',
+                       'offense_winning_greatly']
+    TURNOVER_TEAM_SPECIFIC_PARAMS = ['atts']
 
     def __init__(self, ex_turnover, turnover):
         super(ParamCalculatorNoTurnoverDefense, self).__init__(ex_turnover, turnover)
 
-
-    def re_draw_turnover_sample(self):
-        num_samples = self.turnover.atts.gettrace().shape[0]
-        draw = np.random.randint(0, num_samples)
-        return {'atts': self.turnover.atts.gettrace()[draw, :],
-                'home': self.turnover.home.gettrace()[draw],
-                'baseline_hazards': self.turnover.baseline_hazards.gettrace()[draw, :],
-                'two_minute_drill': self.turnover.two_minute_drill.gettrace()[draw],
-                'offense_losing_badly': self.turnover.offense_losing_badly.gettrace()[draw],
-                'offense_winning_greatly': self.turnover.offense_winning_greatly.gettrace()[draw]}
-
     def home_turnover_xb(self):
-        return self.t['atts'][self.i_home]
+        # a copy: simulate_drive() adds to xb_turn in place, and a view would write into the trace
+        return np.take(self.t['atts'], self.i_home, axis=-1)
 
 
     def away_turnover_xb(self):
-        return self.t['atts'][self.i_away] + self.t['home']
+        return self.t['atts'][..., self.i_away] + self.t['home']
 
 
 class ParamCalculatorNoRZ(ParamCalculator):
     """
     Redzone is identical to other pieces in terms of team-specific attack/defense/params.
     """
+    EX_TURNOVER_PARAMS = ['atts', 'defs', 'home', 'baseline_hazards', 'two_minute_drill', 'offense_losing_badly',
+                          'offense_winning_greatly']
+    EX_TURNOVER_TEAM_SPECIFIC_PARAMS = ['atts', 'defs', 'home']
 
     def __init__(self, ex_turnover, turnover):
         super(ParamCalculatorNoRZ, self).__init__(ex_turnover, turnover)
@@ -150,17 +217,6 @@ class ParamCalculatorNoRZ(ParamCalculator):
     def away_xb_rz(self):
         return self.away_xb()
 
-    def re_draw_ex_turnover_sample(self):
-        num_samples = self.ex_turnover.atts.gettrace().shape[0]
-        draw = np.random.randint(0, num_samples)
-        return {'atts': self.ex_turnover.atts.gettrace()[draw, :],
-                'defs': self.ex_turnover.defs.gettrace()[draw, :],
-                'home': self.ex_turnover.home.gettrace()[draw, :],
-                'baseline_hazards': self.ex_turnover.baseline_hazards.gettrace()[draw, :],
-                'two_minute_drill': self.ex_turnover.two_minute_drill.gettrace()[draw],
-                'offense_losing_badly': self.ex_turnover.offense_losing_badly.gettrace()[draw],
-                'offense_winning_greatly': self.ex_turnover.offense_winning_greatly.gettrace()[draw]}
-
 
 class ParamCalculatorNoRZNoTurnoverDefense(ParamCalculatorNoRZ, ParamCalculatorNoTurnoverDefense):
     def __init__(self, ex_turnover, turnover):
@@ -170,24 +226,6 @@ class ParamCalculatorNoRZNoTurnoverDefense(ParamCalculatorNoRZ, ParamCalculatorN
 class ParamCalculatorNoRZNoTurnoverDefenseNeutralField(ParamCalculatorNoRZ, ParamCalculatorNoTurnoverDefense):
     def __init__(self, ex_turnover, turnover):
         super(ParamCalculatorNoRZNoTurnoverDefenseNeutralField, self).__init__(ex_turnover, turnover)
-
-    def re_draw_ex_turnover_sample(self):
-        num_samples = self.ex_turnover.atts.gettrace().shape[0]
-        draw = np.random.randint(0, num_samples)
-        return {'atts': self.ex_turnover.atts.gettrace()[draw, :],
-                'defs': self.ex_turnover.defs.gettrace()[draw, :],
-                'home': np.zeros(32),
-                'baseline_hazards': self.ex_turnover.baseline_hazards.gettrace()[draw, :],
-                'two_minute_drill': self.ex_turnover.two_minute_drill.gettrace()[draw],
-                'offense_losing_badly': self.ex_turnover.offense_losing_badly.gettrace()[draw],
-                'offense_winning_greatly': self.ex_turnover.offense_winning_greatly.gettrace()[draw]}
-
-    def re_draw_turnover_sample(self):
-        num_samples = self.turnover.atts.gettrace().shape[0]
-        draw = np.random.randint(0, num_samples)
-        return {'atts': self.turnover.atts.gettrace()[draw, :],
-                'home': 0,
-                'baseline_hazards': self.turnover.baseline_hazards.gettrace()[draw, :],
-                'two_minute_drill': self.turnover.two_minute_drill.gettrace()[draw],
-                'offense_losing_badly': self.turnover.offense_losing_badly.gettrace()[draw],
-                'offense_winning_greatly': self.turnover.offense_winning_greatly.gettrace()[draw]}
\ No newline at end of file
+        # same traces as the other calculators, with the home field advantage masked out.
+        self.ex_t_traces = dict(self.ex_t_traces, home=np.zeros_like(self.ex_t_traces['home']))
+        self.t_traces = dict(self.t_traces, home=np.zeros_like(self.t_traces['home']))
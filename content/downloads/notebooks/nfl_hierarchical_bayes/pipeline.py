@@ -0,0 +1,127 @@
+import hashlib
+import inspect
+import os
+
+from . import PIECES, LOSING_BADLY_THRESHOLD, data_prep, columnar, sufficient_stats, team_index
+from .columnar import write_frame, read_frame
+
+# Run the data_prep chain from a play-by-play file to piecewise counts, caching every stage's output on disk.
+#
+# Each stage's cache key hashes its upstream stage's key, the stage function's source, any input files it reads,
+# PIECES and LOSING_BADLY_THRESHOLD - so the chain is content-addressed, and only the stages downstream of a change
+# are recomputed.  The stages lean on helpers and constants (description tags, the column-wise yards and points,
+# the team index), so every key also hashes the source of the modules those live in, and the team index's slugs
+# and aliases.  Editing any of them recomputes the whole chain.
+
+CACHE_DIR = os.path.join(data_prep.DATA_DIR, 'cache/')
+
+# (name, function, names of the outputs it returns)
+STAGES = [('enrich_play_level_df', data_prep.enrich_play_level_df, ['df']),
+          ('merge_in_game_level_dataset', data_prep.merge_in_game_level_dataset, ['df']),
+          ('calculate_game_score_at_play_start', data_prep.calculate_game_score_at_play_start, ['df']),
+          ('generate_drive_df', data_prep.generate_drive_df, ['df_drive']),
+          ('index_with_team_indexes', data_prep.index_with_team_indexes, ['df_drive', 'teams']),
+          ('remove_unexplained_drives', data_prep.remove_unexplained_drives, ['df_drive']),
+          ('enrich_drive_level_df', data_prep.enrich_drive_level_df, ['df_drive']),
+          ('remove_end_of_half_and_kneel_drives', data_prep.remove_end_of_half_and_kneel_drives, ['df_drive']),
+          ('generate_piecewise_df', data_prep.generate_piecewise_df, ['df_pw']),
+          ('generate_piecewise_counts_df', data_prep.generate_piecewise_counts_df, ['df_counts'])]
+# modules the stages' helpers live in
+CODE_MODULES = [data_prep, columnar, sufficient_stats, team_index]
+# the outputs run_pipeline() returns, and the stage each comes from last
+RESULTS = {'teams': 'index_with_team_indexes',
+           'df_drive': 'remove_end_of_half_and_kneel_drives',
+           'df_counts': 'generate_piecewise_counts_df'}
+
+
+def run_pipeline(pbp_file, game_level_dataset=data_prep.GAME_LEVEL_DATASET_2014, cache_dir=CACHE_DIR, force=False,
+                 workers=1):
+    """
+    :param pbp_file: str path to play-by-play csv from http://nflsavant.com/about.php
+    :param game_level_dataset: str path to game level dataset
+    :param cache_dir: str
+    :param force: bool, recompute every stage
+    :param workers: int, processes for play enrichment.  Doesn't change any output, so isn't part of the cache keys.
+    :return: dict with df_drive, teams and df_counts
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    stage_args = {'merge_in_game_level_dataset': [game_level_dataset]}
+    stage_kwargs = {'enrich_play_level_df': {'workers': workers}}
+    keys = []
+    key = file_digest(pbp_file)
+    code = code_digest()
+    for name, func, outputs in STAGES:
+        key = digest(key, inspect.getsource(func), [file_digest(f) for f in stage_args.get(name, [])], PIECES,
+                     LOSING_BADLY_THRESHOLD, code)
+        keys.append(key)
+
+    stage_i = {name: i for i, (name, func, outputs) in enumerate(STAGES)}
+
+    def cache_path(i, output):
+        return os.path.join(cache_dir, '%s-%s-%s.parquet' % (STAGES[i][0], output, keys[i][:16]))
+
+    def resumable(i):
+        # the stage's outputs, and any results from earlier stages that won't be run again, are all on disk
+        needed = [(i, output) for output in STAGES[i][2]] + \
+                 [(stage_i[name], output) for output, name in RESULTS.items() if stage_i[name] < i]
+        return all(os.path.exists(cache_path(j, output)) for j, output in needed)
+
+    # resume after the last stage already in the cache
+    frames = {}
+    last_cached = -1
+    if not force:
+        for i in range(len(STAGES) - 1, -1, -1):
+            if resumable(i):
+                last_cached = i
+                break
+    if last_cached >= 0:
+        frames.update({output: read_frame(cache_path(last_cached, output)) for output in STAGES[last_cached][2]})
+    else:
+        frames['df'] = data_prep.load_play_by_play(pbp_file)
+
+    for i in range(last_cached + 1, len(STAGES)):
+        name, func, outputs = STAGES[i]
+        print 'Running %s.' % name
+        result = func(frames[_input_name(i)], *stage_args.get(name, []), **stage_kwargs.get(name, {}))
+        result = result if isinstance(result, tuple) else (result,)
+        for output, frame in zip(outputs, result):
+            write_frame(frame, cache_path(i, output))
+            frames[output] = frame
+
+    # results from stages before the resume point, which resumable() made sure are cached
+    for output, name in RESULTS.items():
+        if stage_i[name] < last_cached:
+            frames[output] = read_frame(cache_path(stage_i[name], output))
+    return {output: frames[output] for output in RESULTS}
+
+
+def _input_name(i):
+    """
+    Stages take the main output of the stage before them.
+    """
+    return STAGES[i - 1][2][0] if i else 'df'
+
+
+def code_digest():
+    """
+    :return: str hash of the source of CODE_MODULES and of the team index's numbering
+    """
+    return digest([inspect.getsource(module) for module in CODE_MODULES], team_index.TEAM_INDEX.slugs,
+                  sorted(team_index.TEAM_INDEX.aliases.items()))
+
+
+def digest(*parts):
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(repr(part))
+    return h.hexdigest()
+
+
+def file_digest(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
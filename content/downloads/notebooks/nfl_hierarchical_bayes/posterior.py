@@ -0,0 +1,266 @@
+import math
+
+import numpy as np
+
+# The hierarchical piecewise exponential models of fit_turn.py, as a log posterior with an analytic gradient, for
+# samplers and optimizers other than pymc's.  Same priors:
+#   baseline_hazards, covariate coefficients ~ Normal(0, tau=.0001)
+#   std_dev_* ~ Uniform(0, 50), with tau = std_dev ** -2 capped at 10000 by the limit_tau potential
+#   team effects *_star ~ Normal(0, tau), then centered to sum to zero
+#   deaths ~ Poisson(exposure * baseline_hazards[piece] * exp(covariates * coefficients + team effects))
+#
+# Params live in an unconstrained vector: log baseline hazards, coefficients, team effects as z-scores times their
+# std_dev (the same model, with better geometry for gradient-based samplers), and std_devs through a logistic map
+# onto their allowed range.
+
+PRIOR_TAU = .0001
+STD_DEV_LOWER = 10000 ** -.5
+STD_DEV_UPPER = 50.
+
+
+class TeamEffect(object):
+    """
+    A team-specific param added to the linear predictor of every cell, centered to sum to zero.
+    """
+
+    def __init__(self, name, std_dev, teams):
+        """
+        :param name: str node name, e.g. 'atts'.  The uncentered version is name + '_star'.
+        :param std_dev: str name of its std_dev hyperprior, e.g. 'std_dev_att'
+        :param teams: int array, the team of each cell
+        """
+        self.name = name
+        self.std_dev = std_dev
+        self.teams = np.asarray(teams)
+
+
+class PiecewiseExponentialPosterior(object):
+    """
+    Log posterior of a hierarchical piecewise exponential model over a flat vector of unconstrained params.
+    """
+
+    def __init__(self, deaths, exposures, piece_i, num_pieces, covariates, team_effects, num_teams):
+        """
+        :param deaths: array of deaths per cell
+        :param exposures: array of exposure yards per cell
+        :param piece_i: int array of the piece of each cell
+        :param num_pieces: int
+        :param covariates: list of (coefficient name, 0/1 array over cells)
+        :param team_effects: list of TeamEffect
+        :param num_teams: int
+        """
+        self.deaths = np.asarray(deaths, dtype=float)
+        self.log_exposures = np.log(exposures)
+        self.piece_i = np.asarray(piece_i)
+        self.num_pieces = num_pieces
+        self.num_teams = num_teams
+        self.covariate_names = [name for name, x in covariates]
+        self.covariates = np.column_stack([np.asarray(x, dtype=float) for name, x in covariates] or
+                                          [np.zeros((len(self.deaths), 0))])
+        self.team_effects = team_effects
+        self.std_dev_names = sorted(set(effect.std_dev for effect in team_effects))
+        self.constant = -sum(math.lgamma(d + 1) for d in self.deaths)
+
+        # layout of the unconstrained vector
+        sizes = [('log_baseline_hazards', num_pieces), ('coefficients', len(self.covariate_names))]
+        sizes += [('z_' + effect.name, num_teams) for effect in team_effects]
+        sizes += [('u_' + name, 1) for name in self.std_dev_names]
+        self.slices = {}
+        start = 0
+        for name, size in sizes:
+            self.slices[name] = slice(start, start + size)
+            start += size
+        self.size = start
+
+    def unpack(self, x):
+        """
+        :param x: unconstrained vector
+        :return: dict of node values: baseline_hazards, each coefficient, std_devs and their taus, and each team
+                 effect before (name + '_star') and after centering
+        """
+        params = {'baseline_hazards': np.exp(x[self.slices['log_baseline_hazards']])}
+        params.update(zip(self.covariate_names, x[self.slices['coefficients']]))
+        for name in self.std_dev_names:
+            params[name] = _std_dev(x[self.slices['u_' + name]][0])
+            params[name.replace('std_dev', 'tau')] = params[name] ** -2
+        for effect in self.team_effects:
+            star = params[effect.std_dev] * x[self.slices['z_' + effect.name]]
+            params[effect.name + '_star'] = star
+            params[effect.name] = star - star.mean()
+        return params
+
+    def pack(self, params):
+        """
+        Inverse of unpack().
+        :param params: dict with baseline_hazards, each coefficient, std_dev and team effect's _star
+        :return: unconstrained vector
+        """
+        x = np.zeros(self.size)
+        x[self.slices['log_baseline_hazards']] = np.log(params['baseline_hazards'])
+        x[self.slices['coefficients']] = [params[name] for name in self.covariate_names]
+        for name in self.std_dev_names:
+            p = (np.clip(params[name], STD_DEV_LOWER * 1.001, STD_DEV_UPPER * .999) - STD_DEV_LOWER) / \
+                (STD_DEV_UPPER - STD_DEV_LOWER)
+            x[self.slices['u_' + name]] = np.log(p / (1 - p))
+        for effect in self.team_effects:
+            x[self.slices['z_' + effect.name]] = params[effect.name + '_star'] / params[effect.std_dev]
+        return x
+
+    def pack_traces(self, fit):
+        """
+        :param fit: a previous fit of the same model: Traces, TraceStore, or a fitted pymc MCMC object
+        :return: array of its draws as unconstrained vectors, one row per draw
+        """
+        names = ['baseline_hazards'] + self.covariate_names + self.std_dev_names + \
+                [effect.name + '_star' for effect in self.team_effects]
+        traces = {name: np.asarray(getattr(fit, name).gettrace(), dtype=float) for name in names}
+        return np.array([self.pack({name: trace[i] for name, trace in traces.items()})
+                         for i in range(len(traces['baseline_hazards']))])
+
+    def initial_point(self):
+        """
+        Starting values like fit_turn.py's: empirical baseline hazards, zero coefficients and team effects.
+        """
+        deaths = np.bincount(self.piece_i, self.deaths, minlength=self.num_pieces)
+        exposures = np.bincount(self.piece_i, np.exp(self.log_exposures), minlength=self.num_pieces)
+        params = {'baseline_hazards': np.maximum(deaths, .5) / exposures}
+        params.update((name, 0.) for name in self.covariate_names)
+        params.update((name, 1.) for name in self.std_dev_names)
+        params.update((effect.name + '_star', np.zeros(self.num_teams)) for effect in self.team_effects)
+        return self.pack(params)
+
+    def logp(self, x):
+        return self.logp_and_grad(x)[0]
+
+    def logp_and_grad(self, x):
+        """
+        :param x: unconstrained vector
+        :return: (log posterior, up to a constant, gradient)
+        """
+        grad = np.zeros(self.size)
+        log_baseline_hazards = x[self.slices['log_baseline_hazards']]
+        coefficients = x[self.slices['coefficients']]
+        std_devs = {name: _std_dev(x[self.slices['u_' + name]][0]) for name in self.std_dev_names}
+
+        eta = self.log_exposures + log_baseline_hazards[self.piece_i] + self.covariates.dot(coefficients)
+        for effect in self.team_effects:
+            star = std_devs[effect.std_dev] * x[self.slices['z_' + effect.name]]
+            eta += (star - star.mean())[effect.teams]
+        with np.errstate(over='ignore'):
+            means = np.exp(eta)
+        if not np.isfinite(means).all():
+            return -np.inf, grad
+        residuals = self.deaths - means
+        logp = np.dot(self.deaths, eta) - means.sum() + self.constant
+
+        # priors, with the log jacobian of the baseline hazards' log transform
+        baseline_hazards = np.exp(log_baseline_hazards)
+        logp += -.5 * PRIOR_TAU * (np.dot(baseline_hazards, baseline_hazards) + np.dot(coefficients, coefficients))
+        logp += log_baseline_hazards.sum()
+        grad[self.slices['log_baseline_hazards']] = np.bincount(self.piece_i, residuals, minlength=self.num_pieces) - \
+                                                    PRIOR_TAU * baseline_hazards ** 2 + 1
+        grad[self.slices['coefficients']] = self.covariates.T.dot(residuals) - PRIOR_TAU * coefficients
+
+        for effect in self.team_effects:
+            z_slice, u_slice = self.slices['z_' + effect.name], self.slices['u_' + effect.std_dev]
+            z = x[z_slice]
+            grad_values = np.bincount(effect.teams, residuals, minlength=self.num_teams)
+            grad_star = grad_values - grad_values.mean()
+            logp -= .5 * np.dot(z, z)
+            grad[z_slice] = std_devs[effect.std_dev] * grad_star - z
+            grad[u_slice] += np.dot(z, grad_star) * _std_dev_derivative(x[u_slice][0])
+
+        # uniform std_dev priors, through the logistic map
+        for name in self.std_dev_names:
+            u = x[self.slices['u_' + name]][0]
+            logp += _log_sigmoid(u) + _log_sigmoid(-u)
+            grad[self.slices['u_' + name]] += 1 - 2 * _sigmoid(u)
+        return logp, grad
+
+    def free_indices(self):
+        """
+        :return: int array, indices of every param but the std_devs
+        """
+        return np.arange(self.size - len(self.std_dev_names))
+
+    def hessian_given_std_devs(self, x):
+        """
+        Hessian of the log posterior over free_indices(), holding the std_devs fixed.  Given them the model is a
+        Poisson regression, so it's exact: the design matrix weighted by the Poisson means, plus the priors.
+        :param x: unconstrained vector
+        :return: symmetric array
+        """
+        std_devs = {name: _std_dev(x[self.slices['u_' + name]][0]) for name in self.std_dev_names}
+        num_cells = len(self.deaths)
+        design = [np.eye(self.num_pieces)[self.piece_i], self.covariates]
+        eta = self.log_exposures + x[self.slices['log_baseline_hazards']][self.piece_i] + \
+              self.covariates.dot(x[self.slices['coefficients']])
+        for effect in self.team_effects:
+            block = np.zeros((num_cells, self.num_teams))
+            block[np.arange(num_cells), effect.teams] = 1
+            block -= 1. / self.num_teams
+            block *= std_devs[effect.std_dev]
+            eta += block.dot(x[self.slices['z_' + effect.name]])
+            design.append(block)
+        design = np.column_stack(design)
+        with np.errstate(over='ignore'):
+            means = np.exp(eta)
+        h = -(design * means[:, None]).T.dot(design)
+
+        prior = np.empty(len(h))
+        prior[self.slices['log_baseline_hazards']] = 2 * PRIOR_TAU * np.exp(2 * x[self.slices['log_baseline_hazards']])
+        prior[self.slices['coefficients']] = PRIOR_TAU
+        prior[self.slices['coefficients'].stop:] = 1
+        h[np.diag_indices(len(h))] -= prior
+        return h
+
+    def node_traces(self, samples):
+        """
+        :param samples: array of unconstrained vectors, one row per draw
+        :return: dict of node name to trace array, one row per draw, as pymc would record them
+        """
+        draws = [self.unpack(x) for x in samples]
+        return {name: np.array([d[name] for d in draws]) for name in draws[0]}
+
+
+def turnover_posterior(model_inputs, num_teams, defense=True):
+    """
+    The turnover model of fit_turn.py (or fit_turn_nodef.py, without defense).
+    :param model_inputs: dict from PiecewiseCounts.model_inputs()
+    :param num_teams: int
+    :param defense: bool, include defense takeaway propensity
+    :return: PiecewiseExponentialPosterior
+    """
+    team_effects = [TeamEffect('atts', 'std_dev_att', model_inputs['attacking_team'])]
+    if defense:
+        team_effects.append(TeamEffect('defs', 'std_dev_def', model_inputs['defending_team']))
+    return PiecewiseExponentialPosterior(model_inputs['observed_drive_deaths_turnover'],
+                                         model_inputs['observed_exposures'],
+                                         model_inputs['piece_i'],
+                                         model_inputs['num_pieces'],
+                                         _covariates(model_inputs) + [('home', model_inputs['defending_team_is_home'])],
+                                         team_effects,
+                                         num_teams)
+
+
+def _covariates(model_inputs):
+    return [('two_minute_drill', model_inputs['drive_is_two_minute_drill']),
+            ('offense_losing_badly', model_inputs['offense_is_losing_badly']),
+            ('offense_winning_greatly', model_inputs['offense_is_winning_greatly'])]
+
+
+def _sigmoid(u):
+    return .5 * (1 + math.tanh(.5 * u))
+
+
+def _log_sigmoid(u):
+    return -math.log1p(math.exp(-u)) if u > -30 else u
+
+
+def _std_dev(u):
+    return STD_DEV_LOWER + (STD_DEV_UPPER - STD_DEV_LOWER) * _sigmoid(u)
+
+
+def _std_dev_derivative(u):
+    s = _sigmoid(u)
+    return (STD_DEV_UPPER - STD_DEV_LOWER) * s * (1 - s)
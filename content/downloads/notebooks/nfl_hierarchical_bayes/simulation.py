@@ -1,3 +1,6 @@
+import multiprocessing
+import shutil
+
 import numpy as np
 import pandas as pd
 
@@ -5,11 +8,25 @@ from . import PIECES, FIELD_GOAL_RANGE, PUNT_DISTANCE, LOSING_BADLY_THRESHOLD, \
     SIMULATION_TIE_BREAKER_COIN_FLIP_HOME_ADVANTAGE, REDZONE_PIECE, PIECE_LENGTHS, PUNT_CLOCK_TIME, \
     TOUCHDOWN_CLOCK_TIME, FG_CLOCK_TIME
 from elapsed_time import drive_time_elapsed
-
-MEDIAN_I = 32
-
-
-def simulate_median_team_playing_schedule(season_df, teams, ex_turnover, turnover, param_calculator, n_per):
+from drive_outcomes import drive_hazards, GOAL_LINE
+from team_index import TEAM_INDEX, MEDIAN_SLUG
+from traces import share_posterior
+
+MEDIAN_I = TEAM_INDEX.median_i
+HOME, AWAY = 0, 1  # possession codes used by simulate_game_batch()
+MAX_CACHED_DRIVE_MODELS = 100000
+# per-game stats from simulate_game(), in the order simulate_season() stores them
+GAME_STATS = ['home_score', 'away_score', 'home_yards', 'away_yards', 'home_turnovers', 'away_turnovers',
+              'home_possessions', 'away_possessions']
+SEASON_TABLE_COLUMNS = ['home_losses', 'home_points', 'home_possessions', 'home_takeaways', 'home_turnovers',
+                        'home_wins', 'home_yards', 'home_yards_allowed',
+                        'away_losses', 'away_points', 'away_possessions', 'away_takeaways', 'away_turnovers',
+                        'away_wins', 'away_yards', 'away_yards_allowed',
+                        'wins', 'losses', 'yards', 'yards_allowed', 'turnovers', 'takeaways', 'points', 'possessions']
+
+
+def simulate_median_team_playing_schedule(season_df, teams, ex_turnover, turnover, param_calculator, n_per,
+                                          workers=1, common_random_numbers=False, seed=None):
     """
 
     :param season_df:
@@ -17,24 +34,112 @@ def simulate_median_team_playing_schedule(season_df, teams, ex_turnover, turnove
     :param ex_turnover:
     :param turnover:
     :param n_per:
+    :param workers: int number of processes for each schedule's simulate_n_seasons()
+    :param common_random_numbers: bool, play every schedule on the same posterior draws and random numbers, all in
+                                  one batch in this process; see simulate_median_team_playing_schedules_crn().
+                                  Can't be combined with workers > 1.
+    :param seed: int, for common_random_numbers
     :return:
     """
+    TEAM_INDEX.check_frame(teams)
+    if common_random_numbers and workers > 1:
+        raise ValueError('common_random_numbers runs in one process; use workers=1')
+    if common_random_numbers:
+        return simulate_median_team_playing_schedules_crn(season_df, teams, ex_turnover, turnover, param_calculator,
+                                                          n_per, seed)
+    shared_dir = None
+    if workers > 1:
+        # publish the posterior once for all the schedules
+        ex_turnover, turnover, shared_dir = share_posterior(ex_turnover, turnover, param_calculator)
+    try:
+        results = []
+        teams_with_median = TEAM_INDEX.frame(with_median=True)
+        for i, row in teams.iterrows():
+            print row['slug']
+            df2 = simulate_n_seasons(median_team_schedule(season_df, i), teams_with_median, ex_turnover, turnover,
+                                     param_calculator, n_per, workers=workers)
+            df2 = df2[df2.slug == MEDIAN_SLUG]
+            df2['schedule'] = row['slug']
+            results.append(df2)
+    finally:
+        if shared_dir is not None:
+            shutil.rmtree(shared_dir)
+    return pd.concat(results, ignore_index=True)
+
+
+def simulate_median_team_playing_schedules_crn(season_df, teams, ex_turnover, turnover, param_calculator, n_per,
+                                               seed=None):
+    """
+    simulate_median_team_playing_schedule() with common random numbers.  Game k of iteration j is a slot, and in
+    every team's schedule it gets the same posterior draw, the same random number streams for the median team's and
+    the opponent's offense, and the same tie breaker coin flip, as seen from the median team's side.  Differences
+    between schedules then come from the opponents (and home field) rather than from the dice.  Every game of every
+    schedule is played in one simulate_game_batch() call.
+
+    :param n_per: int iterations per schedule
+    :param seed: int
+    :return: same as simulate_median_team_playing_schedule()
+    """
+    TEAM_INDEX.check_frame(teams)
+    random = np.random.RandomState(seed)
+    pc = param_calculator(ex_turnover, turnover)
+    teams_with_median = TEAM_INDEX.frame(with_median=True)
+    schedules = [(row['slug'], median_team_schedule(season_df, i)) for i, row in teams.iterrows()]
+    num_slots = max(len(schedule) for slug, schedule in schedules)
+
+    # draws and random numbers per slot, shared by all schedules
+    num_ex_t_samples, num_t_samples = pc.num_samples()
+    ex_t_draws = random.randint(0, num_ex_t_samples, (n_per, num_slots))
+    t_draws = random.randint(0, num_t_samples, (n_per, num_slots))
+    coinflips = random.random_sample((n_per, num_slots))
+    # streams 2 * slot for the median team, 2 * slot + 1 for its opponent
+    random_numbers = CommonRandomNumbers(2 * n_per * num_slots, random.randint(0, 2 ** 31 - 1))
+
+    # one batch: schedule by schedule, game by game, n_per iterations each
+    batches = []
+    streams = []
+    for slug, schedule in schedules:
+        for k, (i_home, i_away) in enumerate(zip(schedule.i_home.values, schedule.i_away.values)):
+            pc.i_home = i_home
+            pc.i_away = i_away
+            pc.use_sample(ex_t_draws[:, k], t_draws[:, k])
+            batches.append(pc.batch_params())
+            median_stream = 2 * (np.arange(n_per) * num_slots + k)
+            sides = [median_stream, median_stream + 1] if i_home == MEDIAN_I else [median_stream + 1, median_stream]
+            streams.append(np.column_stack(sides))
+    batch = {key: np.concatenate([b[key] for b in batches]) for key in batches[0]}
+    game_stats = simulate_game_batch(batch, random_numbers, np.concatenate(streams))
+    stats = np.column_stack([game_stats[c] for c in GAME_STATS])
+
     results = []
-    teams_with_median = teams.copy()
-    teams_with_median.loc[32, 'slug'] = 'MED'
-    teams_with_median.loc[32, 'i'] = 32
-    for i, row in teams.iterrows():
-        print row['slug']
-        df = season_df[(season_df.i_home == i) | (season_df.i_away == i)].copy()
-        df.loc[df.i_home == i, 'i_home'] = MEDIAN_I
-        df.loc[df.i_away == i, 'i_away'] = MEDIAN_I
-        df2 = simulate_n_seasons(df, teams_with_median, ex_turnover, turnover, param_calculator, n_per)
-        df2 = df2[df2.slug == 'MED']
-        df2['schedule'] = row['slug']
-        results.append(df2)
+    start = 0
+    for slug, schedule in schedules:
+        end = start + len(schedule) * n_per
+        # rows are game-major; season_tables() wants (iterations, games, stats)
+        schedule_stats = stats[start:end].reshape(len(schedule), n_per, -1).swapaxes(0, 1)
+        # the median team wins the same ties home or away: flip the coin over for its away games
+        median_home = schedule.i_home.values == MEDIAN_I
+        schedule_coinflips = np.where(median_home, coinflips[:, :len(schedule)], 1 - coinflips[:, :len(schedule)])
+        df = season_tables(schedule, teams_with_median, schedule_stats, schedule_coinflips)
+        df = df[df.slug == MEDIAN_SLUG]
+        df['schedule'] = slug
+        results.append(df)
+        start = end
     return pd.concat(results, ignore_index=True)
 
 
+def median_team_schedule(season_df, i):
+    """
+    :param season_df: season schedule
+    :param i: int team index
+    :return: team i's games, with the median team playing in its place
+    """
+    df = season_df[(season_df.i_home == i) | (season_df.i_away == i)].copy()
+    df.loc[df.i_home == i, 'i_home'] = MEDIAN_I
+    df.loc[df.i_away == i, 'i_away'] = MEDIAN_I
+    return df
+
+
 def simulate_everyone_playing_median_team(teams, ex_turnover, turnover, param_calculator, n_per=100):
     """
 
@@ -44,6 +149,7 @@ def simulate_everyone_playing_median_team(teams, ex_turnover, turnover, param_ca
     :param n_per:
     :return:
     """
+    TEAM_INDEX.check_frame(teams)
     results = []
     for i, row in teams.iterrows():
         print row['slug']
@@ -62,49 +168,83 @@ def simulate_playing_median_team(i, teams, ex_turnover, turnover, param_calculat
     :param n:
     :return:
     """
+    TEAM_INDEX.check_frame(teams.loc[[i]])
     game_1 = {'hometeam': teams.slug[i],
-              'awayteam': 'MED',
+              'awayteam': MEDIAN_SLUG,
               'i_home': i,
               'i_away': MEDIAN_I}
-    game_2 = {'hometeam': 'MED',
+    game_2 = {'hometeam': MEDIAN_SLUG,
               'awayteam': teams.slug[i],
               'i_home': MEDIAN_I,
               'i_away': i}
     season_df = pd.DataFrame([game_1, game_2])
-    return simulate_n_seasons(season_df, teams, ex_turnover, turnover, param_calculator, n=n)
+    teams_with_median = TEAM_INDEX.frame(with_median=True)
+    return simulate_n_seasons(season_df, teams_with_median, ex_turnover, turnover, param_calculator, n=n)
 
 
-def winner(x, home_advantage=SIMULATION_TIE_BREAKER_COIN_FLIP_HOME_ADVANTAGE):
-    if x['home_score'] > x['away_score']:
-        return x['hometeam']
-    elif x['home_score'] < x['away_score']:
-        return x['awayteam']
-    return x['hometeam'] if x['coinflip'] > .5 - home_advantage else x['awayteam']
+def game_outcomes(home_score, away_score, coinflip, home_advantage=SIMULATION_TIE_BREAKER_COIN_FLIP_HOME_ADVANTAGE):
+    """
+    Settle any number of games at once: the higher score wins, and ties go to the home team if coinflip comes up
+    above .5 - home_advantage.  Takes arrays of any (matching) shape, e.g. (iterations, games) from
+    simulate_n_seasons(), or the per-game arrays of simulate_game_batch().
+
+    :param home_score: array
+    :param away_score: array
+    :param coinflip: array of uniforms
+    :param home_advantage: float, how much the tie-breaking coin favors the home team
+    :return: dict of bool arrays home_win, home_loss, away_win and away_loss
+    """
+    home_score, away_score = np.asarray(home_score), np.asarray(away_score)
+    home_win = (home_score > away_score) | ((home_score == away_score) & (np.asarray(coinflip) > .5 - home_advantage))
+    return {'home_win': home_win, 'home_loss': ~home_win, 'away_win': ~home_win, 'away_loss': home_win}
 
 
 def simulate_n_seasons(season_df, teams, ex_turnover, turnover, param_calculator, n=100, collect_drives=False,
-                       verbose=False):
-    season_tables = []
+                       verbose=False, workers=1, seed=None):
+    """
+    Simulate the season n times.  Game stats are kept in one array over all iterations, and the season tables are
+    built from it at the end, in one go.
+
+    :param workers: int number of processes to spread the iterations across
+    :param seed: int seed for the per-iteration random streams.  Each iteration gets its own seed drawn from this one,
+                 so results don't depend on the number of workers.  With workers=1 and no seed, numpy's global
+                 random state is used as-is.
+    :return: season tables for all iterations, concatenated (and drive stats, if collect_drives)
+    """
+    if seed is not None or workers > 1:
+        seed_source = np.random.RandomState(seed) if seed is not None else np.random
+        seeds = seed_source.randint(0, 2 ** 31 - 1, size=n)
+    else:
+        seeds = [None] * n
+    stats = np.empty((n, len(season_df), len(GAME_STATS)))
+    coinflips = np.empty((n, len(season_df)))
     drives = []
-    for i in range(n):
-        if verbose and i and not i % 50:
-            print '%s seasons simulated.' % i
-        season_i, drive_stats = simulate_season(season_df, ex_turnover, turnover, param_calculator)
-        # coinflip for ties
-        season_i['coinflip'] = np.random.random(size=season_i.shape[0])
-        season_i['winner'] = season_i.apply(winner, axis=1)
-        season_i['home_win'] = (season_i.winner == season_i.hometeam).astype(int)
-        season_i['home_loss'] = (season_i.winner == season_i.awayteam).astype(int)
-        season_i['away_win'] = (season_i.winner == season_i.awayteam).astype(int)
-        season_i['away_loss'] = (season_i.winner == season_i.hometeam).astype(int)
-        season_table = create_season_table(season_i, teams)
-        season_table['iteration'] = i
-        season_tables.append(season_table)
-
-        if collect_drives:
-            drives += drive_stats
+    if workers > 1:
+        # Workers are forked, so they inherit args rather than unpickling them.  The posterior goes to memory-mapped
+        # trace stores first, so all the workers' ParamCalculators read one shared, read-only copy of the traces.
+        global _POOL_ARGS
+        ex_turnover, turnover, shared_dir = share_posterior(ex_turnover, turnover, param_calculator)
+        _POOL_ARGS = (season_df, ex_turnover, turnover, param_calculator, collect_drives)
+        pool = multiprocessing.Pool(workers)
+        try:
+            iterations = pool.imap(_simulate_season_iteration_in_worker, seeds, chunksize=max(1, n // (4 * workers)))
+            _collect_season_iterations(iterations, stats, coinflips, drives, verbose)
+            pool.close()
+        except BaseException:
+            # don't wait on the rest of the iterations
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _POOL_ARGS = None
+            if shared_dir is not None:
+                shutil.rmtree(shared_dir)
+    else:
+        args = (season_df, ex_turnover, turnover, param_calculator, collect_drives)
+        iterations = (simulate_season_iteration(*(args + (seeds[i],))) for i in range(n))
+        _collect_season_iterations(iterations, stats, coinflips, drives, verbose)
 
-    df = pd.concat(season_tables, ignore_index=True)
+    df = season_tables(season_df, teams, stats, coinflips)
 
     if collect_drives:
         df_drive = pd.DataFrame(drives)
@@ -113,71 +253,119 @@ def simulate_n_seasons(season_df, teams, ex_turnover, turnover, param_calculator
         return df
 
 
-def create_season_table(season, teams):
-    """
-    Using a season dataframe output by simulate_season(), create a summary dataframe with wins, losses, goals for, etc.
-
-    """
-    g = season.groupby('i_home')
-    home = pd.DataFrame({'home_yards': g.home_yards.sum(),
-                         'home_yards_allowed': g.away_yards.sum(),
-                         'home_wins': g.home_win.sum(),
-                         'home_losses': g.home_loss.sum(),
-                         'home_turnovers': g.home_turnovers.sum(),
-                         'home_takeaways': g.away_turnovers.sum(),
-                         'home_points': g.home_score.sum(),
-                         'home_possessions': g.home_possessions.sum()
-    })
-    g = season.groupby('i_away')
-    away = pd.DataFrame({'away_yards': g.away_yards.sum(),
-                         'away_yards_allowed': g.home_yards.sum(),
-                         'away_wins': g.away_win.sum(),
-                         'away_losses': g.away_loss.sum(),
-                         'away_turnovers': g.away_turnovers.sum(),
-                         'away_takeaways': g.home_turnovers.sum(),
-                         'away_points': g.away_score.sum(),
-                         'away_possessions': g.away_possessions.sum()
-    })
-    df = home.join(away)
-    df['wins'] = df.home_wins + df.away_wins
-    df['losses'] = df.home_losses + df.away_losses
-    df['yards'] = df.home_yards + df.away_yards
-    df['yards_allowed'] = df.home_yards_allowed + df.away_yards_allowed
-    df['turnovers'] = df.home_turnovers + df.away_turnovers
-    df['takeaways'] = df.home_takeaways + df.away_takeaways
-    df['points'] = df.home_points + df.away_points
-    df['possessions'] = df.home_possessions + df.away_possessions
-    df = pd.merge(teams, df, left_on='i', right_index=True, how='outer')
-    return df
+def simulate_season_iteration(season_df, ex_turnover, turnover, param_calculator, collect_drives=False, seed=None):
+    """
+    One iteration of simulate_n_seasons(): simulate the season, and flip a coin per game for ties.
+    The game simulation draws from numpy's global random state.  Given a seed, that state is seeded for the
+    iteration and put back as it was afterwards, so the caller's own random stream isn't disturbed.
+    :param seed: int, or None to carry on from the global random state
+    :return: (game stats array from simulate_season(), coinflips array, drive stats list or None)
+    """
+    if seed is not None:
+        state = np.random.get_state()
+        np.random.seed(seed)
+    try:
+        stats, drive_stats = simulate_season(season_df, ex_turnover, turnover, param_calculator)
+        # coinflip for ties
+        coinflips = np.random.random(size=len(stats))
+    finally:
+        if seed is not None:
+            np.random.set_state(state)
+    return stats, coinflips, drive_stats if collect_drives else None
+
+
+_POOL_ARGS = None
+
+
+def _simulate_season_iteration_in_worker(seed):
+    return simulate_season_iteration(*(_POOL_ARGS + (seed,)))
+
+
+def _collect_season_iterations(iterations, stats, coinflips, drives, verbose):
+    """
+    Fill stats and coinflips, one row per iteration, and extend drives with any drive stats.
+    """
+    for i, (season_stats, season_coinflips, drive_stats) in enumerate(iterations):
+        stats[i] = season_stats
+        coinflips[i] = season_coinflips
+        if drive_stats is not None:
+            drives.extend(drive_stats)
+        if verbose and not (i + 1) % 50:
+            print '%s seasons simulated.' % (i + 1)
+
+
+def season_tables(season_df, teams, stats, coinflips, home_advantage=SIMULATION_TIE_BREAKER_COIN_FLIP_HOME_ADVANTAGE):
+    """
+    Summarize simulated seasons with wins, losses, points for, etc. per team per iteration.  Winners come from
+    game_outcomes() over every game of every iteration, and totals from
+    np.bincount over team ids offset by iteration, so every iteration is summed at once.
+
+    :param season_df: the schedule that was simulated, with i_home and i_away
+    :param teams: dataframe with a row per team and its index in column i
+    :param stats: array of GAME_STATS per iteration and game, shape (iterations, games, len(GAME_STATS))
+    :param coinflips: array of uniforms for tie breakers, shape (iterations, games)
+    :param home_advantage: float, how much the tie-breaking coin favors the home team
+    :return: dataframe with the teams' columns and SEASON_TABLE_COLUMNS, one row per team per iteration
+    """
+    n = stats.shape[0]
+    game = dict(zip(GAME_STATS, np.rollaxis(stats, 2)))
+    game.update(game_outcomes(game['home_score'], game['away_score'], coinflips, home_advantage))
+
+    i_home = season_df.i_home.values.astype(int)
+    i_away = season_df.i_away.values.astype(int)
+    ids = teams.i.values.astype(int)
+    size = max(ids.max(), i_home.max(), i_away.max()) + 1
+    offsets = np.arange(n)[:, np.newaxis] * size
+
+    def by_team(i_team, values):
+        totals = np.bincount((offsets + i_team).ravel(), values.ravel(), minlength=n * size).reshape(n, size)[:, ids]
+        # teams without a home (or away) game have no home (or away) totals
+        played = np.bincount(i_team, minlength=size)[ids] > 0
+        return totals if played.all() else np.where(played, totals, np.nan)
+
+    table = {}
+    for side, other, i_team in [('home', 'away', i_home), ('away', 'home', i_away)]:
+        table[side + '_yards'] = by_team(i_team, game[side + '_yards'])
+        table[side + '_yards_allowed'] = by_team(i_team, game[other + '_yards'])
+        table[side + '_wins'] = by_team(i_team, game[side + '_win'])
+        table[side + '_losses'] = by_team(i_team, game[side + '_loss'])
+        table[side + '_turnovers'] = by_team(i_team, game[side + '_turnovers'])
+        table[side + '_takeaways'] = by_team(i_team, game[other + '_turnovers'])
+        table[side + '_points'] = by_team(i_team, game[side + '_score'])
+        table[side + '_possessions'] = by_team(i_team, game[side + '_possessions'])
+    for stat in ['wins', 'losses', 'yards', 'yards_allowed', 'turnovers', 'takeaways', 'points', 'possessions']:
+        table[stat] = table['home_' + stat] + table['away_' + stat]
+    for column in SEASON_TABLE_COLUMNS:
+        # counts come out of bincount as floats
+        if 'yards' not in column and not np.isnan(table[column]).any():
+            table[column] = table[column].astype(int)
+        table[column] = table[column].ravel()
+    for column in teams.columns:
+        table[column] = np.tile(teams[column].values, n)
+    table['iteration'] = np.repeat(np.arange(n), len(ids))
+    return pd.DataFrame(table, columns=list(teams.columns) + SEASON_TABLE_COLUMNS + ['iteration'])
 
 
 def simulate_season(season_df, ex_turnover, turnover, param_calculator):
     """
-    Simulate a season once, using one random draw from the mcmc chain.
+    Simulate a season once, using one random draw from the mcmc chain per game.
+    :return: (array of GAME_STATS, shape (games, len(GAME_STATS)), drive stats list)
     """
     pc = param_calculator(ex_turnover, turnover)
 
     # for data collection
-    season_simul = season_df.copy()
-    stat_cols = []
-    for pos in ['home', 'away']:
-        for stat in ['score', 'yards', 'turnovers', 'possessions']:
-            stat_cols.append('%s_%s' % (pos, stat))
-    for col in stat_cols:
-        season_simul[col] = None
+    stats = np.empty((len(season_df), len(GAME_STATS)))
 
     # simulate each game
     drives = []
-    for i, row in season_simul.iterrows():
-        i_home, i_away = row['i_home'], row['i_away']
+    for g, (i_home, i_away) in enumerate(zip(season_df.i_home.values, season_df.i_away.values)):
         pc.i_home = i_home
         pc.i_away = i_away
         pc.re_draw_sample()
         results, drive_stats = simulate_game(pc)
-        for c in stat_cols:
-            season_simul.loc[i, c] = results[c]
+        stats[g] = [results[c] for c in GAME_STATS]
         drives += drive_stats
-    return season_simul, drives
+    return stats, drives
 
 
 def current_piece(yardline):
@@ -191,18 +379,35 @@ def piece_lengths(PIECES):
     return [PIECES[i + 1] - PIECES[i] for i in range(len(PIECES) - 1)]
 
 
-def simulate_game_n_times(pc, n=10000):
+def simulate_game_n_times(pc, n=10000, batch=False, closed_form=False):
+    """
+    Play pc's matchup n times, each with a fresh posterior draw.
+    :return: dataframe of game stats, with the tie breaker coinflip and game_outcomes() per game
+    """
+    if batch:
+        df = pd.DataFrame(simulate_game_batch(pc.draw_batch(n)))
+        df['i_home'] = pc.i_home
+        df['i_away'] = pc.i_away
+        return _with_outcomes(df)
+    drive_models = {} if closed_form else None
     results = []
     for i in range(n):
         pc.re_draw_sample()
-        game_results, drive_stats = simulate_game(pc)
+        game_results, drive_stats = simulate_game(pc, closed_form=closed_form, drive_models=drive_models)
         game_results['i_home'] = pc.i_home
         game_results['i_away'] = pc.i_away
         results.append(game_results)
-    return pd.DataFrame(results)
+    return _with_outcomes(pd.DataFrame(results))
+
+
+def _with_outcomes(df):
+    df['coinflip'] = np.random.random(size=len(df))
+    for column, values in game_outcomes(df.home_score.values, df.away_score.values, df.coinflip.values).items():
+        df[column] = values.astype(int)
+    return df
 
 
-def simulate_game(params, verbose=False):
+def simulate_game(params, verbose=False, closed_form=False, drive_models=None):
     """
     Simulate a set of drives using params drawn from posterior distributions.
     This is big and needs to be broken up.  #todo
@@ -212,10 +417,18 @@ def simulate_game(params, verbose=False):
     :param i_home: int team index of home team
     :param i_away: int team index of away team
     :param verbose: bool
+    :param closed_form: bool, play each drive with one draw from the closed-form drive model in drive_outcomes,
+                        instead of piece by piece
+    :param drive_models: optional dict caching closed-form drive models.  Pass the same dict to several games to
+                         reuse the models across games with the same draw and teams.
     :return: game_stats dict and drive_stats list of dicts
     """
     i_home = params.i_home
     i_away = params.i_away
+    if closed_form and drive_models is None:
+        drive_models = {}
+    if closed_form and len(drive_models) > MAX_CACHED_DRIVE_MODELS:
+        drive_models.clear()
 
 
     # data collection
@@ -229,18 +442,14 @@ def simulate_game(params, verbose=False):
     yardline = 20
 
     possession = 'home' if np.random.random() > .5 else 'away'
-    defending = 'home' if possession == 'away' else 'away'
 
     first_half_possession = possession
     hit_halftime = False
     while clock > 0:  # BEGIN NEW DRIVE
 
         # new drive
-        drive_in_progress = True
         possessions[possession] += 1
         drive_start = yardline
-        total_drive_yards = 0
-        outcome = None
         this_drive = {'start_yardline': yardline,
                       'i_home': i_home,
                       'i_away': i_away,
@@ -261,86 +470,46 @@ def simulate_game(params, verbose=False):
         if verbose:
             print '%s has the ball at the %s yardline with %s remaining.' % (possession, yardline, clock)
 
-        while drive_in_progress:  # BEGIN NEW INTERVAL
-
-            piece = current_piece(yardline)
-            piece_start = PIECES[piece]
-            piece_end = PIECES[piece + 1]
-
-            # base xb for team and piece
-            if piece == REDZONE_PIECE:
-                xb = params.home_xb_rz() if possession == 'home' else params.away_xb_rz()
-            else:
-                xb = params.home_xb() if possession == 'home' else params.away_xb()
-            xb_turn = params.home_turnover_xb() if possession == 'home' else params.away_turnover_xb()
-
-            # amend xb for drive-specific situations
-            if score[possession] - score[defending] > LOSING_BADLY_THRESHOLD:
-                xb += params.ex_t_offense_winning_greatly()
-                xb_turn += params.t_offense_winning_greatly()
-            if score[defending] - score[possession] > LOSING_BADLY_THRESHOLD:
-                xb += params.ex_t_offense_losing_badly()
-                xb_turn += params.t_offense_losing_badly()
-            if 30 < clock < 32 or clock < 2:
-                xb += params.ex_t_two_minute_drill()
-                xb_turn += params.t_two_minute_drill()
-
-            # piece-specific baseline, and exp
-            hazard = (params.ex_t_baseline_hazards()[piece]) * np.exp(xb)
-            hazard_turnover = (params.t_baseline_hazards()[piece]) * np.exp(xb_turn)
-            total_hazard = hazard + hazard_turnover
-
-            # did they survive this piece?
-            yards_survived = np.random.exponential(1. / total_hazard)
-
-
-            # print '%s yards' % yards_survived
-
-            if (yards_survived + yardline) > piece_end:  # survival to the next piece
-                total_drive_yards += (piece_end - yardline)
-                if piece == REDZONE_PIECE:
-                    drive_in_progress = False
-                    score[possession] += 7
-                    clock -= TOUCHDOWN_CLOCK_TIME
-                    yardline = 20
-                    outcome = 'touchdown'
-                    if verbose:
-                        print '%s scored a touchdown.' % possession
-                else:  # on to the next piece
-                    if verbose:
-                        print '%s advanced to the next piece by surviving %s yards' % (possession, yards_survived)
-                    yardline = piece_end + .01
-            else:  # drive death
-                drive_in_progress = False
-                total_drive_yards += yards_survived
-                # was it 'normal' drive death, or death-by-turnover?
-                p_turnover = hazard_turnover / (hazard_turnover + hazard)
-                if np.random.random() < p_turnover:  # turnover
-                    turnovers[possession] += 1
-                    outcome = 'turnover'
-                    if verbose:
-                        print 'Turnover: %s gave away the ball at the %s yardline.' % (
-                            possession, yards_survived + yardline)
-                    yardline = 100 - (yards_survived + yardline)
-                else:
-                    # Punt or field goal?
-                    if yards_survived + yardline > FIELD_GOAL_RANGE:  # field goal
-                        clock -= FG_CLOCK_TIME
-                        score[possession] += 3
-                        outcome = 'field_goal'
-                        if verbose:
-                            print '%s kicked a field goal from the %s yardline' % (
-                                possession, yardline + yards_survived)
-                        yardline = 20
-                    else:  # punt
-                        clock -= PUNT_CLOCK_TIME
-                        outcome = 'punt'
-                        punt_to_yardline = 100 - (yardline + yards_survived + PUNT_DISTANCE)
-                        punt_to_yardline = 20 if punt_to_yardline < 2 else punt_to_yardline  # cut down on coffin corner punts
-                        if verbose:
-                            print '%s punted from the %s yardline to the %s yardline.' % (
-                                possession, yardline + yards_survived, punt_to_yardline)
-                        yardline = punt_to_yardline
+        if closed_form:
+            key = (params.ex_t_draw, params.t_draw, i_home, i_away, possession, this_drive['offense_winning_greatly'],
+                   this_drive['offense_losing_badly'], this_drive['two_minute_drill'])
+            if key not in drive_models:
+                drive_models[key] = drive_hazards(params, possession, *key[-3:])
+            death_yardline, is_turnover = drive_models[key].sample(yardline)
+            total_drive_yards = (GOAL_LINE if death_yardline is None else death_yardline) - yardline
+        else:
+            total_drive_yards, death_yardline, is_turnover = simulate_drive(params, possession, yardline, score, clock,
+                                                                            verbose)
+
+        if death_yardline is None:  # survived the redzone
+            score[possession] += 7
+            clock -= TOUCHDOWN_CLOCK_TIME
+            yardline = 20
+            outcome = 'touchdown'
+            if verbose:
+                print '%s scored a touchdown.' % possession
+        elif is_turnover:
+            turnovers[possession] += 1
+            outcome = 'turnover'
+            if verbose:
+                print 'Turnover: %s gave away the ball at the %s yardline.' % (possession, death_yardline)
+            yardline = 100 - death_yardline
+        elif death_yardline > FIELD_GOAL_RANGE:  # field goal
+            clock -= FG_CLOCK_TIME
+            score[possession] += 3
+            outcome = 'field_goal'
+            if verbose:
+                print '%s kicked a field goal from the %s yardline' % (possession, death_yardline)
+            yardline = 20
+        else:  # punt
+            clock -= PUNT_CLOCK_TIME
+            outcome = 'punt'
+            punt_to_yardline = 100 - (death_yardline + PUNT_DISTANCE)
+            punt_to_yardline = 20 if punt_to_yardline < 2 else punt_to_yardline  # cut down on coffin corner punts
+            if verbose:
+                print '%s punted from the %s yardline to the %s yardline.' % (
+                    possession, death_yardline, punt_to_yardline)
+            yardline = punt_to_yardline
 
         if verbose:
             print '  -- total drive yards: %s' % total_drive_yards
@@ -370,3 +539,224 @@ def simulate_game(params, verbose=False):
 
     return game_stats, drives
 
+
+def simulate_drive(params, possession, yardline, score, clock, verbose=False):
+    """
+    Play one drive piece by piece, drawing the yards survived in each piece.
+    :return: (total_drive_yards, death_yardline, is_turnover).  death_yardline is None for a touchdown.
+    """
+    defending = 'home' if possession == 'away' else 'away'
+    total_drive_yards = 0
+    while True:  # BEGIN NEW INTERVAL
+
+        piece = current_piece(yardline)
+        piece_start = PIECES[piece]
+        piece_end = PIECES[piece + 1]
+
+        # base xb for team and piece
+        if piece == REDZONE_PIECE:
+            xb = params.home_xb_rz() if possession == 'home' else params.away_xb_rz()
+        else:
+            xb = params.home_xb() if possession == 'home' else params.away_xb()
+        xb_turn = params.home_turnover_xb() if possession == 'home' else params.away_turnover_xb()
+
+        # amend xb for drive-specific situations
+        if score[possession] - score[defending] > LOSING_BADLY_THRESHOLD:
+            xb += params.ex_t_offense_winning_greatly()
+            xb_turn += params.t_offense_winning_greatly()
+        if score[defending] - score[possession] > LOSING_BADLY_THRESHOLD:
+            xb += params.ex_t_offense_losing_badly()
+            xb_turn += params.t_offense_losing_badly()
+        if 30 < clock < 32 or clock < 2:
+            xb += params.ex_t_two_minute_drill()
+            xb_turn += params.t_two_minute_drill()
+
+        # piece-specific baseline, and exp
+        hazard = (params.ex_t_baseline_hazards()[piece]) * np.exp(xb)
+        hazard_turnover = (params.t_baseline_hazards()[piece]) * np.exp(xb_turn)
+        total_hazard = hazard + hazard_turnover
+
+        # did they survive this piece?
+        yards_survived = np.random.exponential(1. / total_hazard)
+
+
+        # print '%s yards' % yards_survived
+
+        if (yards_survived + yardline) > piece_end:  # survival to the next piece
+            total_drive_yards += (piece_end - yardline)
+            if piece == REDZONE_PIECE:
+                return total_drive_yards, None, False
+            if verbose:
+                print '%s advanced to the next piece by surviving %s yards' % (possession, yards_survived)
+            yardline = piece_end + .01
+        else:  # drive death
+            total_drive_yards += yards_survived
+            # was it 'normal' drive death, or death-by-turnover?
+            p_turnover = hazard_turnover / (hazard_turnover + hazard)
+            return total_drive_yards, yards_survived + yardline, np.random.random() < p_turnover
+
+
+class CommonRandomNumbers(object):
+    """
+    Random numbers for simulate_game_batch() that belong to streams rather than to the order games are played in.
+    Each side of each game is given a stream, with a kickoff number and a sequence of exponentials and uniforms, and
+    the k-th piece that side plays on offense uses the k-th numbers of its stream.  Give a team the same stream in
+    two games, say the same week of two schedules, and it sees the same luck as far as the games go alike, so
+    comparisons between them have much less noise.
+    """
+
+    def __init__(self, streams, seed=None, block=64):
+        """
+        :param streams: int number of streams
+        :param seed: int
+        :param block: int, the streams grow by this many numbers at a time
+        """
+        self.random = np.random.RandomState(seed)
+        self.block = block
+        self.kickoff = self.random.random_sample(streams)
+        self.exponentials = np.empty((streams, 0))
+        self.uniforms = np.empty((streams, 0))
+
+    def draw(self, stream, step):
+        """
+        :param stream: int array, the stream of each side on offense
+        :param step: int array, the number of pieces each of those has played so far
+        :return: (standard exponentials, uniforms), one of each per side
+        """
+        while step.max() >= self.uniforms.shape[1]:
+            size = (len(self.kickoff), self.block)
+            self.exponentials = np.column_stack([self.exponentials, self.random.standard_exponential(size)])
+            self.uniforms = np.column_stack([self.uniforms, self.random.random_sample(size)])
+        return self.exponentials[stream, step], self.uniforms[stream, step]
+
+
+def simulate_game_batch(batch, random_numbers=None, stream=None):
+    """
+    Simulate many independent games at once.  Same model as simulate_game(), but the per-game clock, yardline,
+    possession and score are numpy arrays, and each pass of the loop plays one piece of the current drive in every
+    unfinished game, drawing all exponentials and turnover coin flips in one shot.
+
+    :param batch: dict of param arrays, one row per game, from ParamCalculator.draw_batch()
+    :param random_numbers: optional CommonRandomNumbers to draw from, instead of numpy's global random state.  The
+                           side with the higher kickoff number gets the ball first.
+    :param stream: int array of shape (games, 2), the streams in random_numbers of the home and the away side of each
+                   game; by default game i uses streams 2i and 2i + 1
+    :return: game_stats dict of arrays, with the same keys as simulate_game()
+    """
+    n = batch['xb'].shape[0]
+    if random_numbers is not None:
+        stream = np.arange(2 * n).reshape(n, 2) if stream is None else np.asarray(stream)
+        step = np.zeros((n, 2), dtype=int)
+    pieces = np.array(PIECES, dtype=float)
+    num_pieces = len(PIECE_LENGTHS)
+
+    # data collection, [:, HOME] and [:, AWAY]
+    score = np.zeros((n, 2), dtype=int)
+    offensive_yards = np.zeros((n, 2))
+    turnovers = np.zeros((n, 2), dtype=int)
+    possessions = np.zeros((n, 2), dtype=int)
+
+    clock = np.ones(n) * 60
+    yardline = np.ones(n) * 20
+    if random_numbers is None:
+        possession = np.where(np.random.random(n) > .5, HOME, AWAY)
+    else:
+        kickoff = random_numbers.kickoff[stream]
+        possession = np.where(kickoff[:, HOME] > kickoff[:, AWAY], HOME, AWAY)
+    first_half_possession = possession.copy()
+    hit_halftime = np.zeros(n, dtype=bool)
+    total_drive_yards = np.zeros(n)
+    new_drive = np.ones(n, dtype=bool)
+
+    active = np.arange(n)
+    while active.size:
+        # new drives
+        starting = active[new_drive[active]]
+        possessions[starting, possession[starting]] += 1
+        total_drive_yards[starting] = 0
+        new_drive[starting] = False
+
+        g = active
+        poss = possession[g]
+        y = yardline[g]
+        piece = np.clip(np.searchsorted(pieces, y, side='right') - 1, 0, num_pieces - 1)
+        piece_end = pieces[piece + 1]
+        red_zone = piece == REDZONE_PIECE
+
+        # base xb for team and piece
+        xb = np.where(red_zone, batch['xb_rz'][g, poss], batch['xb'][g, poss])
+        xb_turn = batch['xb_turn'][g, poss]
+
+        # amend xb for drive-specific situations
+        margin = score[g, poss] - score[g, 1 - poss]
+        winning_greatly = margin > LOSING_BADLY_THRESHOLD
+        losing_badly = -margin > LOSING_BADLY_THRESHOLD
+        two_minute_drill = ((30 < clock[g]) & (clock[g] < 32)) | (clock[g] < 2)
+        xb = xb + winning_greatly * batch['ex_t_offense_winning_greatly'][g] + \
+             losing_badly * batch['ex_t_offense_losing_badly'][g] + \
+             two_minute_drill * batch['ex_t_two_minute_drill'][g]
+        xb_turn = xb_turn + winning_greatly * batch['t_offense_winning_greatly'][g] + \
+                  losing_badly * batch['t_offense_losing_badly'][g] + \
+                  two_minute_drill * batch['t_two_minute_drill'][g]
+
+        # piece-specific baseline, and exp
+        hazard = batch['ex_t_baseline_hazards'][g, piece] * np.exp(xb)
+        hazard_turnover = batch['t_baseline_hazards'][g, piece] * np.exp(xb_turn)
+        total_hazard = hazard + hazard_turnover
+
+        # did they survive this piece?  Draw everything at once; the coin flip only matters for deaths.
+        if random_numbers is None:
+            yards_survived = np.random.exponential(1. / total_hazard)
+            coin_flip = np.random.random(g.size)
+        else:
+            exponentials, coin_flip = random_numbers.draw(stream[g, poss], step[g, poss])
+            yards_survived = exponentials / total_hazard
+            step[g, poss] += 1
+        death_yardline = y + yards_survived
+
+        survived = death_yardline > piece_end
+        touchdown = survived & red_zone
+        advanced = survived & ~red_zone
+        turnover = ~survived & (coin_flip < hazard_turnover / total_hazard)
+        field_goal = ~survived & ~turnover & (death_yardline > FIELD_GOAL_RANGE)
+        punt = ~survived & ~turnover & ~field_goal
+
+        total_drive_yards[g] += np.where(survived, piece_end - y, yards_survived)
+        score[g[touchdown], poss[touchdown]] += 7
+        score[g[field_goal], poss[field_goal]] += 3
+        turnovers[g[turnover], poss[turnover]] += 1
+        clock[g[touchdown]] -= TOUCHDOWN_CLOCK_TIME
+        clock[g[field_goal]] -= FG_CLOCK_TIME
+        clock[g[punt]] -= PUNT_CLOCK_TIME
+
+        punt_to_yardline = 100 - (death_yardline + PUNT_DISTANCE)
+        punt_to_yardline[punt_to_yardline < 2] = 20  # cut down on coffin corner punts
+        y = np.where(advanced, piece_end + .01, y)
+        y = np.where(touchdown | field_goal, 20, y)
+        y = np.where(turnover, 100 - death_yardline, y)
+        y = np.where(punt, punt_to_yardline, y)
+        yardline[g] = y
+
+        # wrap up finished drives
+        ended = g[~advanced]
+        clock[ended] -= drive_time_elapsed(total_drive_yards[ended])
+        offensive_yards[ended, possession[ended]] += total_drive_yards[ended]
+        new_drive[ended] = True
+
+        # ALWAYS flip posession
+        possession[ended] = 1 - possession[ended]
+
+        # handle the clock
+        halftime = ended[(clock[ended] < 30.5) & ~hit_halftime[ended]]
+        hit_halftime[halftime] = True
+        clock[halftime] = 30
+        possession[halftime] = 1 - first_half_possession[halftime]
+        yardline[halftime] = 20
+
+        active = active[clock[active] > 0]
+
+    game_stats = {'home_score': score[:, HOME], 'away_score': score[:, AWAY],
+                  'home_yards': offensive_yards[:, HOME], 'away_yards': offensive_yards[:, AWAY],
+                  'home_turnovers': turnovers[:, HOME], 'away_turnovers': turnovers[:, AWAY],
+                  'home_possessions': possessions[:, HOME], 'away_possessions': possessions[:, AWAY]}
+    return game_stats
@@ -0,0 +1,122 @@
+import os
+
+import pandas as pd
+
+from . import data_prep
+from .columnar import PLAY_BY_PLAY_DTYPES, TEAM_COLUMNS, write_frame, unify_team_categories
+from .team_index import TEAM_INDEX
+
+# Streaming version of the data_prep chain, for more play-by-play than fits in memory.  The csv is read in chunks
+# of whole games, and each chunk is enriched and broken into drives on its own.  Everything in the chain is
+# game-local, and team codes come from the fixed TEAM_INDEX, so chunks don't need to see each other; the only
+# shared state is the play and drive numbering, which carries on from one chunk to the next.
+#
+# Plays of a game have to be contiguous in the csv (they needn't be sorted within the game).  Chunk edges always fall
+# between games, so the flags that look at the previous or next play only ever miss a neighbour from another game,
+# which the one-shot chain doesn't use either (a game's last row is its END GAME row, outside any drive).
+
+GAMES_PER_CHUNK = 256
+ROWS_PER_READ = 50000
+
+
+def iter_game_chunks(pbp_file, games_per_chunk=GAMES_PER_CHUNK, rows_per_read=ROWS_PER_READ):
+    """
+    Read a play-by-play csv in pieces, cut on game boundaries.
+    :param pbp_file: str path to play-by-play csv from http://nflsavant.com/about.php
+    :param games_per_chunk: int, games per yielded frame (the last one may have fewer)
+    :param rows_per_read: int, csv rows parsed at a time
+    :return: generator of play-by-play frames, each holding all the plays of its games
+    """
+    done = set()
+    buffered = []
+    for rows in pd.read_csv(pbp_file, chunksize=rows_per_read, dtype=PLAY_BY_PLAY_DTYPES):
+        if rows.GameId.isin(done).any():
+            raise ValueError('Plays of game %s are not contiguous in %s.' %
+                             (rows.GameId[rows.GameId.isin(done)].iloc[0], pbp_file))
+        buffered.append(rows)
+        df = pd.concat(buffered, ignore_index=True)
+        game_ids = df.GameId.unique()
+        # the last game may continue in the next read
+        while len(game_ids) > games_per_chunk:
+            is_complete = df.GameId.isin(game_ids[:games_per_chunk])
+            done.update(game_ids[:games_per_chunk])
+            yield df[is_complete].reset_index(drop=True)
+            df = df[~is_complete]
+            game_ids = game_ids[games_per_chunk:]
+        buffered = [df]
+    df = pd.concat(buffered, ignore_index=True)
+    if len(df):
+        yield df
+
+
+def stream_drive_dfs(pbp_files, game_level_datasets=data_prep.GAME_LEVEL_DATASET_2014,
+                     games_per_chunk=GAMES_PER_CHUNK):
+    """
+    Run the data_prep chain one chunk of games at a time, yielding the drives of each chunk.
+    :param pbp_files: str path, or list of paths (e.g. one per season)
+    :param game_level_datasets: str path, or list of paths matching pbp_files
+    :param games_per_chunk: int
+    :return: generator of drive frames, as returned by pipeline.run_pipeline().  Drive ids and play ids are unique
+             across all chunks and files.
+    """
+    pbp_files = [pbp_files] if isinstance(pbp_files, basestring) else pbp_files
+    if isinstance(game_level_datasets, basestring):
+        game_level_datasets = [game_level_datasets] * len(pbp_files)
+
+    next_play_id = 0
+    next_drive_id = 0
+    for pbp_file, game_level_dataset in zip(pbp_files, game_level_datasets):
+        df_game = data_prep.load_game_level_dataset(game_level_dataset)
+        for df in iter_game_chunks(pbp_file, games_per_chunk):
+            df_drive, next_play_id, next_drive_id = prep_games(df, df_game, next_play_id, next_drive_id)
+            yield df_drive
+
+
+def prep_games(df, df_game, next_play_id=0, next_drive_id=0):
+    """
+    Run the data_prep chain on the plays of some whole games.
+    :param df: play-by-play frame
+    :param df_game: frame from data_prep.load_game_level_dataset()
+    :param next_play_id: int, first play id to use
+    :param next_drive_id: int, first drive id to use
+    :return: (df_drive, next_play_id, next_drive_id), the last two for the next call
+    """
+    # each csv read infers its own categories, and team columns can only be compared if theirs are the same
+    df = unify_team_categories(df, [c for c in TEAM_COLUMNS if c in df.columns])
+    df = data_prep.enrich_play_level_df(df)
+    df['play_id'] += next_play_id
+    df['drive_id'] += next_drive_id
+    next_play_id = df.play_id.max() + 1
+    next_drive_id = int(df.drive_id.max()) + 1
+    df = data_prep.merge_in_game_level_df(df, df_game)
+    df = data_prep.calculate_game_score_at_play_start(df)
+    df_drive = data_prep.generate_drive_df(df)
+    del df
+    df_drive, _ = data_prep.index_with_team_indexes(df_drive)
+    df_drive = data_prep.remove_unexplained_drives(df_drive)
+    df_drive = data_prep.enrich_drive_level_df(df_drive)
+    return data_prep.remove_end_of_half_and_kneel_drives(df_drive), next_play_id, next_drive_id
+
+
+def run_streaming(pbp_files, game_level_datasets=data_prep.GAME_LEVEL_DATASET_2014, drive_dir=None,
+                  games_per_chunk=GAMES_PER_CHUNK):
+    """
+    Piecewise counts over any number of seasons, holding one chunk of games in memory at a time.
+    :param pbp_files: str path, or list of paths
+    :param game_level_datasets: str path, or list of paths matching pbp_files
+    :param drive_dir: str, optional directory to write each chunk's drives to, as drives-00000.parquet, ...
+    :param games_per_chunk: int
+    :return: dict with teams, df_counts, and drive_files
+    """
+    if drive_dir is not None and not os.path.exists(drive_dir):
+        os.makedirs(drive_dir)
+
+    df_counts = None
+    drive_files = []
+    for i, df_drive in enumerate(stream_drive_dfs(pbp_files, game_level_datasets, games_per_chunk)):
+        if drive_dir is not None:
+            drive_files.append(os.path.join(drive_dir, 'drives-%05d.parquet' % i))
+            write_frame(df_drive.reset_index(drop=True), drive_files[-1])
+        chunk_counts = data_prep.generate_piecewise_counts_df(data_prep.generate_piecewise_df(df_drive))
+        df_counts = chunk_counts if df_counts is None else data_prep.add_piecewise_counts(df_counts, chunk_counts)
+    return {'teams': TEAM_INDEX.frame(), 'df_counts': df_counts, 'drive_files': drive_files}
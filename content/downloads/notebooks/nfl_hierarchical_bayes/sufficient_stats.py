@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+from . import REDZONE_PIECE
+
+# The piecewise exponential models only see drives through these sums, per cell of the covariates: total exposure
+# yards and total deaths.  PiecewiseCounts keeps them as flat arrays instead of a DataFrame, with the cell keys
+# packed into one structured array, so merging in new drives and building model inputs are a sort and a bincount.
+
+# key fields, in the order generate_piecewise_counts_df() groups by them
+KEY_DTYPE = np.dtype([('piece_i', np.int8),
+                      ('i_attacking', np.int8),
+                      ('i_defending', np.int8),
+                      ('i_home', np.int8),
+                      ('i_away', np.int8),
+                      ('defending_team_is_home', np.int8),
+                      ('offense_losing_badly', np.bool_),
+                      ('offense_winning_greatly', np.bool_),
+                      ('two_minute_drill', np.bool_)])
+SUMS = ['N', 'deaths', 'deaths_ex_turnover', 'deaths_turnover', 'exposure_yards']
+# keys the fitted models use; i_home and i_away follow from the attacking and defending teams and
+# defending_team_is_home
+MODEL_KEYS = ['piece_i', 'i_attacking', 'i_defending', 'defending_team_is_home', 'offense_losing_badly',
+              'offense_winning_greatly', 'two_minute_drill']
+
+
+class PiecewiseCounts(object):
+    """
+    Sufficient statistics of the piecewise exponential drive models: one entry per distinct cell of the keys, sorted
+    by key.
+    """
+
+    def __init__(self, keys, sums):
+        """
+        :param keys: structured array of KEY_DTYPE, one entry per drive piece or per cell
+        :param sums: dict of SUMS name to array, aligned with keys.  Keys needn't be distinct; repeats are added up.
+        """
+        self.keys, inverse = np.unique(np.asarray(keys, dtype=KEY_DTYPE), return_inverse=True)
+        self.sums = {name: np.bincount(inverse, np.asarray(sums[name], dtype=float), minlength=len(self.keys))
+                     for name in SUMS}
+        self.sums['N'] = self.sums['N'].round().astype(np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        :param df: frame from data_prep.generate_piecewise_counts_df()
+        :return: PiecewiseCounts
+        """
+        keys = np.empty(len(df), dtype=KEY_DTYPE)
+        for name in KEY_DTYPE.names:
+            keys[name] = df[name].values
+        return cls(keys, {name: df[name].values for name in SUMS})
+
+    def merge(self, other):
+        """
+        :param other: PiecewiseCounts, e.g. for new drives
+        :return: PiecewiseCounts over both
+        """
+        return PiecewiseCounts(np.concatenate([self.keys, other.keys]),
+                               {name: np.concatenate([self.sums[name], other.sums[name]]) for name in SUMS})
+
+    def to_frame(self):
+        """
+        :return: DataFrame in the layout of data_prep.generate_piecewise_counts_df()
+        """
+        df = pd.DataFrame({name: self.keys[name].astype(np.bool_ if self.keys.dtype[name] == np.bool_ else np.int64)
+                           for name in KEY_DTYPE.names}, columns=list(KEY_DTYPE.names))
+        for name in SUMS:
+            df[name] = self.sums[name]
+        return df
+
+    def model_inputs(self, keys=MODEL_KEYS):
+        """
+        Arrays the fit scripts feed the models, over the distinct cells of keys.  Cells that differ only in other
+        keys are added up: deaths are Poisson given exposure, so the likelihood over the merged cells differs by a
+        constant and the posterior is unchanged.
+        :param keys: list of key names the model uses, including piece_i
+        :return: dict of arrays, plus num_obs and num_pieces
+        """
+        cells, inverse = np.unique(self.keys[list(keys)], return_inverse=True)
+        sums = {name: np.bincount(inverse, self.sums[name], minlength=len(cells)) for name in SUMS}
+        piece_i = cells['piece_i'].astype(int)
+        inputs = {'observed_exposures': sums['exposure_yards'],
+                  'observed_drive_deaths_ex_turnover': sums['deaths_ex_turnover'],
+                  'observed_drive_deaths_turnover': sums['deaths_turnover'],
+                  'num_obs': len(cells),
+                  'num_pieces': len(np.unique(piece_i)),
+                  'piece_i': piece_i,
+                  'red_zone': (piece_i == REDZONE_PIECE).astype(int),
+                  'not_red_zone': (piece_i != REDZONE_PIECE).astype(int)}
+        for key, name in [('i_attacking', 'attacking_team'),
+                          ('i_defending', 'defending_team'),
+                          ('defending_team_is_home', 'defending_team_is_home'),
+                          ('offense_losing_badly', 'offense_is_losing_badly'),
+                          ('offense_winning_greatly', 'offense_is_winning_greatly'),
+                          ('two_minute_drill', 'drive_is_two_minute_drill')]:
+            if key in keys:
+                inputs[name] = cells[key].astype(int)
+        return inputs
+
+    def baseline_hazards(self, deaths='deaths_turnover'):
+        """
+        Crude per-piece hazards, deaths per exposure yard, for starting values.
+        :param deaths: str, which deaths sum
+        :return: array with one entry per piece
+        """
+        piece_i = self.keys['piece_i'].astype(int)
+        return np.bincount(piece_i, self.sums[deaths]) / np.bincount(piece_i, self.sums['exposure_yards'])
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+# One fixed team numbering for every season, so traces fitted on one season line up with data from another.  Codes
+# are positions in the alpha-sorted 2014 slugs; relocated franchises keep their code through ALIASES.  The median
+# team used to assess team quality and strength of schedule comes right after the real teams.
+FRANCHISES = ['ARI', 'ATL', 'BAL', 'BUF', 'CAR', 'CHI', 'CIN', 'CLE', 'DAL', 'DEN', 'DET', 'GB', 'HOU', 'IND', 'JAX',
+              'KC', 'MIA', 'MIN', 'NE', 'NO', 'NYG', 'NYJ', 'OAK', 'PHI', 'PIT', 'SD', 'SEA', 'SF', 'STL', 'TB', 'TEN',
+              'WAS']
+ALIASES = {'JAC': 'JAX', 'LA': 'STL', 'LAR': 'STL', 'LAC': 'SD', 'LV': 'OAK'}
+MEDIAN_SLUG = 'MED'
+
+
+class TeamIndex(object):
+    """
+    Maps team slugs to integer codes.  Codes are looked up once per distinct slug and then broadcast, so indexing a
+    column costs a categorical conversion rather than a merge.
+    """
+
+    def __init__(self, slugs=FRANCHISES, aliases=ALIASES):
+        self.slugs = list(slugs)
+        self.aliases = dict(aliases)
+        self.median_i = len(self.slugs)
+
+    def codes(self, slugs):
+        """
+        :param slugs: Series (object or categorical) of team slugs
+        :return: int array of team codes, -1 for missing or unknown slugs
+        """
+        slugs = pd.Series(slugs).astype('category')
+        categories = pd.Series(slugs.cat.categories).replace(self.aliases)
+        category_codes = pd.Categorical(categories, categories=self.slugs).codes
+        return np.append(category_codes, -1)[slugs.cat.codes.values].astype(np.int64)
+
+    def add_codes(self, df, columns):
+        """
+        Add a team code column for each team slug column, dropping rows whose teams aren't in the index.
+        :param df: DataFrame
+        :param columns: list of (slug column, code column) pairs, e.g. [('hometeam', 'i_home')]
+        :return: df, with a fresh index
+        """
+        codes = [(i_column, self.codes(df[column])) for column, i_column in columns]
+        known = np.logical_and.reduce([c >= 0 for i_column, c in codes])
+        if not known.all():
+            print 'Dropping %s rows with teams not in the team index.' % (~known).sum()
+        df = df[known].reset_index(drop=True)
+        for i_column, c in codes:
+            df[i_column] = c[known]
+        return df
+
+    def check_frame(self, teams):
+        """
+        Make sure a teams frame (or some of its rows) is numbered by this index, as the fitted traces are.
+        :param teams: DataFrame with a slug column, indexed by team code
+        :raise ValueError: if any team's code isn't its code here
+        """
+        slugs = np.array(self.slugs + [MEDIAN_SLUG], dtype=object)
+        codes = np.asarray(teams.index)
+        known = (codes >= 0) & (codes < len(slugs)) if codes.dtype.kind in 'iu' else np.zeros(len(codes), bool)
+        known[known] = slugs[codes[known].astype(int)] == teams.slug.values[known]
+        if 'i' in teams:
+            known &= teams.i.values == codes
+        if not known.all():
+            raise ValueError('Teams not numbered by the team index: %s' % ', '.join(teams.slug[~known].astype(str)))
+
+    def frame(self, with_median=False):
+        """
+        :param with_median: bool, append the median team
+        :return: DataFrame with slug and i columns, indexed by i
+        """
+        slugs = self.slugs + [MEDIAN_SLUG] if with_median else self.slugs
+        return pd.DataFrame({'slug': slugs, 'i': np.arange(len(slugs))}, columns=['slug', 'i'])
+
+
+TEAM_INDEX = TeamIndex()
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+# Small synthetic play-by-play, in the layout of the nflsavant.com csv, for checks that run without the real data.
+# Games are a random walk of kickoffs, plays, penalties, turnovers, punts, field goals and touchdowns, with the
+# quarter, half and game end rows the data_prep chain looks for.
+
+TEAMS = ['ARI', 'ATL', 'BAL', 'BUF', 'CAR', 'CHI', 'CIN', 'CLE']
+QUARTER_ENDS = ['END QUARTER 1', 'END OF HALF', 'END QUARTER 3', 'END GAME']
+
+
+def play_by_play(num_games=12, seed=0, penalty_teams=None):
+    """
+    :param num_games: int
+    :param seed: int
+    :param penalty_teams: optional list of the only teams that commit penalties, e.g. so the PenaltyTeam column has
+                          fewer distinct slugs than OffenseTeam
+    :return: (play-by-play frame, plays of each game contiguous, game level frame with GameId, hometeam, awayteam)
+    """
+    random = np.random.RandomState(seed)
+    rows = []
+    games = []
+    for g in range(num_games):
+        game_id = 2014090700 + g
+        home, away = random.choice(TEAMS, 2, replace=False)
+        games.append({'GameId': game_id, 'hometeam': home, 'awayteam': away})
+        elapsed = 0.
+        quarter = 0
+        offense = home if random.rand() < .5 else away
+        kick_off = True
+
+        def add(description, play_type, offense, yardline, yards=0, down=1, **kwargs):
+            q = min(int(elapsed // 15) + 1, 4)
+            remaining = q * 15 - elapsed
+            defense = None if offense is None else (away if offense == home else home)
+            row = {'GameId': game_id, 'Quarter': q, 'Minute': int(remaining),
+                   'Second': int((remaining - int(remaining)) * 60), 'OffenseTeam': offense, 'DefenseTeam': defense,
+                   'Down': down, 'ToGo': 10, 'YardLine': yardline, 'SeriesFirstDown': 0, 'Description': description,
+                   'Yards': yards, 'PlayType': play_type, 'IsTouchdown': 0, 'IsFumble': 0, 'IsInterception': 0,
+                   'IsChallengeReversed': 0, 'IsTwoPointConversionSuccessful': 0, 'IsPenaltyAccepted': 0,
+                   'PenaltyTeam': None, 'PenaltyYards': 0}
+            row.update(kwargs)
+            rows.append(row)
+
+        while quarter < 4:
+            defense = away if offense == home else home
+            if kick_off:
+                add('KICKS OFF', 'KICK OFF', defense, 35)
+                elapsed += .1
+                yardline = random.randint(10, 40)
+            else:
+                # the defense takes over where the ball was lost
+                yardline = 100 - yardline
+            kick_off = True
+            while True:
+                elapsed += random.uniform(.2, .7)
+                if elapsed > 15 * (quarter + 1):
+                    elapsed = 15 * (quarter + 1) + .0001
+                    add(QUARTER_ENDS[quarter], None, None, 0)
+                    quarter += 1
+                    if quarter in (2, 4):
+                        break
+                r = random.rand()
+                down = random.randint(1, 5)
+                penalty_team = offense if r < .08 else defense
+                if r < .11 and (penalty_teams is None or penalty_team in penalty_teams):
+                    add('RUSH FOR 3. PENALTY ON %s, HOLDING' % penalty_team, 'RUSH', offense, yardline, 3, down,
+                        IsPenaltyAccepted=1, PenaltyTeam=penalty_team, PenaltyYards=10)
+                    yardline += 13 if penalty_team == defense else -7
+                elif r < .15:
+                    add('PASS INTERCEPTED', 'PASS', offense, yardline, 0, down, IsInterception=1)
+                    kick_off = False
+                    break
+                elif r < .17:
+                    add('FUMBLES, RECOVERED BY DEFENSE FOR TOUCHDOWN', 'RUSH', offense, yardline, 0, down,
+                        IsFumble=1, IsTouchdown=1)
+                    add('EXTRA POINT IS GOOD', 'EXTRA POINT', defense, 98)
+                    offense = defense  # the scoring team kicks off
+                    break
+                elif r < .18:
+                    add('SACKED IN END ZONE, SAFETY', 'SACK', offense, yardline, -3, down)
+                    break
+                elif r < .22 and yardline < 70:
+                    add('PUNTS 45 YARDS', 'PUNT', offense, yardline, 0, 4)
+                    break
+                elif r < .26 and yardline > 55:
+                    add('FIELD GOAL IS %s' % random.choice(['GOOD', 'GOOD', 'NO GOOD', 'BLOCKED']), 'FIELD GOAL',
+                        offense, yardline, 0, 4)
+                    break
+                else:
+                    gain = random.randint(-3, 15)
+                    if yardline + gain >= 100:
+                        add('RUSH FOR TOUCHDOWN', 'RUSH', offense, yardline, 100 - yardline, down, IsTouchdown=1)
+                        if random.rand() < .8:
+                            add('EXTRA POINT IS GOOD', 'EXTRA POINT', offense, 98)
+                        else:
+                            add('TWO-POINT CONVERSION ATTEMPT', 'TWO-POINT CONVERSION', offense, 98,
+                                IsTwoPointConversionSuccessful=random.randint(2))
+                        break
+                    add('PASS FOR %d' % gain, random.choice(['RUSH', 'PASS']), offense, yardline, gain, down)
+                    yardline += gain
+            offense = away if offense == home else home
+    return pd.DataFrame(rows), pd.DataFrame(games)
@@ -0,0 +1,86 @@
+import unittest
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from .. import data_prep
+from .fixtures import play_by_play
+
+
+class ColumnWiseTest(unittest.TestCase):
+    """
+    The column-wise yards and points match the row-wise references they replaced.
+    """
+
+    def setUp(self):
+        warnings.simplefilter('ignore')
+        df, df_game = play_by_play(num_games=12)
+        self.df = data_prep.enrich_play_level_df(df)
+
+    def mixed(self):
+        # the fixture's plays, plus every combination of penalty, touchdown and turnover the branches look at
+        df = self.df.copy()
+        random = np.random.RandomState(1)
+        df['IsPenaltyAccepted'] = random.randint(0, 2, len(df))
+        df['PenaltyTeam'] = np.where(random.rand(len(df)) < .5, df.OffenseTeam, df.DefenseTeam)
+        df['IsTouchdown'] = random.randint(0, 2, len(df))
+        df['is_turnover'] = random.rand(len(df)) < .2
+        df['is_no_play'] = random.rand(len(df)) < .2
+        return df
+
+    def test_offensive_yards(self):
+        for df in [self.df, self.mixed()]:
+            np.testing.assert_array_equal(data_prep.calculate_offensive_yards(df).values,
+                                          df.apply(data_prep.offensive_yards, axis=1).values)
+
+    def test_yardline_after_play(self):
+        for df in [self.df, self.mixed()]:
+            df['yards_offensive'] = data_prep.calculate_offensive_yards(df)
+            np.testing.assert_array_equal(data_prep.calculate_yardline_after_play(df).values,
+                                          df.apply(data_prep.yardline_after_play, axis=1).values)
+
+    def test_points_scored(self):
+        for df in [self.df, self.mixed()]:
+            expected = df.apply(data_prep.points_scored, axis=1)
+            points = data_prep.calculate_points_scored(df)
+            for c in ['points_o', 'points_d']:
+                np.testing.assert_array_equal(points[c].values, expected[c].values)
+
+    def test_fixture_scores(self):
+        # so the comparison above isn't over plays worth nothing
+        points = data_prep.calculate_points_scored(self.df)
+        self.assertTrue(set(points.points_o.unique()) >= {0, 1, 3, 6})
+        self.assertTrue(set(points.points_d.unique()) >= {0, 2, 6})
+
+
+class DescriptionTagsTest(unittest.TestCase):
+    """
+    The one-pass description flags match a str.contains() scan per tag, as the tags were first found, however many
+    workers parse them.
+    """
+
+    def test_matches_contains(self):
+        df, df_game = play_by_play(num_games=12)
+        edge_cases = ['', 'line1\nSAFETY', 'SAFETY\nline2', 'END OF\nQUARTER', 'END\nGAME', 'END OF THE HALF',
+                      'THE END GAME, END OF GAME', 'IS GOOD\r\nNO GOOD\n\nBLOCKED', 'NO PLAY. TIMEOUT #1',
+                      'TWO-MINUTE WARNING', 'END QUARTER 1\nEND OF HALF', 'safety', 'ENDQUARTER', 'BLOCKEDSAFETY',
+                      '(12:00) PASS TO 81 FOR 5 YARDS']
+        description = pd.concat([df.Description, pd.Series(edge_cases)], ignore_index=True)
+        flags = data_prep._classify_descriptions(description)
+        for tag, regex in data_prep.DESCRIPTION_TAGS:
+            np.testing.assert_array_equal((flags & data_prep.DESCRIPTION_FLAGS[tag]) != 0,
+                                          description.str.contains(regex).values, tag)
+
+    def test_workers_match_serial(self):
+        warnings.simplefilter('ignore')
+        df, df_game = play_by_play(num_games=12)
+        serial = data_prep.enrich_play_level_df(df)
+        parallel = data_prep.enrich_play_level_df(df, workers=3)
+        for column in ['description_flags', 'drive_id']:
+            np.testing.assert_array_equal(parallel[column].values, serial[column].values, column)
+        self.assertTrue(parallel.equals(serial))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+import numpy as np
+
+from ..fitting import metropolis_schedule
+from ..nuts import NUTS
+from ..traces import Traces
+
+SCALES = np.linspace(.5, 3, 10)
+
+
+def normal_logp_and_grad(x):
+    return -.5 * ((x / SCALES) ** 2).sum(), -x / SCALES ** 2
+
+
+class WarmStartTest(unittest.TestCase):
+    """
+    Warm starts size their warmup and burn-in from the run, not a fixed count.
+    """
+
+    def setUp(self):
+        self.random = np.random.RandomState(0)
+
+    def autoregressive(self, phi, draws=750, params=3):
+        x = np.zeros((draws, params))
+        for i in range(1, draws):
+            x[i] = phi * x[i - 1] + self.random.normal(size=params)
+        return x
+
+    def test_step_size_warmup_stops_once_settled(self):
+        for step_size in [.1, 10.]:
+            sampler = NUTS(normal_logp_and_grad, np.zeros(len(SCALES)), step_size, SCALES ** 2, seed=0)
+            warmup = len(sampler.warmup(1000, adapt_mass=False, until_settled=True))
+            self.assertLess(warmup, 500)
+            self.assertTrue(.5 < sampler.step_size < 1.5, sampler.step_size)
+
+    def test_metropolis_schedule(self):
+        cold = (100000, 70000, 40)
+        self.assertEqual(metropolis_schedule(None, ['a'], *cold), cold)
+        # still trending, so not converged
+        trending = Traces({'a': self.autoregressive(0) + np.linspace(0, 3, 750)[:, None]})
+        self.assertEqual(metropolis_schedule(trending, ['a'], *cold), cold)
+
+        independent = metropolis_schedule(Traces({'a': self.autoregressive(0)}), ['a'], *cold)
+        correlated = metropolis_schedule(Traces({'a': self.autoregressive(.5), 'b': self.autoregressive(0)[:, 0]}),
+                                         ['a', 'b'], *cold)
+        for iterations, burn, thin in [independent, correlated]:
+            self.assertEqual(thin, 40)
+            self.assertTrue(burn < cold[1] and iterations - burn <= cold[0] - cold[1])
+        self.assertLess(independent[0], correlated[0])
+        self.assertLess(independent[1], correlated[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
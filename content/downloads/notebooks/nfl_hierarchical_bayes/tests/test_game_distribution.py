@@ -0,0 +1,57 @@
+import unittest
+import warnings
+
+import numpy as np
+
+from .. import elapsed_time
+from ..game_distribution import cross_check
+from ..param_calculator import ParamCalculator
+from ..traces import Traces
+
+NUM_TEAMS = 4
+
+
+class CrossCheckTest(unittest.TestCase):
+    """
+    The exact margin distribution agrees with simulate_game_n_times() within Monte Carlo error.
+    """
+
+    def setUp(self):
+        warnings.simplefilter('ignore')
+        self.elapsed_time = elapsed_time.MINUTES_INTERCEPT, elapsed_time.MINUTES_PER_YARD, elapsed_time.READY_TO_USE
+        elapsed_time.MINUTES_INTERCEPT, elapsed_time.MINUTES_PER_YARD, elapsed_time.READY_TO_USE = .6, .045, True
+        # a single draw posterior, so both sides play the same params and only the simulation's noise is left
+        random = np.random.RandomState(0)
+
+        def teams(scale=.2):
+            return random.normal(0, scale, (1, NUM_TEAMS))
+
+        ex_turnover = Traces({'atts': teams(), 'atts_rz': teams(), 'defs': teams(), 'defs_rz': teams(),
+                              'home': teams(.1), 'baseline_hazards': np.array([[.03, .02, .05]]),
+                              'two_minute_drill': np.array([-.3]), 'offense_losing_badly': np.array([-.1]),
+                              'offense_winning_greatly': np.array([.1])})
+        turnover = Traces({'atts': teams(), 'defs': teams(), 'home': np.array([.05]),
+                           'baseline_hazards': np.array([[.01, .01, .012]]), 'two_minute_drill': np.array([.1]),
+                           'offense_losing_badly': np.array([.1]), 'offense_winning_greatly': np.array([-.1])})
+        self.pc = ParamCalculator(ex_turnover, turnover)
+        self.pc.i_home, self.pc.i_away = 1, 2
+
+    def tearDown(self):
+        elapsed_time.MINUTES_INTERCEPT, elapsed_time.MINUTES_PER_YARD, elapsed_time.READY_TO_USE = self.elapsed_time
+
+    def test_agrees_with_monte_carlo(self):
+        n_games = 20000
+        np.random.seed(0)
+        df = cross_check(self.pc, n_draws=1, n_games=n_games)
+        self.assertAlmostEqual(df.exact.home_win + df.exact.away_win, 1)
+        # four standard errors of the Monte Carlo side
+        sd = df.monte_carlo.sd_margin
+        for stat, standard_error in [('home_win', np.sqrt(.25 / n_games)),
+                                     ('tie_before_coin_flip', np.sqrt(df.monte_carlo.tie_before_coin_flip / n_games)),
+                                     ('mean_margin', sd / np.sqrt(n_games)),
+                                     ('sd_margin', sd / np.sqrt(2 * n_games))]:
+            self.assertLess(abs(df.exact[stat] - df.monte_carlo[stat]), 4 * standard_error, stat)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import gc
+import unittest
+import weakref
+
+import numpy as np
+
+from .. import param_calculator
+from ..param_calculator import load_trace
+from ..traces import Traces
+
+
+class LoadTraceTest(unittest.TestCase):
+    """
+    load_trace() reads each trace once per model, and lets go of it with the model.
+    """
+
+    def setUp(self):
+        self.atts = np.random.RandomState(0).normal(size=(50, 4))
+        self.model = Traces({'atts': self.atts})
+
+    def test_team_specific_cached_apart(self):
+        plain = load_trace(self.model, 'atts')
+        with_median = load_trace(self.model, 'atts', team_specific=True)
+        self.assertEqual(plain.shape, (50, 4))
+        self.assertEqual(with_median.shape, (50, 5))
+        np.testing.assert_array_equal(with_median[:, 4], np.median(self.atts, axis=1))
+        self.assertIs(load_trace(self.model, 'atts'), plain)
+        self.assertIs(load_trace(self.model, 'atts', team_specific=True), with_median)
+
+    def test_models_not_kept_alive(self):
+        load_trace(self.model, 'atts')
+        model = weakref.ref(self.model)
+        del self.model
+        gc.collect()
+        self.assertIsNone(model())
+        self.assertNotIn(model, list(param_calculator._TRACE_CACHE.keyrefs()))
+
+
+if __name__ == '__main__':
+    unittest.main()
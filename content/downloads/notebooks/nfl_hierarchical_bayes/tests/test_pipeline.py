@@ -0,0 +1,65 @@
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import warnings
+from StringIO import StringIO
+
+from .. import pipeline
+from ..team_index import TEAM_INDEX
+from .fixtures import play_by_play
+
+
+class PipelineCacheTest(unittest.TestCase):
+    """
+    The stage cache is invalidated by edits to what the stages call, and survives pruned side outputs.
+    """
+
+    def setUp(self):
+        warnings.simplefilter('ignore')
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        df, df_game = play_by_play(num_games=6)
+        self.pbp_file = os.path.join(self.directory, 'pbp.csv')
+        self.game_file = os.path.join(self.directory, 'games.xlsx')
+        df.to_csv(self.pbp_file, index=False)
+        df_game.to_excel(self.game_file, index=False)
+        self.stdout, sys.stdout = sys.stdout, StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.directory)
+
+    def run_pipeline(self):
+        return pipeline.run_pipeline(self.pbp_file, self.game_file, cache_dir=self.cache_dir)
+
+    def cached_files(self):
+        return sorted(glob.glob(os.path.join(self.cache_dir, '*.parquet')))
+
+    def test_helper_edits_recompute(self):
+        self.run_pipeline()
+        first = self.cached_files()
+        self.run_pipeline()
+        self.assertEqual(self.cached_files(), first)
+        aliases = TEAM_INDEX.aliases
+        TEAM_INDEX.aliases = dict(aliases, ARZ='ARI')
+        try:
+            self.run_pipeline()
+        finally:
+            TEAM_INDEX.aliases = aliases
+        self.assertEqual(len(self.cached_files()), 2 * len(first))
+
+    def test_pruned_results_recomputed(self):
+        expected = self.run_pipeline()
+        for path in glob.glob(os.path.join(self.cache_dir, 'index_with_team_indexes-teams-*')) + \
+                glob.glob(os.path.join(self.cache_dir, 'remove_end_of_half_and_kneel_drives-*')):
+            os.remove(path)
+        result = self.run_pipeline()
+        for output in ['teams', 'df_drive', 'df_counts']:
+            self.assertTrue(result[output].equals(expected[output]), output)
+
+
+if __name__ == '__main__':
+    unittest.main()
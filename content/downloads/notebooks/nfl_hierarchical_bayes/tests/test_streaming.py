@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+import pandas as pd
+
+from .. import data_prep, streaming
+from ..columnar import PLAY_BY_PLAY_DTYPES, TEAM_COLUMNS, unify_team_categories
+from .fixtures import play_by_play
+
+
+class StreamingTest(unittest.TestCase):
+    """
+    Streaming the csv a few games at a time gives what running the data_prep chain on all of it at once does.
+    """
+
+    def setUp(self):
+        warnings.simplefilter('ignore')
+        self.directory = tempfile.mkdtemp()
+        # penalties by two teams only, so each csv read infers fewer PenaltyTeam categories than OffenseTeam ones
+        df, self.df_game = play_by_play(num_games=12, penalty_teams=['ARI', 'ATL'])
+        self.pbp_file = os.path.join(self.directory, 'pbp.csv')
+        df.to_csv(self.pbp_file, index=False)
+        self.df = pd.read_csv(self.pbp_file, dtype=PLAY_BY_PLAY_DTYPES)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def chunks(self):
+        return streaming.iter_game_chunks(self.pbp_file, games_per_chunk=5, rows_per_read=300)
+
+    def test_chunks_hold_whole_games(self):
+        chunks = list(self.chunks())
+        self.assertGreater(len(chunks), 1)
+        game_ids = [set(chunk.GameId) for chunk in chunks]
+        self.assertEqual(sum(len(ids) for ids in game_ids), len(set.union(*game_ids)))
+        self.assertEqual(sum(len(chunk) for chunk in chunks), len(self.df))
+
+    def test_play_level_matches_one_shot(self):
+        one_shot = data_prep.enrich_play_level_df(unify_team_categories(self.df.copy(), self.team_columns()))
+        streamed = []
+        for chunk in self.chunks():
+            df = data_prep.enrich_play_level_df(unify_team_categories(chunk, self.team_columns()))
+            if streamed:
+                # number on from the last chunk, as prep_games() does
+                df['play_id'] += streamed[-1].play_id.max() + 1
+                df['drive_id'] += streamed[-1].drive_id.max() + 1
+            streamed.append(df)
+        streamed = pd.concat(streamed, ignore_index=True)
+        one_shot = one_shot.reset_index(drop=True)
+        self.assertEqual(list(one_shot.columns), list(streamed.columns))
+        for c in one_shot.columns:
+            if c in ('play_id', 'drive_id'):
+                # numbered per chunk; the same plays and drives, up to renumbering
+                self.assertTrue((one_shot[c].rank(method='dense') == streamed[c].rank(method='dense'))
+                                [one_shot[c].notnull()].all(), c)
+                self.assertTrue((one_shot[c].isnull() == streamed[c].isnull()).all(), c)
+            else:
+                self.assertTrue(one_shot[c].astype(object).fillna(-1).equals(streamed[c].astype(object).fillna(-1)),
+                                c)
+
+    def test_drives_match_one_shot(self):
+        one_shot = streaming.prep_games(self.df, self.df_game)[0].reset_index(drop=True)
+        next_ids = (0, 0)
+        streamed = []
+        for chunk in self.chunks():
+            df_drive, next_play_id, next_drive_id = streaming.prep_games(chunk, self.df_game, *next_ids)
+            next_ids = (next_play_id, next_drive_id)
+            streamed.append(df_drive)
+        streamed = pd.concat(streamed, ignore_index=True)
+        self.assertTrue(streamed.drive_id.is_unique)
+        self.assertEqual(list(one_shot.columns), list(streamed.columns))
+        for c in one_shot.columns.drop('drive_id'):
+            self.assertTrue(one_shot[c].astype(object).fillna(-1).equals(streamed[c].astype(object).fillna(-1)), c)
+
+    def team_columns(self):
+        return [c for c in TEAM_COLUMNS if c in self.df.columns]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+
+import pandas as pd
+
+from ..team_index import TEAM_INDEX
+
+
+class CheckFrameTest(unittest.TestCase):
+    """
+    Only teams numbered as the fitted traces are get past check_frame().
+    """
+
+    def test_index_frames_pass(self):
+        TEAM_INDEX.check_frame(TEAM_INDEX.frame())
+        TEAM_INDEX.check_frame(TEAM_INDEX.frame(with_median=True))
+        TEAM_INDEX.check_frame(TEAM_INDEX.frame().loc[[5, 9]])
+
+    def test_renumbered_teams_raise(self):
+        for teams in [TEAM_INDEX.frame().iloc[1:].reset_index(drop=True),
+                      TEAM_INDEX.frame().set_index('slug', drop=False),
+                      pd.DataFrame({'slug': ['ARI', 'ATL'], 'i': [0, 5]})]:
+            self.assertRaises(ValueError, TEAM_INDEX.check_frame, teams)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from .param_calculator import tack_on_median_team
+from .team_index import FRANCHISES
+
+# Fits that don't come from pymc hand back a Traces object, which ParamCalculator reads like a fitted pymc MCMC
+# object: getattr(traces, node_name).gettrace() is that node's trace, one row per draw.
+#
+# Any fit, pymc's included, can be saved as a trace store: a directory with one .npy file per node and an index.json
+# listing them (shape, dtype) along with the fit's info.  TraceStore opens a store lazily, memory-mapping each node's
+# file the first time it's read, so reads are zero-copy and processes reading the same store share its pages through
+# the OS page cache.  Team-specific nodes are also stored with the median team tacked on, as ParamCalculator uses
+# them, so that doesn't need a copy either.
+
+INDEX_FILE = 'index.json'
+MEDIAN_SUFFIX = '+median'
+SHARED_MEMORY_DIR = '/dev/shm'  # RAM-backed, where there is one
+
+
+class Trace(object):
+    """
+    One node's trace, standing in for a pymc node.
+    """
+
+    def __init__(self, values):
+        self.values = values
+
+    def gettrace(self):
+        return self.values
+
+
+class Traces(object):
+    """
+    Traces of every node of a fit, by name, plus whatever the fit wants to keep about how it was run (step size,
+    mass matrix, ...) in info.
+    """
+
+    def __init__(self, traces, info=None):
+        """
+        :param traces: dict of node name to array, one row per draw
+        :param info: dict
+        """
+        self.traces = {name: np.asarray(values) for name, values in traces.items()}
+        self.info = info or {}
+
+    def __getattr__(self, name):
+        traces = self.__dict__.get('traces', {})
+        if name in traces:
+            return Trace(traces[name])
+        raise AttributeError(name)
+
+    def __len__(self):
+        return len(next(iter(self.traces.values())))
+
+    def names(self):
+        return sorted(self.traces)
+
+    def save(self, directory, dtype=np.float64):
+        save_trace_store(self, directory, dtype=dtype)
+
+
+class TraceStore(object):
+    """
+    A saved trace store, read like Traces.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: str, as written by save_trace_store()
+        """
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.nodes = index['nodes']
+        self.info = index['info']
+        for key in index['info_arrays']:
+            self.info[key] = np.load(os.path.join(directory, 'info-%s.npy' % key), mmap_mode='r')
+        self._arrays = {}
+
+    def __getattr__(self, name):
+        if name in self.__dict__.get('nodes', {}):
+            return Trace(self.array(name))
+        raise AttributeError(name)
+
+    def __len__(self):
+        return self.nodes[self.names()[0]]['shape'][0]
+
+    def names(self):
+        return sorted(name for name in self.nodes if not name.endswith(MEDIAN_SUFFIX))
+
+    def array(self, name):
+        """
+        :param name: str node name
+        :return: read-only array of its trace, backed by the memory-mapped file
+        """
+        if name not in self._arrays:
+            memmap = np.load(os.path.join(self.directory, self.nodes[name]['file']), mmap_mode='r')
+            # as a plain ndarray, so arrays made from it (np.zeros_like, ...) aren't memmaps too
+            self._arrays[name] = memmap.view(np.ndarray)
+        return self._arrays[name]
+
+    def with_median_team(self, name):
+        """
+        :param name: str team-specific node name
+        :return: memory-mapped trace with the median team as an extra column, or None if not stored
+        """
+        return self.array(name + MEDIAN_SUFFIX) if name + MEDIAN_SUFFIX in self.nodes else None
+
+
+def save_trace_store(fit, directory, names=None, dtype=np.float64):
+    """
+    :param fit: Traces, TraceStore, or a fitted pymc MCMC object
+    :param directory: str, created if need be
+    :param names: list of node names to save, or None for every traced node
+    :param dtype: np.float64, or np.float32 for half the size
+    """
+    if names is None:
+        names = fit.names() if hasattr(fit, 'names') else fit.db.trace_names[-1]
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    nodes = {}
+    for name in names:
+        trace = np.asarray(getattr(fit, name).gettrace(), dtype=dtype)
+        arrays = [(name, trace)]
+        if trace.ndim == 2 and trace.shape[1] == len(FRANCHISES):
+            arrays.append((name + MEDIAN_SUFFIX, tack_on_median_team(trace).astype(dtype)))
+        for key, array in arrays:
+            np.save(os.path.join(directory, key + '.npy'), np.ascontiguousarray(array))
+            nodes[key] = {'file': key + '.npy', 'shape': array.shape, 'dtype': array.dtype.str}
+
+    info = dict(getattr(fit, 'info', None) or {})
+    info_arrays = [key for key, value in info.items() if np.ndim(value)]
+    for key in info_arrays:
+        np.save(os.path.join(directory, 'info-%s.npy' % key), np.asarray(info.pop(key)))
+    info = {key: value.item() if isinstance(value, np.generic) else value for key, value in info.items()}
+
+    # the index goes last, so a store is only readable once complete
+    index_path = os.path.join(directory, INDEX_FILE)
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump({'nodes': nodes, 'info': info, 'info_arrays': info_arrays}, f, indent=1, sort_keys=True)
+    os.rename(index_path + '.tmp', index_path)
+
+
+def share_posterior(ex_turnover, turnover, param_calculator, directory=None):
+    """
+    Publish the traces param_calculator reads from the two fits as trace stores, so parallel workers can map one
+    read-only copy instead of each loading their own.  Fits that are trace stores already are used as they are.
+    :param ex_turnover: fit of the ex-turnover model
+    :param turnover: fit of the turnover model
+    :param param_calculator: ParamCalculator class
+    :param directory: str, or None for a new temporary directory, in shared memory where there is any
+    :return: (ex_turnover TraceStore, turnover TraceStore, directory written to or None); the caller removes the
+             directory when done with it
+    """
+    if isinstance(ex_turnover, TraceStore) and isinstance(turnover, TraceStore):
+        return ex_turnover, turnover, None
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix='posterior-',
+                                     dir=SHARED_MEMORY_DIR if os.path.isdir(SHARED_MEMORY_DIR) else None)
+    stores = []
+    for name, fit, params in [('ex_turnover', ex_turnover, param_calculator.EX_TURNOVER_PARAMS),
+                              ('turnover', turnover, param_calculator.TURNOVER_PARAMS)]:
+        if not isinstance(fit, TraceStore):
+            save_trace_store(fit, os.path.join(directory, name), params)
+            fit = TraceStore(os.path.join(directory, name))
+        stores.append(fit)
+    return stores[0], stores[1], directory